@@ -0,0 +1,232 @@
+import sys
+import logging as log
+
+import argparse
+
+import os
+
+import json
+
+import multiprocessing
+
+sys.path.insert( 0 , os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' ) )
+from corpus_utils.synthetic import generate_note , sdoh_ann_lines , knowtator_xml , i2b2_xml , nlm_scrubbed_text
+from corpus_utils.sdoh import add_omop_types , loadTypeHandles , parse_ann_lines , build_omop_cas
+from corpus_utils.lazy import get_cassis , progress
+from corpus_utils.options import add_progressbar_arguments , add_workers_arguments , init_logging , init_progressbar
+
+#############################################
+## helper functions
+#############################################
+
+## The folders each format is written to (relative to --output-dir)
+format_folders = { 'brat' : [ 'brat' ] ,
+                   'omop' : [ 'omop' ] ,
+                   'knowtator' : [ 'knowtator' ] ,
+                   'i2b2' : [ 'i2b2' ] ,
+                   'nlm' : [ os.path.join( 'nlm' , 'raw' ) ,
+                             os.path.join( 'nlm' , 'nphi' ) ] }
+
+def initialize_arg_parser():
+    parser = argparse.ArgumentParser( description = """
+Generate a synthetic corpus shaped like the corpora these scripts
+convert:  n2c2 SDOH brat (.txt/.ann) pairs, OMOP CDM CAS XMI, Knowtator
+XML, i2b2 PHI XML, and NLM-Scrubber (.txt/.nphi.txt) pairs.
+""" )
+    parser.add_argument( '-v' , '--verbose' ,
+                         help = "print more information" ,
+                         action = "store_true" )
+
+    add_progressbar_arguments( parser )
+
+    parser.add_argument( '--output-dir' , default = None ,
+                         required = True ,
+                         dest = 'output_dir' ,
+                         help = "Directory to write the corpus to (one sub-folder per format)" )
+
+    parser.add_argument( '--docs' , default = 100 , type = int ,
+                         dest = 'docs' ,
+                         help = "Number of notes to generate" )
+
+    parser.add_argument( '--note-length' , default = 2000 , type = int ,
+                         dest = 'note_length' ,
+                         help = "Approximate length of each note in characters" )
+
+    parser.add_argument( '--sdoh-density' , default = 2.0 , type = float ,
+                         dest = 'sdoh_density' ,
+                         help = "SDOH events per 1,000 characters" )
+
+    parser.add_argument( '--phi-density' , default = 2.0 , type = float ,
+                         dest = 'phi_density' ,
+                         help = "PHI spans per 1,000 characters" )
+
+    parser.add_argument( '--seed' , default = 0 , type = int ,
+                         dest = 'seed' ,
+                         help = "Seed for the generator.  The same seed and settings always produce the same corpus" )
+
+    parser.add_argument( '--formats' , nargs = '+' ,
+                         default = sorted( format_folders ) ,
+                         choices = sorted( format_folders ) ,
+                         dest = 'formats' ,
+                         help = "Which formats to write (Default:  all of them)" )
+
+    add_workers_arguments( parser , 'generate notes' )
+    ##
+    return parser
+
+def get_arguments( command_line_args ):
+    parser = initialize_arg_parser()
+    args = parser.parse_args( command_line_args )
+    ##
+    return args
+
+def init_args( command_line_args = None ):
+    ##
+    args = get_arguments( command_line_args )
+    ## Set up logging
+    init_logging( args )
+    ## Configure progressbar peformance
+    init_progressbar( args )
+    ##
+    for corpus_format in args.formats:
+        for folder in format_folders[ corpus_format ]:
+            output_dir = os.path.join( args.output_dir , folder )
+            if( not os.path.exists( output_dir ) ):
+                try:
+                    os.makedirs( output_dir )
+                except OSError as e:
+                    log.error( 'OSError caught while trying to create output folder:  {}'.format( e ) )
+                except IOError as e:
+                    log.error( 'IOError caught while trying to create output folder:  {}'.format( e ) )
+    ##
+    return args
+
+
+#############################################
+## core functions
+#############################################
+
+def note_name( note_idx , note_total ):
+    ## Numeric names so the OMOP CDM note_id matches the filename
+    return( '{:0{}d}'.format( note_idx , max( 4 , len( str( note_total - 1 ) ) ) ) )
+
+
+def write_text( path , text ):
+    with open( path , 'w' ) as fp:
+        fp.write( text )
+
+
+def write_note( note_idx , args , typesystem , types ):
+    """Generate a single note and write it out in every requested
+    format.  Returns the length of the note in characters."""
+    name = note_name( note_idx , args.docs )
+    note = generate_note( name ,
+                          seed = args.seed ,
+                          note_length = args.note_length ,
+                          sdoh_density = args.sdoh_density ,
+                          phi_density = args.phi_density )
+    note_text = note.text
+    ann_lines = sdoh_ann_lines( note )
+    if( 'brat' in args.formats ):
+        write_text( os.path.join( args.output_dir , 'brat' , '{}.txt'.format( name ) ) ,
+                    note_text )
+        write_text( os.path.join( args.output_dir , 'brat' , '{}.ann'.format( name ) ) ,
+                    ''.join( [ '{}\n'.format( line ) for line in ann_lines ] ) )
+    if( 'omop' in args.formats ):
+        cas = get_cassis().Cas( typesystem = typesystem )
+        cas.sofa_string = note_text
+        cas.sofa_mime = "text/plain"
+        cas = build_omop_cas( cas , parse_ann_lines( ann_lines ) , types , note_idx )
+        cas.to_xmi( path = os.path.join( args.output_dir , 'omop' , '{}.xmi'.format( name ) ) ,
+                    pretty_print = True )
+    if( 'knowtator' in args.formats ):
+        write_text( os.path.join( args.output_dir , 'knowtator' , '{}.txt'.format( name ) ) ,
+                    note_text )
+        write_text( os.path.join( args.output_dir , 'knowtator' , '{}.knowtator.xml'.format( name ) ) ,
+                    knowtator_xml( note ) )
+    if( 'i2b2' in args.formats ):
+        write_text( os.path.join( args.output_dir , 'i2b2' , '{}.xml'.format( name ) ) ,
+                    i2b2_xml( note ) )
+    if( 'nlm' in args.formats ):
+        write_text( os.path.join( args.output_dir , 'nlm' , 'raw' , '{}.txt'.format( name ) ) ,
+                    note_text )
+        write_text( os.path.join( args.output_dir , 'nlm' , 'nphi' , '{}.nphi.txt'.format( name ) ) ,
+                    nlm_scrubbed_text( note ) )
+    return( len( note_text ) )
+
+
+def loadTypesystem( args ):
+    ## The OMOP CDM types don't depend on anything in the cTAKES type
+    ## system so a bare type system is enough to write them
+    typesystem = None
+    types = None
+    if( 'omop' in args.formats ):
+        typesystem = add_omop_types( get_cassis().TypeSystem() )
+        types = loadTypeHandles( typesystem , sharpn = False , omop = True )
+    return( typesystem , types )
+
+
+## Everything a worker needs is built once in the parent process and
+## inherited by forked workers.  Workers started any other way (e.g.,
+## spawn) rebuild it from args.
+shared_state = {}
+
+def init_worker( args ):
+    if( len( shared_state ) > 0 ):
+        return
+    typesystem , types = loadTypesystem( args )
+    shared_state.update( { 'args' : args ,
+                           'typesystem' : typesystem ,
+                           'types' : types } )
+
+
+def write_note_in_worker( note_idx ):
+    return( write_note( note_idx , **shared_state ) )
+
+
+def main( command_line_args = None ):
+    ##
+    args = init_args( command_line_args )
+    ##
+    typesystem , types = loadTypesystem( args )
+    shared_state.update( { 'args' : args ,
+                           'typesystem' : typesystem ,
+                           'types' : types } )
+    ##
+    total_chars = 0
+    if( args.workers > 1 ):
+        if( 'fork' in multiprocessing.get_all_start_methods() ):
+            mp_context = multiprocessing.get_context( 'fork' )
+        else:
+            mp_context = multiprocessing.get_context()
+        with mp_context.Pool( processes = args.workers ,
+                              initializer = init_worker ,
+                              initargs = ( args , ) ) as pool:
+            for note_chars in progress( pool.imap_unordered( write_note_in_worker ,
+                                                             range( args.docs ) ,
+                                                             chunksize = 64 ) ,
+                                        total = args.docs ,
+                                        file = args.progressbar_file ,
+                                        disable = args.progressbar_disabled ):
+                total_chars += note_chars
+    else:
+        for note_idx in progress( range( args.docs ) ,
+                                  file = args.progressbar_file ,
+                                  disable = args.progressbar_disabled ):
+            total_chars += write_note( note_idx , **shared_state )
+    ##
+    ## Record how the corpus was made so benchmark reports can say what
+    ## they were run against
+    with open( os.path.join( args.output_dir , 'corpus.json' ) , 'w' ) as fp:
+        json.dump( { 'docs' : args.docs ,
+                     'note_length' : args.note_length ,
+                     'sdoh_density' : args.sdoh_density ,
+                     'phi_density' : args.phi_density ,
+                     'seed' : args.seed ,
+                     'formats' : sorted( args.formats ) ,
+                     'total_chars' : total_chars } ,
+                   fp , indent = 2 , sort_keys = True )
+
+
+if __name__ == "__main__":
+    main()
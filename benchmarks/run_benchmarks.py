@@ -0,0 +1,448 @@
+import sys
+import logging as log
+
+import argparse
+
+import glob
+import os
+
+import json
+import time
+import platform
+import tempfile
+
+import multiprocessing
+import queue as queue_module
+
+try:
+    import resource
+except ImportError:
+    ## Not available on Windows
+    resource = None
+
+repo_root = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' )
+sys.path.insert( 0 , repo_root )
+from corpus_utils.brat import BratWriter
+from corpus_utils.sdoh import add_omop_types
+from corpus_utils.lazy import get_cassis
+from corpus_utils.profiling import Profiler
+from corpus_utils.options import init_logging
+from corpus_utils.cli import load_script , call_script
+
+#############################################
+## helper functions
+#############################################
+
+def initialize_arg_parser():
+    parser = argparse.ArgumentParser( description = """
+Time each stage of the converters against a corpus written by
+generate_synthetic_corpus.py and record docs/sec and peak RSS.
+""" )
+    parser.add_argument( '-v' , '--verbose' ,
+                         help = "print more information" ,
+                         action = "store_true" )
+
+    parser.add_argument( '--corpus-dir' , default = None ,
+                         required = True ,
+                         dest = 'corpus_dir' ,
+                         help = "Directory written by generate_synthetic_corpus.py" )
+
+    parser.add_argument( '--types-file' ,
+                         dest = 'typesFile' ,
+                         help = 'cTAKES type system XML (required for the sdoh-sharpn and omop-brat benchmarks)' )
+
+    parser.add_argument( '--benchmarks' , nargs = '+' ,
+                         default = None ,
+                         choices = sorted( benchmark_classes ) ,
+                         dest = 'benchmarks' ,
+                         help = "Which benchmarks to run (Default:  every benchmark the corpus and --types-file allow)" )
+
+    parser.add_argument( '--limit' , default = None , type = int ,
+                         dest = 'limit' ,
+                         help = "Only use the first N documents of the corpus" )
+
+    parser.add_argument( '--report-file' , default = None ,
+                         dest = 'report_file' ,
+                         help = "JSON file to write the full report to" )
+
+    parser.add_argument( '--baseline' , default = None ,
+                         dest = 'baseline_file' ,
+                         help = "Earlier --report-file to compare docs/sec and peak RSS against" )
+    ##
+    return parser
+
+def get_arguments( command_line_args ):
+    parser = initialize_arg_parser()
+    args = parser.parse_args( command_line_args )
+    ##
+    return args
+
+def init_args( command_line_args = None ):
+    ##
+    args = get_arguments( command_line_args )
+    ## Set up logging
+    init_logging( args )
+    ##
+    if( not os.path.exists( args.corpus_dir ) ):
+        log.error( 'The corpus dir does not exist:  {}'.format( args.corpus_dir ) )
+        exit( 1 )
+    if( args.benchmarks is None ):
+        args.benchmarks = []
+        for name in sorted( benchmark_classes ):
+            benchmark_class = benchmark_classes[ name ]
+            if( benchmark_class.needs_types_file and
+                args.typesFile is None ):
+                log.info( 'Skipping {} (needs --types-file)'.format( name ) )
+                continue
+            if( len( glob.glob( os.path.join( args.corpus_dir ,
+                                              benchmark_class.input_pattern ) ) ) == 0 ):
+                log.info( 'Skipping {} (no input files in the corpus)'.format( name ) )
+                continue
+            args.benchmarks.append( name )
+    else:
+        for name in args.benchmarks:
+            if( benchmark_classes[ name ].needs_types_file and
+                args.typesFile is None ):
+                log.error( 'The {} benchmark needs --types-file'.format( name ) )
+                exit( 1 )
+    ##
+    return args
+
+
+def peak_rss_kb():
+    if( resource is None ):
+        return( None )
+    peak_rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    ## macOS reports bytes and Linux reports kilobytes
+    if( sys.platform == 'darwin' ):
+        peak_rss = peak_rss // 1024
+    return( peak_rss )
+
+#############################################
+## benchmarks
+#############################################
+## Each benchmark lists its stages in order.  Benchmarks with a
+## convert() method hand each document to the converter script's own
+## per-file function, which marks its stages with the profiler the
+## benchmark was built with.  Otherwise every document is passed through the stage methods
+## one after another (each gets the return value of the one before,
+## starting with the input path).  Either way the time spent in each
+## stage is added up across the corpus.
+
+class SdohOmopBenchmark( object ):
+    """n2c2 SDOH brat to OMOP CDM CAS XMI"""
+    input_pattern = os.path.join( 'brat' , '*.ann' )
+    needs_types_file = False
+    stages = [ 'read' , 'parse' , 'build' , 'serialize' ]
+
+    def __init__( self , args , output_dir , profiler ):
+        self.converter = load_script( os.path.join( 'n2c2' ,
+                                                    'convert-n2c2-sdoh-brat-to-omop-cdm.py' ) )
+        brat_root = os.path.join( args.corpus_dir , 'brat' )
+        converter_args = self.converter.get_arguments( [ '--txt-root' , brat_root ,
+                                                         '--brat-root' , brat_root ,
+                                                         '--cas-root' , output_dir ] )
+        ## The OMOP CDM types are all the CAS needs so the cTAKES type
+        ## system is optional here
+        if( args.typesFile is None ):
+            typesystem = add_omop_types( get_cassis().TypeSystem() )
+        else:
+            converter_args.typesFile = args.typesFile
+            typesystem = self.converter.loadTypesystem( converter_args )
+        self.sinks = self.converter.init_sinks( converter_args , typesystem , profiler )
+        self.profiler = profiler
+        self.note_count = 0
+
+    def convert( self , ann_path ):
+        self.note_count += 1
+        self.converter.convert_file( ann_path ,
+                                     '{}.txt'.format( ann_path[ 0:-4 ] ) ,
+                                     self.converter.get_note_id( ann_path , self.note_count ) ,
+                                     self.sinks , self.profiler )
+
+
+class SdohSharpnBenchmark( object ):
+    """n2c2 SDOH brat to SHARPn (cTAKES) CAS XMI"""
+    input_pattern = os.path.join( 'brat' , '*.ann' )
+    needs_types_file = True
+    stages = [ 'read' , 'parse' , 'build' , 'serialize' ]
+
+    def __init__( self , args , output_dir , profiler ):
+        self.output_dir = output_dir
+        self.converter = load_script( os.path.join( 'n2c2' ,
+                                                    'convert-n2c2-sdoh-brat-to-sharpn.py' ) )
+        brat_root = os.path.join( args.corpus_dir , 'brat' )
+        converter_args = self.converter.get_arguments( [ '--types-file' , args.typesFile ,
+                                                         '--txt-root' , brat_root ,
+                                                         '--brat-root' , brat_root ,
+                                                         '--cas-root' , output_dir ] )
+        self.typesystem = self.converter.loadTypesystem( converter_args )
+        self.types = self.converter.loadTypeHandles( self.typesystem )
+        self.profiler = profiler
+
+    def convert( self , ann_path ):
+        self.converter.convert_file( ann_path ,
+                                     '{}.txt'.format( ann_path[ 0:-4 ] ) ,
+                                     os.path.join( self.output_dir ,
+                                                   '{}.xmi'.format( os.path.basename( ann_path )[ 0:-4 ] ) ) ,
+                                     self.typesystem , self.types , self.profiler )
+
+
+class OmopBratBenchmark( object ):
+    """OMOP CDM CAS XMI back to n2c2 SDOH brat"""
+    input_pattern = os.path.join( 'omop' , '*.xmi' )
+    needs_types_file = True
+    stages = [ 'read' , 'parse' , 'build' , 'serialize' ]
+
+    def __init__( self , args , output_dir , profiler ):
+        self.output_dir = output_dir
+        self.converter = load_script( os.path.join( 'n2c2' ,
+                                                    'convert-omop-cdm-to-n2c2-sdoh-brat.py' ) )
+        self.typesystem = self.converter.loadTypesystem( args )
+
+    def read( self , xmi_path ):
+        with open( xmi_path , 'rb' ) as fp:
+            return( xmi_path , fp.read() )
+
+    def parse( self , item ):
+        xmi_path , xmi_bytes = item
+        return( xmi_path , get_cassis().load_cas_from_xmi( xmi_bytes.decode( 'utf8' ) ,
+                                                           typesystem = self.typesystem ) )
+
+    def build( self , item ):
+        xmi_path , cas = item
+        plain_filename = os.path.basename( xmi_path )[ 0:-4 ]
+        attached_annots , brat = self.converter.process_cas_file( cas , plain_filename ,
+                                                                  20 , 20 , False )
+        return( plain_filename , attached_annots , brat )
+
+    def serialize( self , item ):
+        plain_filename , attached_annots , brat = item
+        brat_writer = BratWriter( os.path.join( self.output_dir ,
+                                                '{}.ann'.format( plain_filename ) ) )
+        for annot_id , body in self.converter.brat_records( attached_annots , brat ):
+            brat_writer.add_line( annot_id , body )
+        brat_writer.flush()
+
+
+class KnowtatorBenchmark( object ):
+    """Knowtator XML to CAS XMI and brat"""
+    input_pattern = os.path.join( 'knowtator' , '*.knowtator.xml' )
+    needs_types_file = False
+    stages = [ 'read' , 'parse' , 'build' , 'write' , 'serialize' ]
+
+    def __init__( self , args , output_dir , profiler ):
+        self.converter = load_script( os.path.join( 'knowtator' , 'knowtator2cas.py' ) )
+        converter_args = self.converter.get_arguments( [ '--txt-root' , os.path.join( args.corpus_dir , 'knowtator' ) ,
+                                                         '--knowtator-root' , os.path.join( args.corpus_dir , 'knowtator' ) ,
+                                                         '--cas-root' , output_dir ,
+                                                         '--brat-root' , output_dir ] )
+        typesystem , defaultType = self.converter.loadTypesystem( converter_args )
+        ontology_mapping , src_type , tgt_type = self.converter.loadOntologyMapping( converter_args )
+        self.state = { 'args' : converter_args ,
+                       'typesystem' : typesystem ,
+                       'defaultType' : defaultType ,
+                       'ontology_mapping' : ontology_mapping ,
+                       'src_type' : src_type ,
+                       'tgt_type' : tgt_type }
+        self.profiler = profiler
+
+    def convert( self , xml_path ):
+        self.converter.convert_file( xml_path , profiler = self.profiler , **self.state )
+
+
+class I2b2DatesBenchmark( object ):
+    """Surrogate years for i2b2 PHI dates"""
+    input_pattern = os.path.join( 'i2b2' , '*.xml' )
+    needs_types_file = False
+    stages = [ 'parse' , 'build' , 'serialize' ]
+
+    def __init__( self , args , output_dir , profiler ):
+        self.output_dir = output_dir
+        self.converter = load_script( os.path.join( 'i2b2' , 'normalize_phi_dates.py' ) )
+        self.shifter = self.converter.DateShifter( seed = 'benchmark' )
+        self.profiler = profiler
+
+    def convert( self , xml_path ):
+        self.converter.normalize_file( xml_path ,
+                                       os.path.join( self.output_dir ,
+                                                     os.path.basename( xml_path ) ) ,
+                                       self.shifter ,
+                                       profiler = self.profiler )
+
+
+class NlmBenchmark( object ):
+    """NLM-Scrubber output back to brat"""
+    input_pattern = os.path.join( 'nlm' , 'raw' , '*.txt' )
+    needs_types_file = False
+    stages = [ 'read' , 'parse' , 'build' , 'serialize' ]
+
+    def __init__( self , args , output_dir , profiler ):
+        self.output_dir = output_dir
+        self.nphi_dir = os.path.join( args.corpus_dir , 'nlm' , 'nphi' )
+        self.converter = load_script( os.path.join( 'nlm-scrubber' , 'nlm2brat.py' ) )
+
+    def read( self , raw_path ):
+        file_root = os.path.basename( raw_path )[ 0:-4 ]
+        return( file_root ,
+                self.converter.load_pair( raw_path ,
+                                          os.path.join( self.nphi_dir ,
+                                                        '{}.nphi.txt'.format( file_root ) ) ) )
+
+    def parse( self , item ):
+        file_root , ( raw_txt , proc_txt , max_raw_pos , max_proc_pos ) = item
+        annot_list = self.converter.find_tag_groups( proc_txt , max_proc_pos )
+        return( file_root , raw_txt , proc_txt , max_raw_pos , max_proc_pos , annot_list )
+
+    def build( self , item ):
+        file_root , raw_txt , proc_txt , max_raw_pos , max_proc_pos , annot_list = item
+        return( file_root , self.converter.align_chunks( raw_txt , proc_txt , annot_list ,
+                                                         max_raw_pos , max_proc_pos ) )
+
+    def serialize( self , item ):
+        file_root , annot_list = item
+        self.converter.write_annotations( annot_list ,
+                                          os.path.join( self.output_dir ,
+                                                        '{}.ann'.format( file_root ) ) )
+
+
+benchmark_classes = { 'sdoh-omop' : SdohOmopBenchmark ,
+                      'sdoh-sharpn' : SdohSharpnBenchmark ,
+                      'omop-brat' : OmopBratBenchmark ,
+                      'knowtator' : KnowtatorBenchmark ,
+                      'i2b2-dates' : I2b2DatesBenchmark ,
+                      'nlm2brat' : NlmBenchmark }
+
+#############################################
+## core functions
+#############################################
+
+def run_benchmark( name , args ):
+    """Run a single benchmark over the corpus and return its timings"""
+    benchmark_class = benchmark_classes[ name ]
+    file_list = sorted( glob.glob( os.path.join( args.corpus_dir ,
+                                                 benchmark_class.input_pattern ) ) )
+    if( args.limit is not None ):
+        file_list = file_list[ 0:args.limit ]
+    input_bytes = sum( [ os.path.getsize( path ) for path in file_list ] )
+    ## The profiler is only used to add up the stage timings.  No report
+    ## is written.
+    profiler = Profiler( None )
+    with tempfile.TemporaryDirectory( prefix = 'corpus-utils-benchmark-' ) as output_dir:
+        start = time.perf_counter()
+        benchmark = benchmark_class( args , output_dir , profiler )
+        setup_seconds = time.perf_counter() - start
+        startup_rss_kb = peak_rss_kb()
+        for path in file_list:
+            if( hasattr( benchmark , 'convert' ) ):
+                benchmark.convert( path )
+                continue
+            item = path
+            for stage in benchmark_class.stages:
+                with profiler.stage( stage , path ):
+                    item = getattr( benchmark , stage )( item )
+    stage_seconds = dict( [ ( stage , profiler.stages[ stage ][ 'seconds' ]
+                              if stage in profiler.stages else 0.0 )
+                            for stage in benchmark_class.stages ] )
+    total_seconds = sum( stage_seconds.values() )
+    return( { 'benchmark' : name ,
+              'docs' : len( file_list ) ,
+              'input_bytes' : input_bytes ,
+              'setup_seconds' : setup_seconds ,
+              'stage_seconds' : stage_seconds ,
+              'total_seconds' : total_seconds ,
+              'docs_per_sec' : len( file_list ) / total_seconds if total_seconds > 0 else None ,
+              'startup_rss_kb' : startup_rss_kb ,
+              'peak_rss_kb' : peak_rss_kb() } )
+
+
+def run_benchmark_in_child( name , args , queue ):
+    queue.put( run_benchmark( name , args ) )
+
+
+def run_isolated( name , args ):
+    """Run a benchmark in a fresh interpreter so its peak RSS isn't
+    inflated by whatever ran before it"""
+    mp_context = multiprocessing.get_context( 'spawn' )
+    queue = mp_context.Queue()
+    ## This script may have been loaded by path (e.g., by corpus-utils)
+    ## so the child loads it again the same way
+    process = mp_context.Process( target = call_script ,
+                                  args = ( os.path.join( 'benchmarks' , 'run_benchmarks.py' ) ,
+                                           'run_benchmark_in_child' ,
+                                           name , args , queue ) )
+    process.start()
+    ## Don't wait forever on a child that died before reporting back
+    while( True ):
+        try:
+            result = queue.get( timeout = 1 )
+            break
+        except queue_module.Empty:
+            if( not process.is_alive() ):
+                raise RuntimeError( 'The {} benchmark exited without a result (exit code {})'.format( name ,
+                                                                                                     process.exitcode ) )
+    process.join()
+    return( result )
+
+
+def print_summary( results , baseline = None ):
+    baseline_results = {}
+    if( baseline is not None ):
+        for result in baseline[ 'results' ]:
+            baseline_results[ result[ 'benchmark' ] ] = result
+    print( '{}\t{}\t{}\t{}\t{}'.format( 'Benchmark' , 'Docs' , 'Docs/sec' ,
+                                        'Peak RSS (MB)' , 'Stage seconds' ) )
+    for result in results:
+        peak_rss = result[ 'peak_rss_kb' ]
+        line = '{}\t{}\t{:.1f}\t{}\t{}'.format( result[ 'benchmark' ] ,
+                                                 result[ 'docs' ] ,
+                                                 result[ 'docs_per_sec' ] or 0 ,
+                                                 '-' if peak_rss is None else '{:.1f}'.format( peak_rss / 1024.0 ) ,
+                                                 ' '.join( [ '{}={:.3f}'.format( stage , seconds )
+                                                             for stage , seconds in result[ 'stage_seconds' ].items() ] ) )
+        old_result = baseline_results.get( result[ 'benchmark' ] )
+        if( old_result is not None and
+            old_result[ 'docs_per_sec' ] and
+            result[ 'docs_per_sec' ] ):
+            line += '\t({:+.1f}% docs/sec'.format( 100.0 * ( result[ 'docs_per_sec' ] /
+                                                             old_result[ 'docs_per_sec' ] - 1 ) )
+            if( old_result[ 'peak_rss_kb' ] and peak_rss ):
+                line += ', {:+.1f}% peak RSS'.format( 100.0 * ( peak_rss /
+                                                                old_result[ 'peak_rss_kb' ] - 1 ) )
+            line += ')'
+        print( line )
+
+
+def main( command_line_args = None ):
+    ##
+    args = init_args( command_line_args )
+    ##
+    corpus_info = None
+    corpus_json = os.path.join( args.corpus_dir , 'corpus.json' )
+    if( os.path.exists( corpus_json ) ):
+        with open( corpus_json , 'r' ) as fp:
+            corpus_info = json.load( fp )
+    baseline = None
+    if( args.baseline_file is not None ):
+        with open( args.baseline_file , 'r' ) as fp:
+            baseline = json.load( fp )
+    ##
+    results = []
+    for name in args.benchmarks:
+        log.info( 'Running {}'.format( name ) )
+        results.append( run_isolated( name , args ) )
+    ##
+    print_summary( results , baseline )
+    if( args.report_file is not None ):
+        with open( args.report_file , 'w' ) as fp:
+            json.dump( { 'corpus' : corpus_info ,
+                         'limit' : args.limit ,
+                         'python' : platform.python_version() ,
+                         'platform' : platform.platform() ,
+                         'timestamp' : time.strftime( '%Y-%m-%dT%H:%M:%S%z' ) ,
+                         'results' : results } ,
+                       fp , indent = 2 )
+
+
+if __name__ == "__main__":
+    main()
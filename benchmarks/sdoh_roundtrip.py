@@ -0,0 +1,415 @@
+import sys
+import logging as log
+
+import argparse
+
+import glob
+import os
+
+import itertools
+import json
+import time
+
+import multiprocessing
+
+sys.path.insert( 0 , os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' ) )
+from corpus_utils.brat import ann_record_sets
+from corpus_utils.sdoh import add_omop_types , loadTypeHandles , parse_ann_lines , get_note_id , build_omop_cas
+from corpus_utils.lazy import get_cassis , load_typesystem , progress
+from corpus_utils.options import add_progressbar_arguments , add_workers_arguments , init_logging , init_progressbar
+from corpus_utils.cli import load_script
+
+#############################################
+## helper functions
+#############################################
+
+stages = [ 'read' , 'parse' , 'build' , 'serialize' , 'deserialize' ,
+           'convert' , 'compare' ]
+
+def initialize_arg_parser():
+    parser = argparse.ArgumentParser( description = """
+Convert every note of an n2c2 SDOH brat corpus to OMOP CDM CAS XMI and
+back again in memory and report how much of the original annotation
+survives (per label) and how long each stage takes.  Give several
+--left-window, --right-window, or --allow-identity values to compare
+every combination of them in one pass over the corpus.
+""" )
+    parser.add_argument( '-v' , '--verbose' ,
+                         help = "print more information" ,
+                         action = "store_true" )
+
+    add_progressbar_arguments( parser )
+
+    parser.add_argument( '--types-file' ,
+                         required = True ,
+                         dest = 'typesFile' ,
+                         help = 'cTAKES type system XML (needed to read the OMOP CDM CAS XMI back in)' )
+
+    parser.add_argument( '--txt-root' , default = None ,
+                         required = True ,
+                         dest = "txt_root",
+                         help = "Directory containing input corpus in text format" )
+
+    parser.add_argument( '--brat-root' , default = None ,
+                         required = True ,
+                         dest = "brat_root",
+                         help = "Directory for input corpus in brat format (.ann files)" )
+
+    parser.add_argument( '--no-relations' ,
+                         dest = 'no_relations' ,
+                         help = "Do not create any OMOP CDM relation arcs (so events are rebuilt from the windows alone)" ,
+                         action = "store_true" )
+
+    parser.add_argument( '--left-window' , nargs = '+' , default = [ 20 ] , type = int ,
+                         dest = 'left_windows' ,
+                         help = "Left window(s) to convert back with" )
+
+    parser.add_argument( '--right-window' , nargs = '+' , default = [ 20 ] , type = int ,
+                         dest = 'right_windows' ,
+                         help = "Right window(s) to convert back with" )
+
+    parser.add_argument( '--allow-identity' , default = 'no' ,
+                         choices = [ 'no' , 'yes' , 'both' ] ,
+                         dest = 'allow_identity' ,
+                         help = "Convert back without, with, or both without and with --allow-identity" )
+
+    parser.add_argument( '--limit' , default = None , type = int ,
+                         dest = 'limit' ,
+                         help = "Only use the first N documents of the corpus" )
+
+    parser.add_argument( '--report-file' , default = None ,
+                         dest = 'report_file' ,
+                         help = "JSON file to write the full report (every setting and label) to" )
+
+    add_workers_arguments( parser , 'round-trip notes' )
+    ##
+    return parser
+
+def get_arguments( command_line_args ):
+    parser = initialize_arg_parser()
+    args = parser.parse_args( command_line_args )
+    ##
+    return args
+
+def init_args( command_line_args = None ):
+    ##
+    args = get_arguments( command_line_args )
+    ## Set up logging
+    init_logging( args )
+    ## Configure progressbar peformance
+    init_progressbar( args )
+    ##
+    args.settings = []
+    for left_window , right_window , allow_identity in itertools.product( args.left_windows ,
+                                                                          args.right_windows ,
+                                                                          { 'no' : [ False ] ,
+                                                                            'yes' : [ True ] ,
+                                                                            'both' : [ False , True ] }[ args.allow_identity ] ):
+        args.settings.append( ( left_window , right_window , allow_identity ) )
+    ##
+    return args
+
+
+def setting_name( setting ):
+    left_window , right_window , allow_identity = setting
+    return( 'left={} right={} identity={}'.format( left_window , right_window ,
+                                                    'yes' if allow_identity else 'no' ) )
+
+
+def loadTypesystems( args ):
+    """The type system the forward converter builds CASes with and the
+    one the reverse converter reads them back with"""
+    omop_typesystem = add_omop_types( load_typesystem( args.typesFile ) )
+    types = loadTypeHandles( omop_typesystem , sharpn = False , omop = True )
+    reverse_converter = load_script( os.path.join( 'n2c2' ,
+                                                   'convert-omop-cdm-to-n2c2-sdoh-brat.py' ) )
+    brat_typesystem = reverse_converter.loadTypesystem( args )
+    return( omop_typesystem , types , reverse_converter , brat_typesystem )
+
+#############################################
+## core functions
+#############################################
+
+def event_arguments( events ):
+    """Split E keys into one ( argument label , event type , trigger key ,
+    argument key ) key per argument so events that only differ in some
+    of their arguments still get partial credit"""
+    return( set( [ ( argument[ 0 ] , event_type , trigger , argument )
+                   for event_type , trigger , arguments in events
+                   for argument in arguments ] ) )
+
+
+def compare_record_sets( original , roundtrip , counts ):
+    """Add the number of original, round-tripped, and matching records
+    of every ( record type , label ) to counts.  Event arguments are
+    counted as record type 'Arg' and labelled by the label of the
+    argument's T record (e.g., StatusTime rather than Status)."""
+    original[ 'Arg' ] = event_arguments( original[ 'E' ] )
+    roundtrip[ 'Arg' ] = event_arguments( roundtrip[ 'E' ] )
+    for record_type in [ 'T' , 'E' , 'Arg' , 'A' ]:
+        for keys , column in [ ( original[ record_type ] , 1 ) ,
+                               ( roundtrip[ record_type ] , 2 ) ,
+                               ( original[ record_type ] & roundtrip[ record_type ] , 0 ) ]:
+            for key in keys:
+                label = ( record_type , key[ 0 ] )
+                if( label not in counts ):
+                    counts[ label ] = [ 0 , 0 , 0 ]
+                counts[ label ][ column ] += 1
+    return( counts )
+
+
+def check_identity( ann_lines ):
+    """Compare the records of a note with themselves.  Every T, E, and A
+    record has to match or round-trip scores mean nothing."""
+    counts = compare_record_sets( ann_record_sets( ann_lines ) ,
+                                  ann_record_sets( ann_lines ) , {} )
+    return( [ label for label in sorted( counts )
+              if( counts[ label ][ 0 ] != counts[ label ][ 1 ] ) ] )
+
+
+def roundtrip_file( plain_filename , note_count , args ,
+                    omop_typesystem , types ,
+                    reverse_converter , brat_typesystem ):
+    """Round-trip a single note through every setting.  Returns the
+    record counts (see compare_record_sets) of each setting and the
+    seconds spent in each stage."""
+    seconds = dict( [ ( stage , 0.0 ) for stage in stages ] )
+    start = time.perf_counter()
+    with open( os.path.join( args.txt_root ,
+                             '{}.txt'.format( plain_filename ) ) , 'r' ) as fp:
+        note_contents = fp.read().strip()
+    with open( os.path.join( args.brat_root ,
+                             '{}.ann'.format( plain_filename ) ) , 'r' ) as fp:
+        ann_lines = fp.read().splitlines()
+    seconds[ 'read' ] += time.perf_counter() - start
+    ##
+    start = time.perf_counter()
+    doc = parse_ann_lines( ann_lines )
+    original = ann_record_sets( ann_lines )
+    seconds[ 'parse' ] += time.perf_counter() - start
+    ##
+    start = time.perf_counter()
+    cas = get_cassis().Cas( typesystem = omop_typesystem )
+    cas.sofa_string = note_contents
+    cas.sofa_mime = "text/plain"
+    cas = build_omop_cas( cas , doc , types ,
+                          get_note_id( '{}.ann'.format( plain_filename ) , note_count ) ,
+                          skip_relations = args.no_relations )
+    seconds[ 'build' ] += time.perf_counter() - start
+    ##
+    ## The XMI round trip isn't optional:  reading the XMI back in is
+    ## what turns the string ids of the new CAS into integers
+    start = time.perf_counter()
+    xmi = cas.to_xmi( pretty_print = True )
+    seconds[ 'serialize' ] += time.perf_counter() - start
+    start = time.perf_counter()
+    cas = get_cassis().load_cas_from_xmi( xmi , typesystem = brat_typesystem )
+    seconds[ 'deserialize' ] += time.perf_counter() - start
+    ##
+    setting_counts = []
+    for left_window , right_window , allow_identity in args.settings:
+        start = time.perf_counter()
+        attached_annots , brat = reverse_converter.process_cas_file( cas , plain_filename ,
+                                                                     left_window ,
+                                                                     right_window ,
+                                                                     allow_identity )
+        roundtrip_lines = [ '{}\t{}'.format( annot_id , body )
+                            for annot_id , body in reverse_converter.brat_records( attached_annots , brat ) ]
+        seconds[ 'convert' ] += time.perf_counter() - start
+        start = time.perf_counter()
+        setting_counts.append( compare_record_sets( original ,
+                                                    ann_record_sets( roundtrip_lines ) ,
+                                                    {} ) )
+        seconds[ 'compare' ] += time.perf_counter() - start
+    return( setting_counts , seconds )
+
+
+## Everything a worker needs is built once in the parent process and
+## inherited by forked workers.  Workers started any other way (e.g.,
+## spawn) rebuild it from args.
+shared_state = {}
+
+def init_worker( args ):
+    if( len( shared_state ) > 0 ):
+        return
+    omop_typesystem , types , reverse_converter , brat_typesystem = loadTypesystems( args )
+    shared_state.update( { 'args' : args ,
+                           'omop_typesystem' : omop_typesystem ,
+                           'types' : types ,
+                           'reverse_converter' : reverse_converter ,
+                           'brat_typesystem' : brat_typesystem } )
+
+
+def roundtrip_file_in_worker( job ):
+    plain_filename , note_count = job
+    return( roundtrip_file( plain_filename , note_count , **shared_state ) )
+
+
+def scores( matched , original , roundtrip ):
+    ## Recall is the share of the original records that survived and
+    ## precision the share of the round-tripped records that were in
+    ## the original
+    recall = matched / original if original > 0 else None
+    precision = matched / roundtrip if roundtrip > 0 else None
+    f1 = None
+    if( recall is not None and precision is not None ):
+        f1 = 2 * matched / ( original + roundtrip )
+    return( { 'original' : original ,
+              'roundtrip' : roundtrip ,
+              'matched' : matched ,
+              'recall' : recall ,
+              'precision' : precision ,
+              'f1' : f1 } )
+
+
+def summarize_setting( setting , counts ):
+    labels = []
+    totals = {}
+    for record_type , label in sorted( counts ):
+        matched , original , roundtrip = counts[ ( record_type , label ) ]
+        labels.append( dict( [ ( 'record_type' , record_type ) ,
+                               ( 'label' , label ) ] +
+                             list( scores( matched , original , roundtrip ).items() ) ) )
+        ## Arguments are already counted once as part of their event
+        for total_key in [ record_type ] + ( [] if record_type == 'Arg' else [ 'all' ] ):
+            if( total_key not in totals ):
+                totals[ total_key ] = [ 0 , 0 , 0 ]
+            for column in range( 3 ):
+                totals[ total_key ][ column ] += counts[ ( record_type , label ) ][ column ]
+    return( { 'left_window' : setting[ 0 ] ,
+              'right_window' : setting[ 1 ] ,
+              'allow_identity' : setting[ 2 ] ,
+              'labels' : labels ,
+              'totals' : dict( [ ( total_key , scores( *totals[ total_key ] ) )
+                                 for total_key in totals ] ) } )
+
+
+def format_score( value ):
+    return( '-' if value is None else '{:.3f}'.format( value ) )
+
+
+def print_summary( summaries , stage_seconds , docs , wall_seconds ):
+    print( '{}\t{}\t{}\t{}\t{}\t{}'.format( 'Setting' , 'T F1' , 'E F1' , 'Arg F1' , 'A F1' , 'All F1' ) )
+    for summary in summaries:
+        totals = summary[ 'totals' ]
+        print( '{}\t{}'.format( setting_name( ( summary[ 'left_window' ] ,
+                                                summary[ 'right_window' ] ,
+                                                summary[ 'allow_identity' ] ) ) ,
+                                '\t'.join( [ format_score( totals[ total_key ][ 'f1' ] if total_key in totals else None )
+                                             for total_key in [ 'T' , 'E' , 'Arg' , 'A' , 'all' ] ] ) ) )
+    ## Break the best setting down by label
+    best = max( summaries ,
+                key = lambda summary : summary[ 'totals' ][ 'all' ][ 'f1' ] or 0 if 'all' in summary[ 'totals' ] else 0 )
+    print( '' )
+    print( 'Per label ({})'.format( setting_name( ( best[ 'left_window' ] ,
+                                                    best[ 'right_window' ] ,
+                                                    best[ 'allow_identity' ] ) ) ) )
+    print( '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}'.format( 'Record' , 'Label' , 'Original' , 'Round-trip' ,
+                                                    'Matched' , 'Recall' , 'Precision' , 'F1' ) )
+    for label in best[ 'labels' ]:
+        print( '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}'.format( label[ 'record_type' ] , label[ 'label' ] ,
+                                                        label[ 'original' ] , label[ 'roundtrip' ] ,
+                                                        label[ 'matched' ] ,
+                                                        format_score( label[ 'recall' ] ) ,
+                                                        format_score( label[ 'precision' ] ) ,
+                                                        format_score( label[ 'f1' ] ) ) )
+    print( '' )
+    total_seconds = sum( stage_seconds.values() )
+    print( '{}\t{}\t{}'.format( 'Stage' , 'Seconds' , 'Share' ) )
+    for stage in stages:
+        print( '{}\t{:.3f}\t{}'.format( stage , stage_seconds[ stage ] ,
+                                        format_score( stage_seconds[ stage ] / total_seconds if total_seconds > 0 else None ) ) )
+    print( '{} notes in {:.2f} seconds ({:.1f} notes/sec)'.format( docs , wall_seconds ,
+                                                                   docs / wall_seconds if wall_seconds > 0 else 0 ) )
+
+
+def main( command_line_args = None ):
+    ##
+    args = init_args( command_line_args )
+    ##
+    start = time.perf_counter()
+    omop_typesystem , types , reverse_converter , brat_typesystem = loadTypesystems( args )
+    shared_state.update( { 'args' : args ,
+                           'omop_typesystem' : omop_typesystem ,
+                           'types' : types ,
+                           'reverse_converter' : reverse_converter ,
+                           'brat_typesystem' : brat_typesystem } )
+    ##
+    jobs = []
+    for brat_path in sorted( glob.glob( os.path.join( args.brat_root , '*.ann' ) ) ):
+        plain_filename = os.path.basename( brat_path )[ 0:-4 ]
+        if( not os.path.exists( os.path.join( args.txt_root ,
+                                              '{}.txt'.format( plain_filename ) ) ) ):
+            log.warning( 'No matching txt file found for \'{}\''.format( os.path.basename( brat_path ) ) )
+            continue
+        jobs.append( ( plain_filename , len( jobs ) ) )
+    if( args.limit is not None ):
+        jobs = jobs[ 0:args.limit ]
+    if( len( jobs ) > 0 ):
+        with open( os.path.join( args.brat_root ,
+                                 '{}.ann'.format( jobs[ 0 ][ 0 ] ) ) , 'r' ) as fp:
+            mismatched = check_identity( fp.read().splitlines() )
+        if( len( mismatched ) > 0 ):
+            log.error( 'Records of \'{}.ann\' don\'t match themselves:  {}'.format( jobs[ 0 ][ 0 ] ,
+                                                                                  mismatched ) )
+            exit( 1 )
+    ##
+    setting_counts = [ {} for setting in args.settings ]
+    stage_seconds = dict( [ ( stage , 0.0 ) for stage in stages ] )
+    if( args.workers > 1 ):
+        if( 'fork' in multiprocessing.get_all_start_methods() ):
+            mp_context = multiprocessing.get_context( 'fork' )
+        else:
+            mp_context = multiprocessing.get_context()
+        pool = mp_context.Pool( processes = args.workers ,
+                                initializer = init_worker ,
+                                initargs = ( args , ) )
+        results = pool.imap_unordered( roundtrip_file_in_worker , jobs ,
+                                       chunksize = 16 )
+    else:
+        pool = None
+        results = map( roundtrip_file_in_worker , jobs )
+    try:
+        for file_counts , file_seconds in progress( results ,
+                                                    total = len( jobs ) ,
+                                                    file = args.progressbar_file ,
+                                                    disable = args.progressbar_disabled ):
+            for setting_idx , counts in enumerate( file_counts ):
+                for label in counts:
+                    if( label not in setting_counts[ setting_idx ] ):
+                        setting_counts[ setting_idx ][ label ] = [ 0 , 0 , 0 ]
+                    for column in range( 3 ):
+                        setting_counts[ setting_idx ][ label ][ column ] += counts[ label ][ column ]
+            for stage in stages:
+                stage_seconds[ stage ] += file_seconds[ stage ]
+    finally:
+        if( pool is not None ):
+            pool.close()
+            pool.join()
+    wall_seconds = time.perf_counter() - start
+    ##
+    summaries = [ summarize_setting( setting , counts )
+                  for setting , counts in zip( args.settings , setting_counts ) ]
+    for summary in summaries:
+        if( 'E' in summary[ 'totals' ] and
+            summary[ 'totals' ][ 'E' ][ 'original' ] > 0 and
+            summary[ 'totals' ][ 'E' ][ 'matched' ] == 0 ):
+            log.warning( 'No event survived the round trip with {}'.format( setting_name( ( summary[ 'left_window' ] ,
+                                                                                            summary[ 'right_window' ] ,
+                                                                                            summary[ 'allow_identity' ] ) ) ) )
+    print_summary( summaries , stage_seconds , len( jobs ) , wall_seconds )
+    if( args.report_file is not None ):
+        with open( args.report_file , 'w' ) as fp:
+            json.dump( { 'txt_root' : args.txt_root ,
+                         'brat_root' : args.brat_root ,
+                         'docs' : len( jobs ) ,
+                         'no_relations' : args.no_relations ,
+                         'workers' : args.workers ,
+                         'wall_seconds' : wall_seconds ,
+                         'stage_seconds' : stage_seconds ,
+                         'settings' : summaries } ,
+                       fp , indent = 2 )
+
+
+if __name__ == "__main__":
+    main()
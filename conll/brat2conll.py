@@ -1,9 +1,13 @@
 # Convert files from brat annotated format to CoNLL format
+import sys
 from os import listdir, path
 from collections import namedtuple
 import argparse
 import re
 
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+from corpus_utils.profiling import add_profile_arguments, init_profiler, NullProfiler
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "--input_dir",
@@ -21,10 +25,13 @@ parser.add_argument(
     help="Output file where CoNLL format annotations are saved",
 )
 
+add_profile_arguments(parser)
+
 class FormatConvertor:
-    def __init__(self, input_dir: str, output_file: str):
+    def __init__(self, input_dir: str, output_file: str, profiler=None):
         self.input_dir = input_dir
         self.output_file = output_file
+        self.profiler = profiler if profiler is not None else NullProfiler()
 
         # self.input_dir = '/home/pranav/Dropbox (GaTech)/repos/brat2CoNLL/sample_input_data/'
         # self.output_file = '/home/pranav/Dropbox (GaTech)/repos/brat2CoNLL/sample_output_data/test.txt'
@@ -82,95 +89,103 @@ class FormatConvertor:
 
     def parse_text(self):
         """Loop over all annotation files, and write tokens with their label to an output file"""
-        file_pair_list = self.read_input_folder()
+        with self.profiler.stage('discover'):
+            file_pair_list = self.read_input_folder()
         #different tokenization options
         #different sentence splitting options
         #separate folder for preprocessing
         with open(self.output_file, 'w') as fo:
             for file_count, file_pair in enumerate(file_pair_list):
                 annotation_file, text_file = file_pair.ann, file_pair.text
-                input_annotations, text_string = self.read_input(annotation_file, text_file)
-                num_annotations = len( input_annotations )
-                if( num_annotations == 0 ):
-                    ## skip over any files with no samples to train from
-                    continue
-                ## TODO - convert this to medspaCy tokenizer
-                text_tokens = re.split( r'([ \t\n])', text_string)
-                text_tokens = [t for t in text_tokens]## if t != ' ']
-                annotation_count = 0
-                current_ann_start = input_annotations[ annotation_count ][ "start" ]
-                current_ann_end = input_annotations[ annotation_count ][ "end" ]
-                current_index = 0
-                num_tokens = len(text_tokens)
-                i = 0 # Initialize Token number
-                last_label = ''
-                sent_index = 1
-                ## Token index for the current sentence
-                tok_index = 0
                 file_name = text_file.split('/')[-1]
-                bio_state = 'O'
-                bio_label = ''
-                while i < num_tokens:
-                    ## TODO - change this to update on sentence boundaries
-                    if( text_tokens[i] == '\n' ):
-                        sent_index += 1
-                        i += 1
-                        current_index += 1
-                        tok_index = 0
-                        fo.write('\n')
-                        if( current_ann_end <= current_index ):
-                            annotation_count += 1
-                            bio_state = 'O'
-                            bio_label = ''
-                            if( annotation_count < num_annotations ):
-                                current_ann_start = input_annotations[ annotation_count ][ "start" ]
-                                current_ann_end = input_annotations[ annotation_count ][ "end" ]
-                    elif( text_tokens[ i ] in [ ' ' , '\t' , '' ] ):
-                        i += 1
-                        if( text_tokens[ i ] != '' ):
-                            current_index += 1
-                        if( current_ann_end <= current_index ):
-                            annotation_count += 1
-                            bio_state = 'O'
-                            bio_label = ''
-                            if( annotation_count < num_annotations ):
-                                current_ann_start = input_annotations[ annotation_count ][ "start" ]
-                                current_ann_end = input_annotations[ annotation_count ][ "end" ]
-                    else:
-                        token_end = current_index + len( text_tokens[ i ] )
-                        if( annotation_count < num_annotations ):
-                            label = input_annotations[ annotation_count ][ "label" ]
-                            if( current_index == current_ann_start ):
-                                ## If we just had the start of a
-                                ## label, then the last instance was a
-                                ## single token long and so we need to
-                                ## reset
-                                if( bio_state == 'B' ):
-                                    #annotation_count += 1
-                                    #label = input_annotations[ annotation_count ][ "label" ]
-                                    1
-                                bio_state = 'B'
-                                bio_label = '-{}'.format( label )
-                            elif( bio_state == 'B' ):
-                                bio_state = 'I'
-                        fo.write( '{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format( text_tokens[ i ] ,
-                                                                         current_index,
-                                                                         token_end , ##current_index + len( text_tokens[ i ] ) ,
-                                                                         tok_index ,
-                                                                         sent_index ,
-                                                                         file_name ,
-                                                                         '{}{}'.format( bio_state , bio_label ) ) )
-                        tok_index += 1
-                        current_index += len( text_tokens[ i ] )## + 1
-                        i += 1
-                        if( current_ann_end <= current_index ):
-                            annotation_count += 1
-                            bio_state = 'O'
-                            bio_label = ''
-                            if( annotation_count < num_annotations ):
-                                current_ann_start = input_annotations[ annotation_count ][ "start" ]
-                                current_ann_end = input_annotations[ annotation_count ][ "end" ]
+                with self.profiler.stage('read', file_name):
+                    input_annotations, text_string = self.read_input(annotation_file, text_file)
+                with self.profiler.stage('write', file_name):
+                    self.write_tokens(fo, input_annotations, text_string, text_file)
+
+    def write_tokens(self, fo, input_annotations: list, text_string: str, text_file: str):
+        """Write the tokens of a single file with their BIO labels"""
+        num_annotations = len( input_annotations )
+        if( num_annotations == 0 ):
+            ## skip over any files with no samples to train from
+            return
+        ## TODO - convert this to medspaCy tokenizer
+        text_tokens = re.split( r'([ \t\n])', text_string)
+        text_tokens = [t for t in text_tokens]## if t != ' ']
+        annotation_count = 0
+        current_ann_start = input_annotations[ annotation_count ][ "start" ]
+        current_ann_end = input_annotations[ annotation_count ][ "end" ]
+        current_index = 0
+        num_tokens = len(text_tokens)
+        i = 0 # Initialize Token number
+        last_label = ''
+        sent_index = 1
+        ## Token index for the current sentence
+        tok_index = 0
+        file_name = text_file.split('/')[-1]
+        bio_state = 'O'
+        bio_label = ''
+        while i < num_tokens:
+            ## TODO - change this to update on sentence boundaries
+            if( text_tokens[i] == '\n' ):
+                sent_index += 1
+                i += 1
+                current_index += 1
+                tok_index = 0
                 fo.write('\n')
+                if( current_ann_end <= current_index ):
+                    annotation_count += 1
+                    bio_state = 'O'
+                    bio_label = ''
+                    if( annotation_count < num_annotations ):
+                        current_ann_start = input_annotations[ annotation_count ][ "start" ]
+                        current_ann_end = input_annotations[ annotation_count ][ "end" ]
+            elif( text_tokens[ i ] in [ ' ' , '\t' , '' ] ):
+                i += 1
+                if( text_tokens[ i ] != '' ):
+                    current_index += 1
+                if( current_ann_end <= current_index ):
+                    annotation_count += 1
+                    bio_state = 'O'
+                    bio_label = ''
+                    if( annotation_count < num_annotations ):
+                        current_ann_start = input_annotations[ annotation_count ][ "start" ]
+                        current_ann_end = input_annotations[ annotation_count ][ "end" ]
+            else:
+                token_end = current_index + len( text_tokens[ i ] )
+                if( annotation_count < num_annotations ):
+                    label = input_annotations[ annotation_count ][ "label" ]
+                    if( current_index == current_ann_start ):
+                        ## If we just had the start of a
+                        ## label, then the last instance was a
+                        ## single token long and so we need to
+                        ## reset
+                        if( bio_state == 'B' ):
+                            #annotation_count += 1
+                            #label = input_annotations[ annotation_count ][ "label" ]
+                            1
+                        bio_state = 'B'
+                        bio_label = '-{}'.format( label )
+                    elif( bio_state == 'B' ):
+                        bio_state = 'I'
+                fo.write( '{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format( text_tokens[ i ] ,
+                                                                 current_index,
+                                                                 token_end , ##current_index + len( text_tokens[ i ] ) ,
+                                                                 tok_index ,
+                                                                 sent_index ,
+                                                                 file_name ,
+                                                                 '{}{}'.format( bio_state , bio_label ) ) )
+                tok_index += 1
+                current_index += len( text_tokens[ i ] )## + 1
+                i += 1
+                if( current_ann_end <= current_index ):
+                    annotation_count += 1
+                    bio_state = 'O'
+                    bio_label = ''
+                    if( annotation_count < num_annotations ):
+                        current_ann_start = input_annotations[ annotation_count ][ "start" ]
+                        current_ann_end = input_annotations[ annotation_count ][ "end" ]
+        fo.write('\n')
     
     def read_input_folder(self):
         """Read multiple annotation files from a given input folder"""
@@ -187,7 +202,14 @@ class FormatConvertor:
         
         return file_pair_list
 
-if __name__ == '__main__':
-    args = parser.parse_args()
-    format_convertor = FormatConvertor( args.input_dir , args.output_file )
+
+def main(command_line_args=None):
+    args = parser.parse_args(command_line_args)
+    profiler = init_profiler(args)
+    format_convertor = FormatConvertor( args.input_dir , args.output_file , profiler )
     format_convertor.parse_text()
+    profiler.write_report()
+
+
+if __name__ == '__main__':
+    main()
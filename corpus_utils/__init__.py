@@ -0,0 +1 @@
+## Shared helpers for the corpus conversion scripts in this repository
@@ -0,0 +1,205 @@
+import os
+
+import tempfile
+
+## mkstemp() creates files that only the owner can read so we restore
+## the permissions a plain open() would have given
+current_umask = os.umask( 0 )
+os.umask( current_umask )
+
+#############################################
+## brat standoff (.ann) input
+#############################################
+
+def parse_spans( offsets ):
+    """Turn the offsets of a T record ('0 5;16 23') into a list of
+    (begin, end) pairs"""
+    spans = []
+    for fragment in offsets.split( ';' ):
+        begin_offset , end_offset = fragment.split()
+        spans.append( ( int( begin_offset ) , int( end_offset ) ) )
+    return( spans )
+
+
+def span_text( note_text , spans ):
+    """The text brat shows for a (possibly discontinuous) span:  every
+    fragment joined by a single space.  Line breaks inside the span
+    become spaces (as brat writes them) so the record stays on one
+    line."""
+    text = ' '.join( [ note_text[ begin_offset:end_offset ]
+                       for begin_offset , end_offset in spans ] )
+    return( text.replace( '\r' , ' ' ).replace( '\n' , ' ' ) )
+
+
+def ann_record_sets( lines ):
+    """Reduce the T, E, and A records of an .ann file to sets of keys
+    that don't depend on how the ids were numbered, so two annotations
+    of the same note can be compared with plain set operations:
+
+    - T:  ( label , ( ( begin , end ) , ... ) )
+    - E:  ( type , trigger T key , frozenset of argument T keys )
+      ignoring the role names, which can differ for the same argument
+      (e.g., Status:T2 and StatusTime:T2), so an argument listed under
+      more than one role only counts once
+    - A:  ( name , T or E key of the target , value )
+
+    Duplicate records collapse into one key.  Records that point at an
+    id that isn't in the file are skipped."""
+    text_bounds = {}
+    event_lines = []
+    attribute_lines = []
+    for line in lines:
+        line = line.rstrip( '\n' )
+        if( '\t' not in line ):
+            continue
+        annot_id , body = line.split( '\t' , 1 )
+        if( annot_id.startswith( 'T' ) ):
+            label , offsets = body.split( '\t' , 1 )[ 0 ].split( ' ' , 1 )
+            text_bounds[ annot_id ] = ( label , tuple( parse_spans( offsets ) ) )
+        elif( annot_id.startswith( 'E' ) ):
+            event_lines.append( ( annot_id , body ) )
+        elif( annot_id.startswith( 'A' ) ):
+            attribute_lines.append( body )
+    events = {}
+    for annot_id , body in event_lines:
+        trigger , *arguments = body.split()
+        event_type , trigger_id = trigger.split( ':' )
+        if( trigger_id not in text_bounds ):
+            continue
+        argument_keys = set()
+        for argument in arguments:
+            role , argument_id = argument.split( ':' )
+            if( argument_id in text_bounds ):
+                argument_keys.add( text_bounds[ argument_id ] )
+        events[ annot_id ] = ( event_type ,
+                               text_bounds[ trigger_id ] ,
+                               frozenset( argument_keys ) )
+    attributes = set()
+    for body in attribute_lines:
+        fields = body.split()
+        name , target = fields[ 0:2 ]
+        value = ' '.join( fields[ 2: ] ) if len( fields ) > 2 else None
+        if( target in text_bounds ):
+            attributes.add( ( name , text_bounds[ target ] , value ) )
+        elif( target in events ):
+            attributes.add( ( name , events[ target ] , value ) )
+    return( { 'T' : set( text_bounds.values() ) ,
+              'E' : set( events.values() ) ,
+              'A' : attributes } )
+
+#############################################
+## brat standoff (.ann) output
+#############################################
+
+class BratWriter( object ):
+    """Accumulate the records of a single brat .ann file in memory and
+    write them to disk in one go.
+
+    Every add_* method returns the id of the new record (e.g., 'T3').
+    Ids are numbered per record type in the order they are added
+    unless an explicit id is passed in.  Records are written in the
+    order they were added.  The text of each record is written as-is
+    so callers need to flatten any newlines first.
+
+    The file is written to a temporary file in the same folder and
+    then renamed over ann_path so readers never see a partial .ann
+    file.  When used as a context manager, the file is only written
+    if the block exits without an exception.
+    """
+    def __init__( self , ann_path ):
+        self.ann_path = ann_path
+        self.records = []
+        self.counts = { 'T' : 0 , 'N' : 0 , 'A' : 0 ,
+                        'E' : 0 , 'R' : 0 , '#' : 0 }
+
+    def __enter__( self ):
+        return( self )
+
+    def __exit__( self , exc_type , exc_value , traceback ):
+        if( exc_type is None ):
+            self.flush()
+        return( False )
+
+    def __len__( self ):
+        return( len( self.records ) )
+
+    def next_id( self , prefix , annot_id = None ):
+        if( annot_id is None ):
+            self.counts[ prefix ] += 1
+            return( '{}{}'.format( prefix , self.counts[ prefix ] ) )
+        annot_id = str( annot_id )
+        if( not annot_id.startswith( prefix ) ):
+            annot_id = '{}{}'.format( prefix , annot_id )
+        ## Keep automatic numbering from colliding with explicit ids
+        try:
+            self.counts[ prefix ] = max( self.counts[ prefix ] ,
+                                         int( annot_id[ len( prefix ): ] ) )
+        except ValueError:
+            pass
+        return( annot_id )
+
+    def add_line( self , annot_id , body ):
+        """Add a pre-formatted record (everything after the id and first tab)"""
+        self.records.append( '{}\t{}'.format( annot_id , body ) )
+        return( annot_id )
+
+    def add_text_bound( self , label , spans , text , annot_id = None ):
+        """Add a T record. spans is a list of (begin, end) pairs. More
+        than one pair is written as a discontinuous span."""
+        annot_id = self.next_id( 'T' , annot_id )
+        offsets = ';'.join( [ '{} {}'.format( begin_offset , end_offset )
+                              for begin_offset , end_offset in spans ] )
+        return( self.add_line( annot_id ,
+                               '{} {}\t{}'.format( label , offsets , text ) ) )
+
+    def add_normalization( self , target , resource , concept_id , text ,
+                           annot_id = None ):
+        annot_id = self.next_id( 'N' , annot_id )
+        return( self.add_line( annot_id ,
+                               'Reference {} {}:{}\t{}'.format( target ,
+                                                                resource ,
+                                                                concept_id ,
+                                                                text ) ) )
+
+    def add_attribute( self , name , target , value = None , annot_id = None ):
+        annot_id = self.next_id( 'A' , annot_id )
+        if( value is None ):
+            return( self.add_line( annot_id ,
+                                   '{} {}'.format( name , target ) ) )
+        return( self.add_line( annot_id ,
+                               '{} {} {}'.format( name , target , value ) ) )
+
+    def add_event( self , trigger_type , trigger , arguments , annot_id = None ):
+        """Add an E record. arguments is a list of (role, target) pairs."""
+        annot_id = self.next_id( 'E' , annot_id )
+        return( self.add_line( annot_id ,
+                               ' '.join( [ '{}:{}'.format( trigger_type , trigger ) ] +
+                                         [ '{}:{}'.format( role , target )
+                                           for role , target in arguments ] ) ) )
+
+    def add_relation( self , label , arg1 , arg2 , annot_id = None ):
+        annot_id = self.next_id( 'R' , annot_id )
+        return( self.add_line( annot_id ,
+                               '{} Arg1:{} Arg2:{}'.format( label , arg1 , arg2 ) ) )
+
+    def add_note( self , target , text , note_type = 'AnnotatorNotes' ,
+                  annot_id = None ):
+        annot_id = self.next_id( '#' , annot_id )
+        return( self.add_line( annot_id ,
+                               '{} {}\t{}'.format( note_type , target , text ) ) )
+
+    def flush( self ):
+        out_dir = os.path.dirname( os.path.abspath( self.ann_path ) )
+        fd , tmp_path = tempfile.mkstemp( dir = out_dir ,
+                                          prefix = '.{}.'.format( os.path.basename( self.ann_path ) ) ,
+                                          suffix = '.tmp' )
+        try:
+            with os.fdopen( fd , 'w' ) as fp:
+                for record in self.records:
+                    fp.write( '{}\n'.format( record ) )
+            os.chmod( tmp_path , 0o666 & ~current_umask )
+            os.replace( tmp_path , self.ann_path )
+        except BaseException:
+            if( os.path.exists( tmp_path ) ):
+                os.remove( tmp_path )
+            raise
@@ -0,0 +1,337 @@
+## A single entry point for every script in this repository.
+##
+##   corpus-utils [shared options] <command> [command options]
+##
+## Commands are loaded the first time they are run (so --help doesn't
+## import all of them) and run in this process, which lets `batch` run
+## a whole list of conversions in one warm interpreter:  cassis, lxml,
+## each script, and each type system file are only loaded once.
+import logging as log
+
+import os
+import sys
+
+import argparse
+import re
+import shlex
+import time
+
+import importlib.util
+
+repo_root = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+
+def script_path( relative_path ):
+    """Find a script by its path relative to the repository root.  A
+    source checkout (or editable install) runs the scripts in place.  A
+    regular install ships them in the corpus_utils.scripts package,
+    where folder names have to be valid package names (nlm-scrubber is
+    nlm_scrubber)."""
+    checkout_path = os.path.join( repo_root , relative_path )
+    if( os.path.exists( checkout_path ) ):
+        return( checkout_path )
+    spec = importlib.util.find_spec( 'corpus_utils.scripts' )
+    if( spec is None or
+        spec.submodule_search_locations is None ):
+        return( checkout_path )
+    folder , filename = os.path.split( relative_path )
+    return( os.path.join( list( spec.submodule_search_locations )[ 0 ] ,
+                          folder.replace( '-' , '_' ) ,
+                          filename ) )
+
+## The script behind each command (relative to the repository root)
+## and a one line description for --help
+commands = {
+    'brat2conll' : ( os.path.join( 'conll' , 'brat2conll.py' ) ,
+                     'Convert brat annotations to CoNLL' ) ,
+    'generate-synthetic-corpus' : ( os.path.join( 'benchmarks' , 'generate_synthetic_corpus.py' ) ,
+                                    'Write a synthetic corpus in every supported format' ) ,
+    'knowtator2cas' : ( os.path.join( 'knowtator' , 'knowtator2cas.py' ) ,
+                        'Convert Knowtator XML to CAS XMI and brat' ) ,
+    'line-reshaper' : ( 'line_reshaper.py' ,
+                        'Report line length stats or rewrap notes to a fixed width' ) ,
+    'nlm2brat' : ( os.path.join( 'nlm-scrubber' , 'nlm2brat.py' ) ,
+                   'Align NLM-Scrubber output with the raw notes as brat' ) ,
+    'normalize-phi-dates' : ( os.path.join( 'i2b2' , 'normalize_phi_dates.py' ) ,
+                              'Replace the years in i2b2 PHI dates with surrogates' ) ,
+    'omop-to-sdoh-brat' : ( os.path.join( 'n2c2' , 'convert-omop-cdm-to-n2c2-sdoh-brat.py' ) ,
+                            'Convert OMOP CDM CAS XMI back to n2c2 SDOH brat' ) ,
+    'patch-n2c2-2019' : ( os.path.join( 'n2c2' , 'patch_2019_n2c2_track-3_corpus.py' ) ,
+                          'Patch the redacted 2019 n2c2 Track 3 corpus' ) ,
+    'redact-n2c2-2019' : ( os.path.join( 'n2c2' , 'redact_2019_n2c2_track-3_corpus.py' ) ,
+                           'Redact the 2019 n2c2 Track 3 corpus' ) ,
+    'run-benchmarks' : ( os.path.join( 'benchmarks' , 'run_benchmarks.py' ) ,
+                         'Time the converters against a synthetic corpus' ) ,
+    'score-sdoh-brat' : ( os.path.join( 'n2c2' , 'score-n2c2-sdoh-brat.py' ) ,
+                          'Score n2c2 SDOH brat output against a reference standard' ) ,
+    'sdoh-roundtrip' : ( os.path.join( 'benchmarks' , 'sdoh_roundtrip.py' ) ,
+                         'Round-trip n2c2 SDOH brat through OMOP CDM and report what survives' ) ,
+    'sdoh-brat-to-omop' : ( os.path.join( 'n2c2' , 'convert-n2c2-sdoh-brat-to-omop-cdm.py' ) ,
+                            'Convert n2c2 SDOH brat to OMOP CDM CAS XMI' ) ,
+    'sdoh-brat-to-sharpn' : ( os.path.join( 'n2c2' , 'convert-n2c2-sdoh-brat-to-sharpn.py' ) ,
+                              'Convert n2c2 SDOH brat to SHARPn CAS XMI' ) ,
+    'sdoh-brat-to-sharpn-and-omop' : ( os.path.join( 'n2c2' , 'convert-n2c2-sdoh-brat-to-sharpn-and-omop-cdm.py' ) ,
+                                       'Convert n2c2 SDOH brat to SHARPn and OMOP CDM CAS XMI in one pass' ) ,
+    'split-i2b2-2006' : ( os.path.join( 'i2b2' , 'split_2006_corpus_into_files.py' ) ,
+                          'Split a 2006 i2b2 corpus file into one file per record' ) }
+
+## Options that can be given once (before the command) and are passed
+## on to every command that takes them and doesn't already set them
+shared_options = [ ( '--workers' , 'workers' ) ,
+                   ( '--progressbar-output' , 'progressbar_output' ) ]
+
+
+def initialize_arg_parser():
+    parser = argparse.ArgumentParser( prog = 'corpus-utils' ,
+                                      formatter_class = argparse.RawDescriptionHelpFormatter ,
+                                      description = """
+Run any of the corpus conversion scripts.  Use
+`corpus-utils <command> --help` for the options of each command.
+""" ,
+                                      epilog = 'commands:\n{}'.format(
+                                          '\n'.join( [ '  {:<30}{}'.format( name , commands[ name ][ 1 ] )
+                                                       for name in sorted( commands ) ] +
+                                                     [ '  {:<30}{}'.format( 'batch' ,
+                                                                            'Run every command listed in a file in this process' ) ] ) ) )
+    parser.add_argument( '-v' , '--verbose' ,
+                         help = "print more information" ,
+                         action = "store_true" )
+
+    parser.add_argument( '--workers' , default = None , type = int ,
+                         dest = 'workers' ,
+                         help = "Number of worker processes for every command that takes --workers" )
+
+    parser.add_argument( '--progressbar-output' , default = None ,
+                         dest = 'progressbar_output' ,
+                         choices = [ 'stderr' , 'stdout' , 'none' ] ,
+                         help = "Progress bar output for every command that takes --progressbar-output" )
+
+    parser.add_argument( '--profile-dir' , default = None ,
+                         dest = 'profile_dir' ,
+                         help = "Give every command that takes --profile a report in this folder" )
+
+    parser.add_argument( 'command' ,
+                         metavar = 'command' ,
+                         choices = sorted( commands ) + [ 'batch' ] ,
+                         help = "The command to run (see below)" )
+
+    parser.add_argument( 'command_args' ,
+                         nargs = argparse.REMAINDER ,
+                         help = argparse.SUPPRESS )
+    ##
+    return parser
+
+
+def initialize_batch_arg_parser():
+    parser = argparse.ArgumentParser( prog = 'corpus-utils batch' ,
+                                      description = """
+Run every command in a file, one per line (without the leading
+corpus-utils), in this process.  Blank lines and lines starting with #
+are skipped and a trailing backslash continues a command on the next
+line.  Use - to read the commands from stdin.
+""" )
+    parser.add_argument( 'batch_file' ,
+                         help = "File listing the commands to run" )
+
+    parser.add_argument( '--keep-going' ,
+                         dest = 'keep_going' ,
+                         help = "Run the remaining commands after one fails" ,
+                         action = "store_true" )
+    ##
+    return parser
+
+
+def get_arguments( command_line_args ):
+    parser = initialize_arg_parser()
+    args = parser.parse_args( command_line_args )
+    ##
+    return args
+
+
+## Scripts loaded so far in this process, by command name
+loaded_commands = {}
+
+def load_script( relative_path ):
+    """Import one of the stand-alone scripts in this repository (many
+    of which have names that aren't valid module names).  The module is
+    registered in sys.modules so forked workers can unpickle the
+    functions it hands to multiprocessing."""
+    module_path = script_path( relative_path )
+    module_name = re.sub( r'\W' , '_' , os.path.basename( module_path )[ 0:-3 ] )
+    if( module_name in sys.modules ):
+        return( sys.modules[ module_name ] )
+    spec = importlib.util.spec_from_file_location( module_name , module_path )
+    module = importlib.util.module_from_spec( spec )
+    sys.modules[ module_name ] = module
+    try:
+        spec.loader.exec_module( module )
+    except BaseException:
+        del sys.modules[ module_name ]
+        raise
+    return( module )
+
+
+def call_script( relative_path , function_name , *args ):
+    """Call a function of one of the scripts (see load_script).  Spawned
+    processes can't unpickle a function of a script that was loaded
+    with load_script (only the parent has it in sys.modules) so pass
+    them this function and the script path instead."""
+    return( getattr( load_script( relative_path ) , function_name )( *args ) )
+
+
+def load_command( command ):
+    if( command not in loaded_commands ):
+        relative_path = commands[ command ][ 0 ]
+        if( not os.path.exists( script_path( relative_path ) ) ):
+            log.error( 'Unable to find {} (looked for {}).  Try reinstalling corpus-utils.'.format( relative_path ,
+                                                                                                 script_path( relative_path ) ) )
+            return( None )
+        loaded_commands[ command ] = load_script( relative_path )
+    return( loaded_commands[ command ] )
+
+
+def command_option_strings( module ):
+    """Every option string the command's argument parser accepts"""
+    if( hasattr( module , 'initialize_arg_parser' ) ):
+        parser = module.initialize_arg_parser()
+    else:
+        parser = module.parser
+    return( set( parser._option_string_actions ) )
+
+
+def sets_option( command_args , option ):
+    for arg in command_args:
+        if( arg == option or
+            arg.startswith( '{}='.format( option ) ) ):
+            return( True )
+    return( False )
+
+
+def add_shared_options( module , command , command_args , args , profile_name = None ):
+    """Pass the shared options given to corpus-utils on to a command
+    (unless it doesn't take them or the command line already sets
+    them)"""
+    option_strings = command_option_strings( module )
+    command_args = list( command_args )
+    for option , dest in shared_options:
+        value = getattr( args , dest )
+        if( value is not None and
+            option in option_strings and
+            not sets_option( command_args , option ) ):
+            command_args.extend( [ option , str( value ) ] )
+    if( args.verbose and
+        '--verbose' in option_strings and
+        not sets_option( command_args , '--verbose' ) and
+        not sets_option( command_args , '-v' ) ):
+        command_args.append( '--verbose' )
+    if( args.profile_dir is not None and
+        '--profile' in option_strings and
+        not sets_option( command_args , '--profile' ) ):
+        if( not os.path.exists( args.profile_dir ) ):
+            os.makedirs( args.profile_dir )
+        command_args.extend( [ '--profile' ,
+                               os.path.join( args.profile_dir ,
+                                             '{}.json'.format( profile_name or command ) ) ] )
+    return( command_args )
+
+
+def run_command( command , command_args , args , profile_name = None ):
+    """Run a single command in this process and return its exit
+    status"""
+    module = load_command( command )
+    if( module is None ):
+        return( 1 )
+    command_args = add_shared_options( module , command , command_args , args ,
+                                       profile_name = profile_name )
+    log.debug( '{} {}'.format( command , ' '.join( [ shlex.quote( arg ) for arg in command_args ] ) ) )
+    ## Scripts label their reports with sys.argv so make it look like
+    ## the script was run directly
+    saved_argv = sys.argv
+    sys.argv = [ module.__file__ ] + command_args
+    try:
+        module.main( command_args )
+    except SystemExit as e:
+        if( e.code is None ):
+            return( 0 )
+        if( isinstance( e.code , int ) ):
+            return( e.code )
+        log.error( '{}'.format( e.code ) )
+        return( 1 )
+    finally:
+        sys.argv = saved_argv
+    return( 0 )
+
+
+def read_batch_file( batch_file ):
+    """Split a batch file into the command line of each job"""
+    if( batch_file == '-' ):
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open( batch_file , 'r' ) as fp:
+            lines = fp.read().splitlines()
+    jobs = []
+    pending = ''
+    for line in lines:
+        if( line.endswith( '\\' ) ):
+            pending += line[ 0:-1 ] + ' '
+            continue
+        job = shlex.split( pending + line , comments = True )
+        pending = ''
+        if( len( job ) > 0 ):
+            jobs.append( job )
+    if( pending.strip() != '' ):
+        jobs.append( shlex.split( pending , comments = True ) )
+    return( jobs )
+
+
+def run_batch( batch_args , args ):
+    batch_args = initialize_batch_arg_parser().parse_args( batch_args )
+    jobs = read_batch_file( batch_args.batch_file )
+    ## Check every command name before running anything so a typo on
+    ## the last line doesn't waste a long batch
+    bad_jobs = [ job for job in jobs if job[ 0 ] not in commands ]
+    for job in bad_jobs:
+        log.error( 'Unknown command:  {}'.format( job[ 0 ] ) )
+    if( len( bad_jobs ) > 0 ):
+        return( 1 )
+    results = []
+    for job_number , job in enumerate( jobs , start = 1 ):
+        start = time.perf_counter()
+        try:
+            status = run_command( job[ 0 ] , job[ 1: ] , args ,
+                                  profile_name = '{:03d}-{}'.format( job_number , job[ 0 ] ) )
+        except Exception:
+            log.exception( 'Job {} ({}) raised an exception'.format( job_number , job[ 0 ] ) )
+            status = 1
+        results.append( ( job_number , job[ 0 ] , status , time.perf_counter() - start ) )
+        if( status != 0 ):
+            log.error( 'Job {} ({}) failed with exit status {}'.format( job_number , job[ 0 ] , status ) )
+            if( not batch_args.keep_going ):
+                break
+    print( '{:>4}  {:<30}{:>8}{:>10}'.format( 'job' , 'command' , 'status' , 'seconds' ) )
+    for job_number , command , status , seconds in results:
+        print( '{:>4}  {:<30}{:>8}{:>10.2f}'.format( job_number , command , status , seconds ) )
+    if( len( results ) < len( jobs ) ):
+        print( '{} of {} jobs were not run'.format( len( jobs ) - len( results ) , len( jobs ) ) )
+    if( any( [ status != 0 for job_number , command , status , seconds in results ] ) or
+        len( results ) < len( jobs ) ):
+        return( 1 )
+    return( 0 )
+
+
+def main( command_line_args = None ):
+    args = get_arguments( command_line_args )
+    if( args.verbose ):
+        log.basicConfig( format = "%(levelname)s: %(message)s" ,
+                         level = log.DEBUG )
+    else:
+        log.basicConfig( format="%(levelname)s: %(message)s" )
+    if( args.command == 'batch' ):
+        status = run_batch( args.command_args , args )
+    else:
+        status = run_command( args.command , args.command_args , args )
+    sys.exit( status )
+
+
+if __name__ == "__main__":
+    main()
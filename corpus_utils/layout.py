@@ -0,0 +1,72 @@
+## Corpus layout descriptors:  which splits a corpus has and where each
+## kind of file lives within a split
+import os
+
+import json
+
+## The layout of the 2019 n2c2 Track 3 release
+default_layout = { 'splits' : [ 'train' , 'test' ] ,
+                   'folders' : { 'note' : '{split}/{split}_note' ,
+                                 'redacted' : '{split}/{split}_redacted' ,
+                                 'ann' : '{split}/{split}_ann' } }
+
+
+class CorpusLayout( object ):
+    """The splits of a corpus and a folder template for every kind of
+    file ('note', 'redacted', 'ann', ...) in them.  Templates are
+    relative to a root folder and can use {split} for the split name.
+
+    A descriptor looks like:
+
+        { "splits" : [ "train" , "dev" ,
+                       { "name" : "test" ,
+                         "folders" : { "note" : "test_notes" } } ] ,
+          "folders" : { "note" : "{split}/{split}_note" ,
+                        "redacted" : "{split}/{split}_redacted" ,
+                        "ann" : "{split}/{split}_ann" } }
+
+    where a split can override any of the default folder templates.
+    """
+    def __init__( self , descriptor ):
+        if( not isinstance( descriptor , dict ) or
+            'splits' not in descriptor ):
+            raise ValueError( "A corpus layout needs a list of 'splits'" )
+        default_folders = descriptor.get( 'folders' , {} )
+        self.splits = []
+        self.folders = {}
+        for split in descriptor[ 'splits' ]:
+            if( isinstance( split , str ) ):
+                split = { 'name' : split }
+            if( not isinstance( split , dict ) or 'name' not in split ):
+                raise ValueError( 'Every split needs a name:  {}'.format( split ) )
+            split_folders = dict( default_folders )
+            split_folders.update( split.get( 'folders' , {} ) )
+            self.splits.append( split[ 'name' ] )
+            self.folders[ split[ 'name' ] ] = split_folders
+
+    def folder( self , root_dir , split , role ):
+        if( role not in self.folders[ split ] ):
+            raise ValueError( "No '{}' folder defined for split '{}'".format( role ,
+                                                                              split ) )
+        return( os.path.join( root_dir ,
+                              self.folders[ split ][ role ].format( split = split ) ) )
+
+
+def load_layout( layout_file = None ):
+    """Read a JSON or YAML (.yaml/.yml, needs PyYAML) layout descriptor.
+    Without a file, the default n2c2 Track 3 layout is used."""
+    if( layout_file is None ):
+        return( CorpusLayout( default_layout ) )
+    with open( layout_file , 'r' ) as fp:
+        if( layout_file.endswith( ( '.yaml' , '.yml' ) ) ):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError( 'PyYAML is required to read YAML layouts:  {}'.format( layout_file ) )
+            try:
+                descriptor = yaml.safe_load( fp )
+            except yaml.YAMLError as e:
+                raise ValueError( 'Unable to parse the YAML layout {}:  {}'.format( layout_file , e ) )
+        else:
+            descriptor = json.load( fp )
+    return( CorpusLayout( descriptor ) )
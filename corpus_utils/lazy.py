@@ -0,0 +1,55 @@
+## The command-line tools are often run thousands of times over small
+## batches so heavy dependencies (cassis, lxml, tqdm) are only
+## imported the first time they're needed.  --help, argument errors,
+## and runs that never build a CAS don't pay for them.
+import logging as log
+
+import os
+
+import copy
+import functools
+
+
+@functools.lru_cache( maxsize = None )
+def get_etree():
+    """lxml.etree if it is installed, otherwise the standard library's
+    ElementTree.  Resolved once per process."""
+    try:
+        from lxml import etree
+        log.debug( "running with lxml.etree" )
+    except ImportError:
+        import xml.etree.ElementTree as etree
+        log.debug( "running with xml.etree.ElementTree" )
+    return( etree )
+
+
+@functools.lru_cache( maxsize = None )
+def get_cassis():
+    """Import dkpro-cassis (quieting its UserWarnings about offsets)"""
+    import warnings
+    warnings.filterwarnings( 'ignore' , category = UserWarning , module = 'cassis' )
+    import cassis
+    return( cassis )
+
+
+## Type systems parsed so far, keyed by path and modification time
+typesystem_files = {}
+
+def load_typesystem( types_file ):
+    """Load a UIMA type system file.  Each file is only parsed once per
+    process (e.g., across the runs in a corpus-utils batch) and every
+    caller gets its own copy to add types to."""
+    key = ( os.path.abspath( types_file ) , os.path.getmtime( types_file ) )
+    if( key not in typesystem_files ):
+        with open( types_file , 'rb' ) as fp:
+            typesystem_files[ key ] = get_cassis().load_typesystem( fp )
+    return( copy.deepcopy( typesystem_files[ key ] ) )
+
+
+def progress( iterable , total = None , desc = None , file = None , disable = False ):
+    """Wrap iterable in a tqdm progress bar.  tqdm isn't imported at
+    all when the bar is disabled."""
+    if( disable ):
+        return( iterable )
+    from tqdm import tqdm
+    return( tqdm( iterable , total = total , desc = desc , file = file ) )
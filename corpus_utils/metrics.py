@@ -0,0 +1,257 @@
+## Machine-readable progress for long conversions.  tqdm only counts
+## files, which says little when note sizes vary by orders of
+## magnitude, so --metrics-file reports input bytes and annotations
+## per second, an ETA weighted by the bytes left to convert, and how
+## busy each worker has been.  Snapshots are written every
+## --metrics-interval seconds from a background thread (even when no
+## document finishes) so a scheduler watching the file can tell a
+## stalled run from a slow one.
+##
+## Scripts with a worker pool create the pool before starting the
+## heartbeat.  Forking while the heartbeat thread holds a lock (e.g.,
+## mid-write) would leave that lock held forever in the workers.
+import logging as log
+
+import os
+import sys
+
+import json
+import threading
+import time
+
+
+def add_metrics_arguments( parser ):
+    parser.add_argument( '--metrics-file' , default = None ,
+                         dest = 'metrics_file' ,
+                         help = "Write throughput and progress metrics to this file ('-' for stderr)" )
+    parser.add_argument( '--metrics-format' , default = 'jsonl' ,
+                         dest = 'metrics_format' ,
+                         choices = [ 'jsonl' , 'prometheus' ] ,
+                         help = "Append a JSON line per snapshot (jsonl) or keep a Prometheus textfile up to date (prometheus)" )
+    parser.add_argument( '--metrics-interval' , default = 10.0 , type = float ,
+                         dest = 'metrics_interval' ,
+                         help = "Seconds between metrics snapshots" )
+    return( parser )
+
+
+def init_metrics( args , total_files , total_bytes , start = True ):
+    """Build the metrics writer asked for on the command line (a
+    NullMetrics unless --metrics-file was given) and start its
+    heartbeat.  With start = False the caller starts it (e.g., once its
+    worker pool has been forked)."""
+    if( getattr( args , 'metrics_file' , None ) is None ):
+        return( NullMetrics() )
+    if( args.metrics_format == 'prometheus' and
+        args.metrics_file == '-' ):
+        log.error( 'Prometheus metrics need a textfile.  Use --metrics-format jsonl to write to stderr.' )
+        exit( 1 )
+    metrics = ProgressMetrics( args.metrics_file ,
+                               metrics_format = args.metrics_format ,
+                               interval = args.metrics_interval ,
+                               total_files = total_files ,
+                               total_bytes = total_bytes ,
+                               workers = getattr( args , 'workers' , 1 ) )
+    if( start ):
+        metrics.start()
+    return( metrics )
+
+
+def file_bytes( *paths ):
+    """Sum the sizes of the files a document is read from (ignoring any
+    that don't exist)"""
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize( path )
+        except OSError:
+            pass
+    return( total )
+
+
+def run_timed( function , *args , **kwargs ):
+    """Call function and return its result along with the process it
+    ran in and how long it took.  Workers wrap their jobs in this so the
+    main process can report per-worker utilization."""
+    start = time.perf_counter()
+    result = function( *args , **kwargs )
+    return( result , os.getpid() , time.perf_counter() - start )
+
+
+class NullMetrics( object ):
+    """Stands in for ProgressMetrics when --metrics-file wasn't given"""
+    enabled = False
+
+    def start( self ):
+        pass
+
+    def update( self , input_bytes , annotations = 0 ,
+                worker = None , busy_seconds = None ):
+        pass
+
+    def close( self ):
+        pass
+
+
+class ProgressMetrics( object ):
+    """Track the progress of a single run and periodically write a
+    snapshot of it.
+
+    Rates are averaged over the whole run (with the rate since the
+    last snapshot alongside) and the ETA assumes the bytes left will be
+    converted at the average rate so far."""
+    enabled = True
+
+    def __init__( self , metrics_file , metrics_format = 'jsonl' ,
+                  interval = 10.0 , total_files = 0 , total_bytes = 0 ,
+                  workers = 1 ):
+        self.metrics_file = metrics_file
+        self.metrics_format = metrics_format
+        self.interval = interval
+        self.script = os.path.basename( sys.argv[ 0 ] )
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.worker_count = workers
+        self.files_done = 0
+        self.bytes_done = 0
+        self.annotations = 0
+        self.workers = {}
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+        self.last_progress = self.started
+        self.last_snapshot = ( self.started , 0 , 0 )
+        self.done = False
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if( metrics_format == 'jsonl' and metrics_file != '-' ):
+            ## Start every run with a fresh file
+            open( metrics_file , 'w' ).close()
+
+    def start( self ):
+        if( self.thread is not None ):
+            return
+        self.emit()
+        self.thread = threading.Thread( target = self.heartbeat ,
+                                        name = 'metrics' )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def heartbeat( self ):
+        while( not self.stopped.wait( self.interval ) ):
+            self.emit()
+
+    def update( self , input_bytes , annotations = 0 ,
+                worker = None , busy_seconds = None ):
+        """Record a finished document"""
+        with self.lock:
+            self.files_done += 1
+            self.bytes_done += input_bytes
+            self.annotations += annotations
+            self.last_progress = time.perf_counter()
+            if( worker is not None ):
+                if( worker not in self.workers ):
+                    self.workers[ worker ] = { 'files' : 0 ,
+                                               'busy_seconds' : 0.0 }
+                self.workers[ worker ][ 'files' ] += 1
+                if( busy_seconds is not None ):
+                    self.workers[ worker ][ 'busy_seconds' ] += busy_seconds
+
+    def snapshot( self ):
+        now = time.perf_counter()
+        elapsed = now - self.started
+        last_time , last_bytes , last_annotations = self.last_snapshot
+        since_last = now - last_time
+        self.last_snapshot = ( now , self.bytes_done , self.annotations )
+        bytes_per_sec = self.bytes_done / elapsed if elapsed > 0 else 0.0
+        eta_seconds = None
+        if( self.done ):
+            eta_seconds = 0.0
+        elif( bytes_per_sec > 0 ):
+            eta_seconds = max( 0 , self.total_bytes - self.bytes_done ) / bytes_per_sec
+        workers = {}
+        for worker in sorted( self.workers ):
+            busy_seconds = self.workers[ worker ][ 'busy_seconds' ]
+            workers[ str( worker ) ] = { 'files' : self.workers[ worker ][ 'files' ] ,
+                                         'busy_seconds' : busy_seconds ,
+                                         'utilization' : busy_seconds / elapsed if elapsed > 0 else 0.0 }
+        return( { 'script' : self.script ,
+                  'timestamp' : self.start_time + elapsed ,
+                  'elapsed_seconds' : elapsed ,
+                  'done' : self.done ,
+                  'files_done' : self.files_done ,
+                  'files_total' : self.total_files ,
+                  'bytes_done' : self.bytes_done ,
+                  'bytes_total' : self.total_bytes ,
+                  'annotations' : self.annotations ,
+                  'bytes_per_sec' : bytes_per_sec ,
+                  'annotations_per_sec' : self.annotations / elapsed if elapsed > 0 else 0.0 ,
+                  'recent_bytes_per_sec' : ( self.bytes_done - last_bytes ) / since_last if since_last > 0 else 0.0 ,
+                  'recent_annotations_per_sec' : ( self.annotations - last_annotations ) / since_last if since_last > 0 else 0.0 ,
+                  'eta_seconds' : eta_seconds ,
+                  'seconds_since_progress' : now - self.last_progress ,
+                  'worker_count' : self.worker_count ,
+                  'workers' : workers } )
+
+    def emit( self ):
+        with self.lock:
+            snapshot = self.snapshot()
+            if( self.metrics_format == 'prometheus' ):
+                self.write_prometheus( snapshot )
+            else:
+                self.write_jsonl( snapshot )
+
+    def write_jsonl( self , snapshot ):
+        line = '{}\n'.format( json.dumps( snapshot , sort_keys = True ) )
+        ## Scripts print their own reports to stdout so snapshots
+        ## don't go there
+        if( self.metrics_file == '-' ):
+            sys.stderr.write( line )
+            sys.stderr.flush()
+        else:
+            with open( self.metrics_file , 'a' ) as fp:
+                fp.write( line )
+
+    def write_prometheus( self , snapshot ):
+        ## Written to a temporary file and moved into place so the
+        ## node_exporter textfile collector never sees half a file
+        labels = 'script="{}"'.format( snapshot[ 'script' ] )
+        lines = []
+        for name , metric_type , description , value in [
+                ( 'documents_processed_total' , 'counter' , 'Documents converted so far' , snapshot[ 'files_done' ] ) ,
+                ( 'documents' , 'gauge' , 'Documents in this run' , snapshot[ 'files_total' ] ) ,
+                ( 'input_bytes_processed_total' , 'counter' , 'Input bytes of the documents converted so far' , snapshot[ 'bytes_done' ] ) ,
+                ( 'input_bytes' , 'gauge' , 'Input bytes in this run' , snapshot[ 'bytes_total' ] ) ,
+                ( 'annotations_total' , 'counter' , 'Annotations converted so far' , snapshot[ 'annotations' ] ) ,
+                ( 'input_bytes_per_second' , 'gauge' , 'Input bytes converted per second (whole run)' , snapshot[ 'bytes_per_sec' ] ) ,
+                ( 'annotations_per_second' , 'gauge' , 'Annotations converted per second (whole run)' , snapshot[ 'annotations_per_sec' ] ) ,
+                ( 'eta_seconds' , 'gauge' , 'Estimated seconds left, weighted by input bytes' , snapshot[ 'eta_seconds' ] ) ,
+                ( 'seconds_since_progress' , 'gauge' , 'Seconds since a document last finished' , snapshot[ 'seconds_since_progress' ] ) ,
+                ( 'elapsed_seconds' , 'gauge' , 'Seconds since the run started' , snapshot[ 'elapsed_seconds' ] ) ,
+                ( 'done' , 'gauge' , '1 once the run has finished' , 1 if snapshot[ 'done' ] else 0 ) ,
+                ( 'last_update_timestamp_seconds' , 'gauge' , 'When this file was written' , snapshot[ 'timestamp' ] ) ]:
+            if( value is None ):
+                continue
+            lines.append( '# HELP corpus_utils_{} {}'.format( name , description ) )
+            lines.append( '# TYPE corpus_utils_{} {}'.format( name , metric_type ) )
+            lines.append( 'corpus_utils_{}{{{}}} {}'.format( name , labels , value ) )
+        for name , metric_type , description , key in [
+                ( 'worker_busy_seconds_total' , 'counter' , 'Seconds each worker has spent converting documents' , 'busy_seconds' ) ,
+                ( 'worker_utilization' , 'gauge' , 'Share of the run each worker has spent converting documents' , 'utilization' ) ]:
+            lines.append( '# HELP corpus_utils_{} {}'.format( name , description ) )
+            lines.append( '# TYPE corpus_utils_{} {}'.format( name , metric_type ) )
+            for worker in snapshot[ 'workers' ]:
+                lines.append( 'corpus_utils_{}{{{},worker="{}"}} {}'.format( name , labels , worker ,
+                                                                             snapshot[ 'workers' ][ worker ][ key ] ) )
+        tmp_file = '{}.tmp'.format( self.metrics_file )
+        with open( tmp_file , 'w' ) as fp:
+            fp.write( '\n'.join( lines ) )
+            fp.write( '\n' )
+        os.replace( tmp_file , self.metrics_file )
+
+    def close( self ):
+        """Stop the heartbeat and write the final snapshot"""
+        self.stopped.set()
+        if( self.thread is not None ):
+            self.thread.join()
+        self.done = True
+        self.emit()
@@ -0,0 +1,55 @@
+## Command-line options that every script in this repository shares.
+## Scripts add them to their own parser and call the matching init_*
+## function on the parsed arguments so the scripts (and the options
+## the corpus-utils command passes down to them) all behave the same.
+import logging as log
+
+import sys
+
+
+def add_progressbar_arguments( parser ):
+    parser.add_argument( '--progressbar-output' ,
+                         dest = 'progressbar_output' ,
+                         default = 'stderr' ,
+                         choices = [ 'stderr' , 'stdout' , 'none' ] ,
+                         help = "Pipe the progress bar to stderr, stdout, or neither" )
+    return( parser )
+
+
+def add_workers_arguments( parser , task = 'convert files' ):
+    parser.add_argument( '--workers' , default = 1 , type = int ,
+                         dest = 'workers' ,
+                         help = "Number of worker processes to {} with (1 = run serially)".format( task ) )
+    return( parser )
+
+
+def init_logging( args ):
+    """Log at DEBUG with -v and at WARNING otherwise.  The root logger
+    is reconfigured every time so each run in a corpus-utils batch gets
+    its own verbosity."""
+    if( args.verbose ):
+        log.basicConfig( format = "%(levelname)s: %(message)s" ,
+                         level = log.DEBUG ,
+                         force = True )
+        log.info( "Verbose output." )
+        log.debug( "{}".format( args ) )
+    else:
+        log.basicConfig( format="%(levelname)s: %(message)s" ,
+                         level = log.WARNING ,
+                         force = True )
+    return( args )
+
+
+def init_progressbar( args ):
+    """Turn --progressbar-output into the file and disable flag that
+    corpus_utils.lazy.progress takes"""
+    if( args.progressbar_output == 'none' ):
+        args.progressbar_disabled = True
+        args.progressbar_file = None
+    else:
+        args.progressbar_disabled = False
+        if( args.progressbar_output == 'stderr' ):
+            args.progressbar_file = sys.stderr
+        elif( args.progressbar_output == 'stdout' ):
+            args.progressbar_file = sys.stdout
+    return( args )
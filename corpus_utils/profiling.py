@@ -0,0 +1,240 @@
+## Opt-in instrumentation shared by the command-line scripts in this
+## repository.  Scripts wrap the work they do for each document in
+## named stages (discover, read, parse, build, serialize, write) and
+## --profile writes where the time (and, optionally, memory) went to
+## a JSON report.  Without --profile every stage is a no-op.
+import logging as log
+
+import os
+import sys
+
+import heapq
+import json
+import time
+
+## cProfile, pstats, and tracemalloc are imported when a Profiler
+## needs them so the NullProfiler costs nothing at startup
+
+## Functions defined under this folder count as "ours" in the cProfile
+## summary.  Everything else (cassis, lxml, the standard library) is
+## only listed with the overall hot spots.  A regular install ships
+## the scripts inside the package so that is the folder there.
+repo_root = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+if( os.path.isdir( os.path.join( repo_root , 'corpus_utils' , 'scripts' ) ) ):
+    repo_root = os.path.join( repo_root , 'corpus_utils' )
+
+
+def add_profile_arguments( parser ):
+    parser.add_argument( '--profile' , default = None ,
+                         dest = 'profile_file' ,
+                         help = "Time every stage of every document and write a JSON report to this file" )
+    parser.add_argument( '--profile-cprofile' ,
+                         dest = 'profile_cprofile' ,
+                         help = "Also run cProfile (needs --profile).  The raw stats are written next to the report (.prof)" ,
+                         action = "store_true" )
+    parser.add_argument( '--profile-tracemalloc' ,
+                         dest = 'profile_tracemalloc' ,
+                         help = "Also track the memory allocated in each stage (needs --profile)" ,
+                         action = "store_true" )
+    return( parser )
+
+
+def init_profiler( args ):
+    """Build the profiler asked for on the command line (a NullProfiler
+    unless --profile was given)"""
+    if( getattr( args , 'profile_file' , None ) is None ):
+        return( NullProfiler() )
+    if( getattr( args , 'workers' , 1 ) > 1 ):
+        log.warning( '--profile only sees the main process.  Use --workers 1 to time every stage.' )
+    return( Profiler( args.profile_file ,
+                      cprofile = args.profile_cprofile ,
+                      trace_memory = args.profile_tracemalloc ) )
+
+
+class NullStage( object ):
+    __slots__ = ()
+
+    def __enter__( self ):
+        return( self )
+
+    def __exit__( self , exc_type , exc_value , traceback ):
+        return( False )
+
+null_stage = NullStage()
+
+
+class NullProfiler( object ):
+    """Stands in for a Profiler when --profile wasn't given"""
+    enabled = False
+
+    def stage( self , name , document = None ):
+        return( null_stage )
+
+    def write_report( self ):
+        pass
+
+
+class Stage( object ):
+    __slots__ = ( 'profiler' , 'name' , 'document' , 'start' , 'start_memory' )
+
+    def __init__( self , profiler , name , document ):
+        self.profiler = profiler
+        self.name = name
+        self.document = document
+
+    def __enter__( self ):
+        if( self.profiler.trace_memory ):
+            import tracemalloc
+            ## reset_peak() is new in Python 3.9
+            if( hasattr( tracemalloc , 'reset_peak' ) ):
+                tracemalloc.reset_peak()
+            self.start_memory = tracemalloc.get_traced_memory()[ 0 ]
+        self.start = time.perf_counter()
+        return( self )
+
+    def __exit__( self , exc_type , exc_value , traceback ):
+        seconds = time.perf_counter() - self.start
+        allocated = None
+        if( self.profiler.trace_memory ):
+            import tracemalloc
+            ## The peak allocated during the stage or, without
+            ## reset_peak(), the memory still allocated when it ends
+            if( hasattr( tracemalloc , 'reset_peak' ) ):
+                allocated = tracemalloc.get_traced_memory()[ 1 ] - self.start_memory
+            else:
+                allocated = tracemalloc.get_traced_memory()[ 0 ] - self.start_memory
+        self.profiler.record( self.name , self.document , seconds , allocated )
+        return( False )
+
+
+class Profiler( object ):
+    """Accumulate stage timings for a single run.
+
+    Totals are kept per stage and the slowest documents are kept with a
+    breakdown by stage.  Only the slowest documents are kept (rather
+    than every document) so memory use stays flat on large corpora.
+    Stages are assumed not to nest and documents are assumed to be
+    handled one at a time (i.e., in the main process)."""
+    enabled = True
+
+    def __init__( self , report_file , cprofile = False , trace_memory = False ,
+                  slowest_count = 25 ):
+        self.report_file = report_file
+        self.trace_memory = trace_memory
+        self.slowest_count = slowest_count
+        self.stages = {}
+        self.document_count = 0
+        self.current_document = None
+        self.current_stages = {}
+        self.slowest = []
+        self.start = time.perf_counter()
+        self.cprofile = None
+        if( cprofile ):
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        if( trace_memory ):
+            import tracemalloc
+            tracemalloc.start()
+
+    def stage( self , name , document = None ):
+        """Time the body of a with statement as stage name (of document,
+        if given)"""
+        return( Stage( self , name , document ) )
+
+    def record( self , name , document , seconds , allocated = None ):
+        if( name not in self.stages ):
+            self.stages[ name ] = { 'calls' : 0 ,
+                                    'seconds' : 0.0 ,
+                                    'max_seconds' : 0.0 ,
+                                    'max_document' : None }
+            if( self.trace_memory ):
+                self.stages[ name ][ 'peak_allocated_bytes' ] = 0
+        stage = self.stages[ name ]
+        stage[ 'calls' ] += 1
+        stage[ 'seconds' ] += seconds
+        if( seconds > stage[ 'max_seconds' ] ):
+            stage[ 'max_seconds' ] = seconds
+            stage[ 'max_document' ] = document
+        if( allocated is not None and
+            allocated > stage[ 'peak_allocated_bytes' ] ):
+            stage[ 'peak_allocated_bytes' ] = allocated
+        if( document is None ):
+            return
+        if( document != self.current_document ):
+            self.finish_document()
+            self.current_document = document
+        self.current_stages[ name ] = self.current_stages.get( name , 0.0 ) + seconds
+
+    def finish_document( self ):
+        if( self.current_document is None ):
+            return
+        self.document_count += 1
+        entry = ( sum( self.current_stages.values() ) ,
+                  self.document_count ,
+                  self.current_document ,
+                  self.current_stages )
+        if( len( self.slowest ) < self.slowest_count ):
+            heapq.heappush( self.slowest , entry )
+        else:
+            heapq.heappushpop( self.slowest , entry )
+        self.current_document = None
+        self.current_stages = {}
+
+    def function_summary( self , stats , limit = 30 , ours_only = False ):
+        functions = []
+        for ( filename , line_number , function_name ) , ( primitive_calls , calls ,
+                                                           tottime , cumtime , callers ) in stats.stats.items():
+            if( ours_only and
+                ( not os.path.abspath( filename ).startswith( repo_root ) or
+                  os.path.abspath( filename ) == os.path.abspath( __file__ ) ) ):
+                continue
+            if( ours_only ):
+                filename = os.path.relpath( os.path.abspath( filename ) , repo_root )
+            functions.append( { 'function' : '{}:{}({})'.format( filename ,
+                                                                  line_number ,
+                                                                  function_name ) ,
+                                'calls' : calls ,
+                                'tottime' : tottime ,
+                                'cumtime' : cumtime } )
+        functions.sort( key = lambda function : function[ 'cumtime' ] , reverse = True )
+        return( functions[ 0:limit ] )
+
+    def write_report( self ):
+        self.finish_document()
+        wall_seconds = time.perf_counter() - self.start
+        staged_seconds = sum( [ stage[ 'seconds' ] for stage in self.stages.values() ] )
+        for stage in self.stages.values():
+            stage[ 'mean_seconds' ] = stage[ 'seconds' ] / stage[ 'calls' ]
+            stage[ 'share' ] = stage[ 'seconds' ] / staged_seconds if staged_seconds > 0 else None
+        report = { 'script' : os.path.basename( sys.argv[ 0 ] ) ,
+                   'argv' : sys.argv[ 1: ] ,
+                   'wall_seconds' : wall_seconds ,
+                   'unstaged_seconds' : wall_seconds - staged_seconds ,
+                   'documents' : self.document_count ,
+                   'stages' : self.stages ,
+                   'slowest_documents' : [ { 'document' : document ,
+                                             'seconds' : seconds ,
+                                             'stages' : stages }
+                                           for seconds , count , document , stages in sorted( self.slowest ,
+                                                                                              reverse = True ) ] }
+        if( self.cprofile is not None ):
+            self.cprofile.disable()
+            stats_file = '{}.prof'.format( os.path.splitext( self.report_file )[ 0 ] )
+            self.cprofile.dump_stats( stats_file )
+            import pstats
+            stats = pstats.Stats( self.cprofile )
+            report[ 'cprofile' ] = { 'stats_file' : stats_file ,
+                                     'our_functions' : self.function_summary( stats , ours_only = True ) ,
+                                     'all_functions' : self.function_summary( stats ) }
+        if( self.trace_memory ):
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            report[ 'tracemalloc' ] = { 'peak_bytes' : tracemalloc.get_traced_memory()[ 1 ] ,
+                                        'top_allocations' : [ { 'location' : str( statistic.traceback ) ,
+                                                                'size_bytes' : statistic.size ,
+                                                                'count' : statistic.count }
+                                                              for statistic in snapshot.statistics( 'lineno' )[ 0:20 ] ] }
+            tracemalloc.stop()
+        with open( self.report_file , 'w' ) as fp:
+            json.dump( report , fp , indent = 2 )
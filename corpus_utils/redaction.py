@@ -0,0 +1,73 @@
+## Redaction policies for brat strings and the checks that let a
+## patched corpus be compared against its redacted copy
+import re
+
+import hashlib
+import hmac
+
+## Tokens written by HashPolicy
+hash_token_re = re.compile( r'^\[redacted:([0-9a-f]+)\]$' )
+
+#############################################
+## Redaction policies
+#############################################
+
+class RedactedPolicy( object ):
+    """Replace every string with the same placeholder."""
+
+    def __init__( self , placeholder = '[redacted]' ):
+        self.placeholder = placeholder
+
+    def redact( self , text ):
+        return( self.placeholder )
+
+
+class MaskPolicy( object ):
+    """Mask every non-whitespace character so the string keeps its
+    length and shape."""
+
+    def __init__( self , mask_char = 'X' ):
+        self.mask_char = mask_char
+        self.non_space_re = re.compile( r'\S' )
+
+    def redact( self , text ):
+        return( self.non_space_re.sub( self.mask_char , text ) )
+
+
+class HashPolicy( object ):
+    """Replace every string with a token derived from a keyed hash of the
+    string so that the same string always gets the same token and only
+    someone holding the key can link a token back to a candidate
+    string."""
+
+    def __init__( self , key , token_length = 16 ):
+        self.key = key
+        self.token_length = token_length
+
+    def redact( self , text ):
+        digest = hmac.new( self.key ,
+                           text.encode( 'utf-8' ) ,
+                           hashlib.sha256 ).hexdigest()
+        return( '[redacted:{}]'.format( digest[ :self.token_length ] ) )
+
+
+def check_redacted( redacted_text , text , hash_policy = None ):
+    """Check whether text is the string that was redacted into
+    redacted_text.  Masked strings are checked against the mask and hash
+    tokens are checked against hash_policy (when given).  Returns True or
+    False, or None when redacted_text carries nothing to check against
+    (e.g., '[redacted]')."""
+    if( redacted_text == RedactedPolicy().placeholder ):
+        return( None )
+    token_match = hash_token_re.match( redacted_text )
+    if( token_match is not None ):
+        if( hash_policy is None ):
+            return( None )
+        digest = hmac.new( hash_policy.key ,
+                           text.encode( 'utf-8' ) ,
+                           hashlib.sha256 ).hexdigest()
+        return( digest.startswith( token_match.group( 1 ) ) )
+    mask_chars = set( ''.join( redacted_text.split() ) )
+    if( len( mask_chars ) == 1 ):
+        return( MaskPolicy( mask_chars.pop() ).redact( text ) == redacted_text )
+    return( None )
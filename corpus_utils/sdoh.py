@@ -0,0 +1,678 @@
+## Shared pieces of the 2022 n2c2 Track 2 Social Determinants of Health
+## (SDOH) converters:  a single parser for the brat (.ann) files and
+## builders for the SHARPn (cTAKES) and OMOP CDM CAS representations
+import logging as log
+
+import os
+
+import re
+
+#############################################
+## Type names
+#############################################
+
+eventMention_typeString = 'org.apache.ctakes.typesystem.type.textsem.EventMention'
+modifier_typeString = 'org.apache.ctakes.typesystem.type.textsem.Modifier'
+timeMention_typeString = 'org.apache.ctakes.typesystem.type.textsem.TimeMention'
+
+event_typeString = 'org.apache.ctakes.typesystem.type.refsem.Event'
+eventProperties_typeString = 'org.apache.ctakes.typesystem.type.refsem.EventProperties'
+
+umlsConcept_typeString = 'org.apache.ctakes.typesystem.type.refsem.UmlsConcept'
+
+relationArgument_typeString = 'org.apache.ctakes.typesystem.type.relation.RelationArgument'
+binaryTextRelation_typeString = 'org.apache.ctakes.typesystem.type.relation.BinaryTextRelation'
+
+noteNlp_typeString = 'edu.musc.tbic.omop_cdm.Note_Nlp_TableProperties'
+factRelationship_typeString = 'edu.musc.tbic.omop_cdm.Fact_Relationship_TableProperties'
+
+#############################################
+## Concepts and relations
+#############################################
+
+eventConcepts = {}
+##########################################################
+## All Semantics Types are Finding (T033) unless otherwise
+## specified
+####################################################
+## https://uts.nlm.nih.gov/uts/umls/concept/C2184149
+## living situation
+eventConcepts[ 'LivingStatus' ] = ( 'C2184149' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C0439044
+## Living Alone
+eventConcepts[ 'alone' ] = ( 'C0439044' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C0557130
+## Lives with family
+eventConcepts[ 'with_family' ] = ( 'C0557130' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C3242657
+## unrelated person
+eventConcepts[ 'with_others' ] = ( 'C3242657' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C0237154
+## Homelessness
+eventConcepts[ 'homeless' ] = ( 'C0237154' , 'T033' )
+####################################################
+## https://uts.nlm.nih.gov/uts/umls/concept/C0242271
+## Employment status
+eventConcepts[ 'Employment' ] = ( 'C0242271' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C0557351
+## Employed
+eventConcepts[ 'employed' ] = ( 'C0557351' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C0041674
+## Unemployment
+eventConcepts[ 'unemployed' ] = ( 'C0041674' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C0035345
+## Retirement
+eventConcepts[ 'retired' ] = ( 'C0035345' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C0682148
+## Disability status
+eventConcepts[ 'on_disability' ] = ( 'C0682148' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C0038492
+## student (Population Group)
+eventConcepts[ 'student' ] = ( 'C0038492' , 'T098' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C0555052
+## homemaker (Professional or Occupational Group)
+eventConcepts[ 'homemaker' ] = ( 'C0555052' , 'T097' )
+####################################################
+## https://uts.nlm.nih.gov/uts/umls/concept/C0001948
+## Alcohol consumption (Individual Behavior)
+eventConcepts[ 'Alcohol' ] = ( 'C0001948' , 'T055' )
+####################################################
+## https://uts.nlm.nih.gov/uts/umls/concept/C0281875
+## illicit drug use (finding)
+eventConcepts[ 'Drug' ] = ( 'C0281875' , 'T033' )
+####################################################
+## https://uts.nlm.nih.gov/uts/umls/concept/C1287520
+## Tobacco use and exposure – finding
+eventConcepts[ 'Tobacco' ] = ( 'C1287520' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C1971295
+## TOBACCO NON-USER
+eventConcepts[ 'none' ] = ( 'C1971295' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C1698618
+## Ex-tobacco user
+eventConcepts[ 'past' ] = ( 'C1698618' , 'T033' )
+## https://uts.nlm.nih.gov/uts/umls/concept/C3853727
+## Tobacco user
+eventConcepts[ 'current' ] = ( 'C3853727' , 'T033' )
+
+## The OMOP CDM output only uses the CUI
+eventCuis = {}
+for event_type in eventConcepts:
+    eventCuis[ event_type ] = eventConcepts[ event_type ][ 0 ]
+
+modifierClasses = [ 'Amount' ,
+                    'Method' ,
+                    'StatusEmploy' ,
+                    'StatusTime' ,
+                    'Type' ,
+                    'TypeLiving' ]
+timeMentionClasses = [ 'Duration' ,
+                       'Frequency' ,
+                       'History' ]
+attributeClasses = [ 'StatusTimeVal' ,
+                     'StatusEmployVal' ,
+                     'TypeLivingVal' ]
+
+relPairs = { 'IsTriggerFor' : 'HasTrigger' ,
+             'HasStatus' : 'IsStatusFor' ,
+             'HasStatusEmploy' : 'IsStatusEmployFor' ,
+             'HasStatusTime' : 'IsStatusTimeFor' ,
+             'HasDuration' : 'IsDurationFor' ,
+             'HasHistory' : 'IsHistoryFor' ,
+             'HasType' : 'IsTypeFor' ,
+             'HasTypeLiving' : 'IsTypeLivingFor' ,
+             'HasMethod' : 'IsMethodFor' ,
+             'HasAmount' : 'IsAmountFor' ,
+             'HasFrequency' : 'IsFrequencyFor' 
+            }
+relIds = {}
+count = 0
+## Make sure all relations are symmetrical
+## TODO - add relIds mapping to metadata in CAS XMI
+for relA in [ 'IsTriggerFor' ,
+              'HasStatus' ,
+              'HasStatusEmploy' ,
+              'HasStatusTime' ,
+              'HasDuration' ,
+              'HasHistory' , 
+              'HasType' ,
+              'HasTypeLiving' ,
+              'HasMethod' ,
+              'HasAmount' ,
+              'HasFrequency' ]:
+    count += 1
+    relIds[ relA ] = count
+    count += 1
+    relIds[ relPairs[ relA ] ] = count
+    relPairs[ relPairs[ relA ] ] = relA
+
+
+def add_omop_types( typesystem ):
+    """Add the OMOP CDM NOTE_NLP and FACT_RELATIONSHIP tables to a
+    (cTAKES) type system"""
+    ############
+    ## ... for OMOP CDM v5.3 NOTE_NLP table properties
+    ##     https://ohdsi.github.io/CommonDataModel/cdm53.html#NOTE_NLP
+    NoteNlp = typesystem.create_type( name = noteNlp_typeString ,
+                                      supertypeName = 'uima.tcas.Annotation' )
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'note_nlp_id' ,
+                               description = 'A unique identifier for the NLP record.' ,
+                               rangeType = 'uima.cas.Integer' )
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'note_id' ,
+                               description = 'This is the NOTE_ID for the NOTE record the NLP record is associated to.' ,
+                               rangeType = 'uima.cas.Integer' )
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'section_concept_id' ,
+                               description = '' ,
+                               rangeType = 'uima.cas.Integer' )
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'snippet' ,
+                               description = '' ,
+                               rangeType = 'uima.cas.String' )
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'offset' ,
+                               description = '' ,
+                               rangeType = 'uima.cas.Integer' )
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'lexical_variant' ,
+                               description = '' ,
+                               rangeType = 'uima.cas.String' )
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'note_nlp_concept_id' ,
+                               description = '' ,
+                               rangeType = 'uima.cas.Integer' )
+    ## TODO - this really should be an int but we can't look up the appropriate
+    ##        ID without a connected OMOP CDM Concept table
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'note_nlp_source_concept_id' ,
+                               description = '' ,
+                               rangeType = 'uima.cas.String' )
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'nlp_system' ,
+                               description = '' ,
+                               rangeType = 'uima.cas.String' )
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'term_exists' ,
+                               description = 'Term_exists is defined as a flag that indicates if the patient actually has or had the condition. Any of the following modifiers would make Term_exists false: Negation = true; Subject = [anything other than the patient]; Conditional = true; Rule_out = true; Uncertain = very low certainty or any lower certainties. A complete lack of modifiers would make Term_exists true. For the modifiers that are there, they would have to have these values: Negation = false; Subject = patient; Conditional = false; Rule_out = false; Uncertain = true or high or moderate or even low (could argue about low).' ,
+                               rangeType = 'uima.cas.Boolean' )
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'term_temporal' ,
+                               description = '' ,
+                               rangeType = 'uima.cas.String' )
+    typesystem.create_feature( domainType = NoteNlp ,
+                               name = 'term_modifiers' ,
+                               description = '' ,
+                               rangeType = 'uima.cas.String' )
+    ############
+    ## ... for OMOP CDM v5.3 FACT_RELATIONSHIP table properties
+    ##     https://ohdsi.github.io/CommonDataModel/cdm53.html#FACT_RELATIONSHIP
+    FactRelationship = typesystem.create_type( name = factRelationship_typeString ,
+                                               supertypeName = 'uima.tcas.Annotation' )
+    typesystem.create_feature( domainType = FactRelationship ,
+                               name = 'domain_concept_id_1' ,
+                               description = 'The CONCEPT id for the appropriate scoping domain' ,
+                               rangeType = 'uima.cas.Integer' )
+    typesystem.create_feature( domainType = FactRelationship ,
+                               name = 'fact_id_1' ,
+                               description = 'The id for the first fact' ,
+                               rangeType = 'uima.cas.Integer' )
+    typesystem.create_feature( domainType = FactRelationship ,
+                               name = 'domain_concept_id_2' ,
+                               description = 'The CONCEPT id for the appropriate scoping domain' ,
+                               rangeType = 'uima.cas.Integer' )
+    typesystem.create_feature( domainType = FactRelationship ,
+                               name = 'fact_id_2' ,
+                               description = 'The id for the second fact' ,
+                               rangeType = 'uima.cas.Integer' )
+    typesystem.create_feature( domainType = FactRelationship ,
+                               name = 'relationship_concept_id' ,
+                               description = 'This id for the relationship held between the two facts' ,
+                               rangeType = 'uima.cas.Integer' )
+    ####
+    return( typesystem )
+
+
+def loadTypeHandles( typesystem , sharpn = True , omop = False ):
+    """Look up every type we need once per run rather than once per
+    document"""
+    types = {}
+    types[ 'FSArray' ] = typesystem.get_type( 'uima.cas.FSArray' )
+    if( sharpn ):
+        types[ 'EventMention' ] = typesystem.get_type( eventMention_typeString )
+        types[ 'Modifier' ] = typesystem.get_type( modifier_typeString )
+        types[ 'TimeMention' ] = typesystem.get_type( timeMention_typeString )
+        types[ 'Event' ] = typesystem.get_type( event_typeString )
+        types[ 'EventProperties' ] = typesystem.get_type( eventProperties_typeString )
+        types[ 'UmlsConcept' ] = typesystem.get_type( umlsConcept_typeString )
+        types[ 'RelationArgument' ] = typesystem.get_type( relationArgument_typeString )
+        types[ 'BinaryTextRelation' ] = typesystem.get_type( binaryTextRelation_typeString )
+    if( omop ):
+        types[ 'NoteNlp' ] = typesystem.get_type( noteNlp_typeString )
+        types[ 'FactRelationship' ] = typesystem.get_type( factRelationship_typeString )
+    return( types )
+
+
+class ConceptPool( object ):
+    """The UmlsConcepts referenced by a single CAS.  Each concept in
+    eventConcepts is only created and added to the CAS the first time
+    it is looked up so documents don't carry concepts they never
+    mention."""
+    def __init__( self , cas , umlsConceptType ):
+        self.cas = cas
+        self.umlsConceptType = umlsConceptType
+        self.concepts = {}
+
+    def __contains__( self , event_type ):
+        return( event_type in eventConcepts )
+
+    def __getitem__( self , event_type ):
+        if( event_type not in self.concepts ):
+            cui , tui = eventConcepts[ event_type ]
+            concept = self.umlsConceptType( cui = cui , tui = tui )
+            self.cas.add( concept )
+            self.concepts[ event_type ] = concept
+        return( self.concepts[ event_type ] )
+
+#############################################
+## brat (.ann) parsing
+#############################################
+
+textBound_re = re.compile( r'^(T[0-9]+)\s+([\w\-]+)\s+([0-9]+)\s+([0-9]+;[0-9]+\s+)*([0-9]+)\s+(.*)' )
+attribute_re = re.compile( r'^(A[0-9]+)\s+([\w\-]+)\s+(T[0-9]+)\s+(.*)' )
+event_re = re.compile( r'^(E[0-9]+)\s+([A-Za-z]+):(T[0-9]+)\s+(.*)' )
+
+
+def parse_ann_file( input_filename ):
+    """Read a single SDOH .ann file (see parse_ann_lines)"""
+    with open( input_filename , 'r' ) as fp:
+        return( parse_ann_lines( fp ) )
+
+
+def parse_ann_lines( lines ):
+    """Parse the lines of a single SDOH .ann file into the intermediate
+    shared by every output format:
+
+    - eventMentions:  trigger spans by T id with their 'class',
+      'begin', 'end', 'text', and the T id of every argument by role
+    - modifierMentions:  argument spans by T id with their 'role_type'
+      (Modifier or TimeMention), 'class', 'begin', 'end', 'text', and
+      any *Val attribute values
+    - attributes:  ( attribute type , T id , value ) for every *Val
+      attribute in file order
+    - events:  ( trigger type , trigger T id , [ ( role , T id ) ] ) for
+      every event in file order
+    """
+    eventMentions = {}
+    modifierMentions = {}
+    attributes = []
+    events = []
+    for line in lines:
+        line = line.strip()
+        ## Continuous:
+        ## T1    Organization 0 43    International Business Machines Corporation
+        ## Discontinuous (0..23):
+        ## T1	Location 0 5;16 23	North America
+        ## T1	Location 0 5;8 12;16 23	North America
+        ## TODO - add flag to accommodate different scoring styles for
+        ##        discontinuous spans.  Current approach treats these
+        ##        spans as equivalent to the maximal span of all sub-spans.
+        matches = textBound_re.match( line )
+        if( matches ):
+            found_tag = matches.group( 2 )
+            if( found_tag in eventConcepts ):
+                mentions = eventMentions
+                mention = {}
+            elif( found_tag in modifierClasses ):
+                mentions = modifierMentions
+                mention = { 'role_type' : 'Modifier' }
+            elif( found_tag in timeMentionClasses ):
+                mentions = modifierMentions
+                mention = { 'role_type' : 'TimeMention' }
+            else:
+                continue
+            mention[ 'class' ] = found_tag
+            mention[ 'begin' ] = int( matches.group( 3 ) )
+            mention[ 'end' ] = int( matches.group( 5 ) )
+            mention[ 'text' ] = matches.group( 6 )
+            mentions[ matches.group( 1 ) ] = mention
+            continue
+        
+        ## Continuous:
+        ## A4	StatusTimeVal T12 current
+        ## A5	TypeLivingVal T13 with_family
+        ## A6	StatusEmployVal T15 homemaker
+        matches = attribute_re.match( line )
+        if( matches ):
+            found_tag = matches.group( 2 )
+            if( found_tag not in attributeClasses ):
+                log.warning( 'Unknown annotation note: {}'.format( found_tag ) )
+                continue
+            mention_id = matches.group( 3 )
+            annot_val = matches.group( 4 )
+            modifierMentions[ mention_id ][ found_tag ] = annot_val
+            attributes.append( ( found_tag , mention_id , annot_val ) )
+            continue
+        ############
+        ## E1	Tobacco:T1 Status:T2
+        ## E2	Alcohol:T3 Status:T4 Amount:T5 Frequency:T6 Type:T10
+        matches = event_re.match( line )
+        if( matches ):
+            trigger_type = matches.group( 2 )
+            found_tag = matches.group( 3 )
+            arguments = []
+            for relation in matches.group( 4 ).split( ' ' ):
+                rel_entity , rel_tag = relation.split( ':' )
+                ## TODO - handle multiple relations arcs for a
+                ## given type (e.g., "Amount", "Amount2",
+                ## "Amount3", etc.)
+                rel_entity = rel_entity.strip( '0123456789' )
+                eventMentions[ found_tag ][ rel_entity ] = rel_tag
+                arguments.append( ( rel_entity , rel_tag ) )
+            events.append( ( trigger_type , found_tag , arguments ) )
+            continue
+    return( { 'eventMentions' : eventMentions ,
+              'modifierMentions' : modifierMentions ,
+              'attributes' : attributes ,
+              'events' : events } )
+
+def get_note_id( input_filename , note_count ):
+    """OMOP CDM note ids come from numeric filenames (e.g., 0123.ann) or,
+    failing that, the position of the note in the run"""
+    try:
+        return( int( os.path.basename( input_filename )[ 0:-4 ] ) )
+    except ValueError:
+        return( note_count )
+
+
+def count_mentions( doc ):
+    """Number of trigger and argument spans in a parsed .ann file"""
+    return( len( doc[ 'eventMentions' ] ) + len( doc[ 'modifierMentions' ] ) )
+
+#############################################
+## SHARPn (cTAKES) output
+#############################################
+
+def build_sharpn_cas( cas , doc , types ):
+    """Add the SHARPn representation of a parsed document to a CAS (or
+    CAS view)"""
+    eventMentions = doc[ 'eventMentions' ]
+    modifierMentions = doc[ 'modifierMentions' ]
+    ##
+    FSArray = types[ 'FSArray' ]
+    
+    eventMentionType = types[ 'EventMention' ]
+    modifierType = types[ 'Modifier' ]
+    timeMentionType = types[ 'TimeMention' ]
+    
+    eventType = types[ 'Event' ]
+    eventPropertiesType = types[ 'EventProperties' ]
+    
+    relationArgumentType = types[ 'RelationArgument' ]
+    binaryTextRelationType = types[ 'BinaryTextRelation' ]
+
+    eventTypes = ConceptPool( cas , types[ 'UmlsConcept' ] )
+    ####
+    for event_tag in eventMentions:
+        span_class = eventMentions[ event_tag ][ 'class' ]
+        aspect_tag = None
+        aspect_val = None
+        category_tag = None
+        category_val = None
+        ## Main Event
+        if( span_class in [ 'Alcohol' , 'Drug' , 'Tobacco' ,
+                            'LivingStatus' ] ):
+            if( 'Status' not in eventMentions[ event_tag ] ):
+                ## TODO - add explicit warning here
+                continue
+            aspect_tag = eventMentions[ event_tag ][ 'Status' ]
+            aspect_val = modifierMentions[ aspect_tag ][ 'StatusTimeVal' ]
+        ####
+        begin_offset = eventMentions[ event_tag ][ 'begin' ]
+        end_offset = eventMentions[ event_tag ][ 'end' ]
+        ##
+        if( span_class in [ 'Employment' ] ):
+            if( 'Status' not in eventMentions[ event_tag ] ):
+                ## TODO - add explicit warning here
+                continue
+            category_tag = eventMentions[ event_tag ][ 'Status' ]
+            category_val = modifierMentions[ category_tag ][ 'StatusEmployVal' ]
+        elif( span_class in [ 'LivingStatus' ] ):
+            if( 'Type' not in eventMentions[ event_tag ] ):
+                ## TODO - add explicit warning here
+                continue
+            category_tag = eventMentions[ event_tag ][ 'Type' ]
+            category_val = modifierMentions[ category_tag ][ 'TypeLivingVal' ]
+        ################
+        ## The default CUI representation for the event is the
+        ## parent concept for this domain
+        event_cui = eventTypes[ span_class ]
+        if( span_class in [ 'Employment' ] ):
+            event_cui = eventTypes[ category_val ]
+            anEvent = eventType( ontologyConcept = event_cui ,
+                                 properties = eventPropertiesType( category = category_val ) )
+        elif( span_class in [ 'LivingStatus' ] ):
+            event_cui = eventTypes[ category_val ]
+            anEvent = eventType( ontologyConcept = event_cui ,
+                                 properties = eventPropertiesType( aspect = aspect_val ,
+                                                                   category = category_val ) )
+        elif( span_class in [ 'Alcohol' , 'Drug' , 'Tobacco' ] ):
+            if( span_class in [ 'Tobacco' ] ):
+                event_cui = eventTypes[ aspect_val ]
+            anEvent = eventType( ontologyConcept = event_cui ,
+                                 properties = eventPropertiesType( aspect = aspect_val ) )
+        ## Trigger Event Mention
+        anEventMention = eventMentionType( begin = begin_offset ,
+                                           end = end_offset ,
+                                           ontologyConceptArr = FSArray( elements = [ eventTypes[ span_class ] ] ) ,
+                                           event = anEvent )
+        ##
+        cas.add( anEvent )
+        cas.add( anEventMention )
+        ####
+        triggerArgument = None
+        for role_type in [ 'Amount' , 'Method' , 'Status' , 'Type' ,
+                           'Duration' , 'Frequency' , 'History' ]:
+            if( role_type not in eventMentions[ event_tag ] ):
+                continue
+            if( triggerArgument is None ):
+                triggerArgument = relationArgumentType( role = "Trigger" ,
+                                                        argument = anEventMention )
+                cas.add( triggerArgument )
+            ####
+            role_tag = eventMentions[ event_tag ][ role_type ]
+            if( modifierMentions[ role_tag ][ 'role_type' ] == 'Modifier' ):
+                if( role_tag == aspect_tag ):
+                    role_type = aspect_val
+                elif( role_tag == category_tag ):
+                    role_type = category_val
+                else:
+                    role_type = modifierMentions[ role_tag ][ 'class' ]
+                ########
+                roleMention = modifierType( begin = modifierMentions[ role_tag ][ 'begin' ] ,
+                                            end = modifierMentions[ role_tag ][ 'end' ] ,
+                                            category = role_type )
+            elif( modifierMentions[ role_tag ][ 'role_type' ] == 'TimeMention' ):
+                role_type = modifierMentions[ role_tag ][ 'class' ]
+                roleMention = timeMentionType( begin = modifierMentions[ role_tag ][ 'begin' ] ,
+                                               end = modifierMentions[ role_tag ][ 'end' ] ,
+                                               timeClass = role_type )
+            else:
+                log.warning( 'Surprising role_type: {}'.format( modifierMentions[ role_tag ][ 'role_type' ] ) )
+                continue
+            dependentArgument = relationArgumentType( role = role_type ,
+                                                      argument = roleMention )
+            dependentRelation = binaryTextRelationType( arg1 = triggerArgument ,
+                                                        arg2 = dependentArgument )
+            cas.add_all( [ roleMention ,
+                           dependentArgument ,
+                           dependentRelation ] )
+    return( cas )
+
+#############################################
+## OMOP CDM output
+#############################################
+
+def build_omop_relations( cas , doc , types ):
+    """Add a pair of FACT_RELATIONSHIP rows (one in each direction) for
+    every trigger-argument arc of a parsed document to a CAS (or CAS
+    view)"""
+    factRelationshipType = types[ 'FactRelationship' ]
+    for trigger_type , found_tag , arguments in doc[ 'events' ]:
+        trigger_id = found_tag.strip( 'T' )
+        for rel_entity , rel_tag in arguments:
+            rel_id = rel_tag.strip( 'T' )
+            ## TODO - make look-up in real OMOP CDM concept table easier
+            triggerRelType = relIds[ 'Has{}'.format( rel_entity ) ]
+            relTriggerType = relIds[ 'Is{}For'.format( rel_entity ) ]
+            triggerRelRelation = factRelationshipType( domain_concept_id_1 = 1 ,
+                                                       fact_id_1 = trigger_id ,
+                                                       domain_concept_id_2 = 2 ,
+                                                       fact_id_2 = rel_id ,
+                                                       relationship_concept_id = triggerRelType )
+            cas.add( triggerRelRelation )
+            relTriggerRelation = factRelationshipType( domain_concept_id_2 = 1 ,
+                                                       fact_id_2 = trigger_id ,
+                                                       domain_concept_id_1 = 2 ,
+                                                       fact_id_1 = rel_id ,
+                                                       relationship_concept_id = relTriggerType )
+            cas.add( relTriggerRelation )
+    return( cas )
+
+
+def build_omop_cas( cas , doc , types , note_id , skip_relations = False ):
+    """Add the OMOP CDM representation (NOTE_NLP rows and, unless
+    skip_relations is set, FACT_RELATIONSHIP rows) of a parsed document
+    to a CAS (or CAS view)"""
+    eventMentions = doc[ 'eventMentions' ]
+    modifierMentions = doc[ 'modifierMentions' ]
+    ##
+    noteNlpType = types[ 'NoteNlp' ]
+    ##
+    if( not skip_relations ):
+        build_omop_relations( cas , doc , types )
+    for event_tag in eventMentions:
+        span_class = eventMentions[ event_tag ][ 'class' ]
+        ## Main Event
+        if( span_class in [ 'Alcohol' , 'Drug' , 'Tobacco' ,
+                            'LivingStatus' ] ):
+            if( 'Status' not in eventMentions[ event_tag ] ):
+                ## TODO - add explicit warning here
+                continue
+            aspect_tag = eventMentions[ event_tag ][ 'Status' ]
+            aspect_val = modifierMentions[ aspect_tag ][ 'StatusTimeVal' ]
+        ####
+        begin_offset = eventMentions[ event_tag ][ 'begin' ]
+        end_offset = eventMentions[ event_tag ][ 'end' ]
+        text_span = eventMentions[ event_tag ][ 'text' ]
+        ##
+        if( span_class in [ 'Employment' ] ):
+            if( 'Status' not in eventMentions[ event_tag ] ):
+                ## TODO - add explicit warning here
+                continue
+            category_tag = eventMentions[ event_tag ][ 'Status' ]
+            category_val = modifierMentions[ category_tag ][ 'StatusEmployVal' ]
+        elif( span_class in [ 'LivingStatus' ] ):
+            if( 'Type' not in eventMentions[ event_tag ] ):
+                ## TODO - add explicit warning here
+                continue
+            category_tag = eventMentions[ event_tag ][ 'Type' ]
+            category_val = modifierMentions[ category_tag ][ 'TypeLivingVal' ]
+        ####
+        term_exists = 'y'
+        term_temporal = ''
+        modifiers = []
+        if( span_class in [ 'Employment' ] ):
+            modifiers.append( 'StatusVal={}'.format( category_val ) )
+        elif( span_class in [ 'LivingStatus' ] ):
+            if( aspect_val in [ 'past' , 'future' ] ):
+                term_exists = 'n'
+            term_temporal = aspect_val
+            modifiers.append( 'StatusVal={}'.format( aspect_val ) )
+            modifiers.append( 'TypeVal={}'.format( category_val ) )
+        elif( span_class in [ 'Alcohol' , 'Drug' , 'Tobacco' ] ):
+            if( aspect_val in [ 'none' , 'past' ] ):
+                term_exists = 'n'
+            term_temporal = aspect_val
+            modifiers.append( 'TriggerVal={}'.format( span_class ) )
+            modifiers.append( 'StatusVal={}'.format( aspect_val ) )
+        ########
+        note_nlp_id = event_tag.strip( 'T' )
+        for role_type in [ 'Amount' , 'Method' , 'Status' , 'Type' ,
+                           'Duration' , 'Frequency' , 'History' ]:
+            if( role_type not in eventMentions[ event_tag ] ):
+                continue
+            ####
+            role_tag = eventMentions[ event_tag ][ role_type ]
+            role_id = role_tag.strip( 'T' )
+            role_cui = ''
+            role_modifiers = []
+            if( not skip_relations ):
+                role_modifiers.append( '{}={}'.format( 'Trigger' ,
+                                                       note_nlp_id ) )
+                modifiers.append( '{}={}'.format( role_type ,
+                                                  role_id ) )
+            if( span_class in [ 'Employment' ] ):
+                if( role_type == 'Status' ):
+                    role_cui = eventCuis[ category_val ]
+                    role_modifiers.append( '{}={}'.format( 'StatusVal' ,
+                                                           category_val ) )
+            elif( span_class in [ 'LivingStatus' ] ):
+                if( role_type == 'Status' ):
+                    role_cui = modifierMentions[ role_tag ][ 'StatusTimeVal' ]
+                    role_modifiers.append( '{}={}'.format( 'StatusVal' ,
+                                                           aspect_val ) )
+                elif( role_type == 'Type' ):
+                    role_cui = eventCuis[ category_val ]
+                    role_modifiers.append( '{}={}'.format( 'TypeVal' ,
+                                                           category_val ) )
+            elif( span_class in [ 'Tobacco' ] ):
+                if( role_type == 'Status' ):
+                    role_cui = eventCuis[ aspect_val ]
+                    role_modifiers.append( '{}={}'.format( 'StatusVal' ,
+                                                           aspect_val ) )
+        ## Trigger Event Mention
+        anEventMention = noteNlpType( note_nlp_id = note_nlp_id ,
+                                      note_id = note_id ,
+                                      begin = begin_offset ,
+                                      end = end_offset ,
+                                      offset = begin_offset ,
+                                      lexical_variant = text_span ,
+                                      nlp_system = 'Reference Standard' ,
+                                      note_nlp_source_concept_id = eventCuis[ span_class ] ,
+                                      term_exists = term_exists ,
+                                      term_temporal = term_temporal ,
+                                      term_modifiers = ';'.join( modifiers ) )
+        cas.add( anEventMention )
+    ######## Now tackel the modifiers
+    for role_tag in modifierMentions:
+        role_type = modifierMentions[ role_tag ][ 'class' ]
+        role_id = role_tag.strip( 'T' )
+        role_modifiers = []
+        begin_offset = modifierMentions[ role_tag ][ 'begin' ]
+        end_offset = modifierMentions[ role_tag ][ 'end' ]
+        text_span = modifierMentions[ role_tag ][ 'text' ]
+        cui_source = None
+        if( role_type == 'StatusTime' ):
+            cui_source = 'StatusTimeVal'
+        elif( role_type == 'StatusEmploy' ):
+            cui_source = 'StatusEmployVal'
+        elif( role_type == 'TypeLiving' ):
+            cui_source = 'TypeLivingVal'
+        if( cui_source is None ):
+            role_cui = role_type
+        else:
+            role_cui = modifierMentions[ role_tag ][ cui_source ]
+        roleMention = noteNlpType( note_nlp_id = role_id ,
+                                   note_id = note_id ,
+                                   begin = begin_offset ,
+                                   end = end_offset ,
+                                   offset = begin_offset ,
+                                   lexical_variant = text_span ,
+                                   nlp_system = 'Reference Standard' ,
+                                   note_nlp_source_concept_id = role_cui ,
+                                   ##term_exists = '' ,
+                                   ##term_temporal = '' ,
+                                   term_modifiers = ';'.join( role_modifiers ) )
+        cas.add( roleMention )
+    return( cas )
@@ -0,0 +1,329 @@
+## Synthetic notes shaped like the corpora the scripts in this
+## repository convert.  The real corpora can't be copied onto build
+## machines so benchmarks run against these instead.  Every note is
+## derived from a seed and its name alone so any subset of a corpus
+## can be regenerated (in any order, by any number of workers) and
+## come out byte-for-byte the same.
+import random
+
+from xml.sax.saxutils import escape , quoteattr
+
+#############################################
+## Vocabulary
+#############################################
+
+filler_sentences = [ 'Patient seen in clinic for follow up' ,
+                     'Vital signs were reviewed and are stable' ,
+                     'No acute distress noted on examination' ,
+                     'Lungs are clear to auscultation bilaterally' ,
+                     'Heart has a regular rate and rhythm' ,
+                     'Abdomen is soft and non-tender' ,
+                     'Medications were reconciled with the patient' ,
+                     'Plan to continue the current regimen' ,
+                     'Labs drawn today will be reviewed at the next visit' ,
+                     'Patient agrees with the plan of care' ,
+                     'Denies chest pain or shortness of breath' ,
+                     'Will return to clinic in three months' ]
+
+section_headers = [ 'HISTORY OF PRESENT ILLNESS:' ,
+                    'SOCIAL HISTORY:' ,
+                    'PHYSICAL EXAM:' ,
+                    'ASSESSMENT AND PLAN:' ]
+
+## Trigger phrases for each SDOH event type
+sdoh_triggers = { 'Alcohol' : [ 'drinks' , 'alcohol' , 'EtOH' , 'beer' ] ,
+                  'Drug' : [ 'illicit drugs' , 'marijuana' , 'cocaine' , 'IVDU' ] ,
+                  'Tobacco' : [ 'smokes' , 'tobacco' , 'cigarettes' , 'smoker' ] ,
+                  'Employment' : [ 'works' , 'employed' , 'job' , 'occupation' ] ,
+                  'LivingStatus' : [ 'lives' , 'resides' , 'living situation' ] }
+
+## Argument roles of each event type (other than Status) and the span
+## class used for each role
+sdoh_roles = { 'Alcohol' : [ 'Amount' , 'Frequency' , 'Duration' , 'History' , 'Type' ] ,
+               'Drug' : [ 'Amount' , 'Frequency' , 'Duration' , 'History' , 'Method' , 'Type' ] ,
+               'Tobacco' : [ 'Amount' , 'Frequency' , 'Duration' , 'History' , 'Type' ] ,
+               'Employment' : [ 'Duration' , 'History' , 'Type' ] ,
+               'LivingStatus' : [ 'Duration' , 'History' ] }
+
+sdoh_role_phrases = { 'Amount' : [ '1 ppd' , '2 drinks' , 'a six pack' , 'half a pack' ] ,
+                      'Frequency' : [ 'daily' , 'weekly' , 'on weekends' , 'twice a month' ] ,
+                      'Duration' : [ 'for 10 years' , 'since 2015' , 'for several months' ] ,
+                      'History' : [ 'in his 20s' , 'until last year' , 'as a teenager' ] ,
+                      'Method' : [ 'IV' , 'smoked' , 'intranasal' ] ,
+                      'Type' : [ 'wine' , 'cigars' , 'heroin' , 'construction' , 'part time' ] }
+
+## Status phrases by attribute value
+status_time_phrases = { 'none' : [ 'denies' , 'never' , 'does not' ] ,
+                        'current' : [ 'currently' , 'still' , 'reports' ] ,
+                        'past' : [ 'formerly' , 'quit' , 'previously' ] ,
+                        'future' : [ 'plans to' , 'will be' ] }
+status_employ_phrases = { 'employed' : [ 'full time' , 'currently' ] ,
+                          'unemployed' : [ 'unemployed' , 'out of work' ] ,
+                          'retired' : [ 'retired' ] ,
+                          'on_disability' : [ 'on disability' ] ,
+                          'student' : [ 'student' , 'in school' ] ,
+                          'homemaker' : [ 'homemaker' , 'stays at home' ] }
+type_living_phrases = { 'alone' : [ 'alone' , 'by himself' ] ,
+                        'with_family' : [ 'with family' , 'with his wife' , 'with her children' ] ,
+                        'with_others' : [ 'with roommates' , 'with a friend' ] ,
+                        'homeless' : [ 'homeless' , 'in a shelter' ] }
+
+## Status values that every converter (including the OMOP CDM CUI
+## lookups) understands for each event type
+event_status_values = { 'Alcohol' : [ 'none' , 'current' , 'past' ] ,
+                        'Drug' : [ 'none' , 'current' , 'past' ] ,
+                        'Tobacco' : [ 'none' , 'current' , 'past' ] ,
+                        'LivingStatus' : [ 'current' , 'past' , 'future' ] }
+
+## PHI types as ( i2b2 tag , i2b2 TYPE , NLM-Scrubber tag )
+phi_types = { 'DATE' : ( 'DATE' , 'DATE' , 'DATE' ) ,
+              'NAME' : ( 'NAME' , 'PATIENT' , 'PERSONALNAME' ) ,
+              'PHONE' : ( 'CONTACT' , 'PHONE' , 'PHONE' ) }
+
+first_names = [ 'John' , 'Maria' , 'Wei' , 'Aisha' , 'Carlos' , 'Emily' ]
+last_names = [ 'Smith' , 'Garcia' , 'Chen' , 'Okafor' , 'Nguyen' , 'Miller' ]
+month_names = [ 'January' , 'February' , 'March' , 'April' , 'May' , 'June' ,
+                'July' , 'August' , 'September' , 'October' , 'November' , 'December' ]
+
+
+def phi_text( rng , phi_type ):
+    if( phi_type == 'DATE' ):
+        year = rng.randrange( 1950 , 2021 )
+        month = rng.randrange( 1 , 13 )
+        day = rng.randrange( 1 , 29 )
+        return( rng.choice( [ '{:02d}/{:02d}/{}'.format( month , day , year ) ,
+                              '{}/{}/{:02d}'.format( month , day , year % 100 ) ,
+                              '{}-{:02d}-{:02d}'.format( year , month , day ) ,
+                              '{} {}'.format( month_names[ month - 1 ] , year ) ,
+                              '{}'.format( year ) ] ) )
+    elif( phi_type == 'NAME' ):
+        return( '{} {}'.format( rng.choice( first_names ) ,
+                                rng.choice( last_names ) ) )
+    return( '({}) {}-{}'.format( rng.randrange( 200 , 1000 ) ,
+                                 rng.randrange( 200 , 1000 ) ,
+                                 rng.randrange( 1000 , 10000 ) ) )
+
+
+phi_sentences = { 'DATE' : [ 'Last seen on {}' , 'Admitted {} for observation' ,
+                             'Next appointment scheduled for {}' ] ,
+                  'NAME' : [ 'Patient {} presents today' , 'Discussed with Dr. {}' ,
+                             'Accompanied by {}' ] ,
+                  'PHONE' : [ 'Call back number is {}' , 'Pharmacy can be reached at {}' ] }
+
+#############################################
+## Notes
+#############################################
+
+class SyntheticNote( object ):
+    """A single generated note:  its text, the SDOH spans
+    (mentions), attributes, and events annotated on it, and the PHI
+    spans in it.  Mentions are ( T id , class , begin , end , text ),
+    attributes are ( attribute type , T id , value ), events are
+    ( trigger type , trigger T id , [ ( role , T id ) ] ), and PHI
+    spans are ( PHI type , begin , end , text )."""
+    def __init__( self , name ):
+        self.name = name
+        self.pieces = []
+        self.length = 0
+        self.mentions = []
+        self.attributes = []
+        self.events = []
+        self.phi = []
+
+    @property
+    def text( self ):
+        return( ''.join( self.pieces ) )
+
+    def add_text( self , text ):
+        self.pieces.append( text )
+        self.length += len( text )
+
+    def trim( self , characters = None ):
+        """Strip trailing whitespace from the last piece of text.  Only
+        plain text (never a span) ends a sentence so this can't move
+        any offsets."""
+        last_piece = self.pieces[ -1 ]
+        self.pieces[ -1 ] = last_piece.rstrip( characters )
+        self.length -= len( last_piece ) - len( self.pieces[ -1 ] )
+
+    def add_mention( self , span_class , text ):
+        mention_id = 'T{}'.format( len( self.mentions ) + 1 )
+        self.mentions.append( ( mention_id , span_class ,
+                                self.length , self.length + len( text ) ,
+                                text ) )
+        self.add_text( text )
+        return( mention_id )
+
+    def add_phi( self , phi_type , text ):
+        self.phi.append( ( phi_type , self.length ,
+                           self.length + len( text ) , text ) )
+        self.add_text( text )
+
+
+def add_sdoh_sentence( note , rng ):
+    event_type = rng.choice( sorted( sdoh_triggers ) )
+    arguments = []
+    note.add_text( 'Patient ' )
+    ## Status comes first, then the trigger, then any other arguments
+    if( event_type == 'Employment' ):
+        status_val = rng.choice( sorted( status_employ_phrases ) )
+        status_id = note.add_mention( 'StatusEmploy' ,
+                                      rng.choice( status_employ_phrases[ status_val ] ) )
+        note.attributes.append( ( 'StatusEmployVal' , status_id , status_val ) )
+    else:
+        status_val = rng.choice( event_status_values[ event_type ] )
+        status_id = note.add_mention( 'StatusTime' ,
+                                      rng.choice( status_time_phrases[ status_val ] ) )
+        note.attributes.append( ( 'StatusTimeVal' , status_id , status_val ) )
+    arguments.append( ( 'Status' , status_id ) )
+    note.add_text( ' ' )
+    trigger_id = note.add_mention( event_type ,
+                                   rng.choice( sdoh_triggers[ event_type ] ) )
+    if( event_type == 'LivingStatus' ):
+        note.add_text( ' ' )
+        type_val = rng.choice( sorted( type_living_phrases ) )
+        type_id = note.add_mention( 'TypeLiving' ,
+                                    rng.choice( type_living_phrases[ type_val ] ) )
+        note.attributes.append( ( 'TypeLivingVal' , type_id , type_val ) )
+        arguments.append( ( 'Type' , type_id ) )
+    for role in sdoh_roles[ event_type ]:
+        if( rng.random() < 0.3 ):
+            note.add_text( ' ' )
+            arguments.append( ( role ,
+                                note.add_mention( role ,
+                                                  rng.choice( sdoh_role_phrases[ role ] ) ) ) )
+    note.add_text( '. ' )
+    note.events.append( ( event_type , trigger_id , arguments ) )
+
+
+def add_phi_sentence( note , rng ):
+    phi_type = rng.choice( sorted( phi_types ) )
+    before , after = rng.choice( phi_sentences[ phi_type ] ).split( '{}' )
+    note.add_text( before )
+    note.add_phi( phi_type , phi_text( rng , phi_type ) )
+    note.add_text( '{}. '.format( after ) )
+
+
+def generate_note( name , seed = 0 , note_length = 2000 ,
+                   sdoh_density = 2.0 , phi_density = 2.0 ):
+    """Generate a note of roughly note_length characters with
+    sdoh_density SDOH events and phi_density PHI spans per 1,000
+    characters.  Sentences are grouped into paragraphs separated by
+    blank lines under the usual section headers."""
+    rng = random.Random( '{}:{}'.format( seed , name ) )
+    sentences = [ add_sdoh_sentence ] * int( round( sdoh_density * note_length / 1000.0 ) )
+    sentences += [ add_phi_sentence ] * int( round( phi_density * note_length / 1000.0 ) )
+    rng.shuffle( sentences )
+    note = SyntheticNote( name )
+    paragraph_length = 0
+    while( note.length < note_length or
+           len( sentences ) > 0 ):
+        if( paragraph_length == 0 ):
+            note.add_text( '{}\n'.format( rng.choice( section_headers ) ) )
+        ## Spread the annotated sentences out over the whole note
+        remaining = max( note_length - note.length , 1 )
+        if( len( sentences ) > 0 and
+            rng.random() < len( sentences ) * 80.0 / remaining ):
+            sentences.pop()( note , rng )
+        else:
+            note.add_text( '{}. '.format( rng.choice( filler_sentences ) ) )
+        paragraph_length += 1
+        if( paragraph_length >= rng.randrange( 3 , 8 ) ):
+            note.trim( ' ' )
+            note.add_text( '\n\n' )
+            paragraph_length = 0
+    note.trim()
+    return( note )
+
+#############################################
+## Output formats
+#############################################
+
+def sdoh_ann_lines( note ):
+    """The brat standoff (.ann) lines of a note's SDOH annotations in
+    the n2c2 2022 Track 2 style"""
+    lines = []
+    for mention_id , span_class , begin_offset , end_offset , text in note.mentions:
+        lines.append( '{}\t{} {} {}\t{}'.format( mention_id , span_class ,
+                                                 begin_offset , end_offset ,
+                                                 text ) )
+    for attribute_idx , ( attribute_type , mention_id , value ) in enumerate( note.attributes ):
+        lines.append( 'A{}\t{} {} {}'.format( attribute_idx + 1 , attribute_type ,
+                                              mention_id , value ) )
+    for event_idx , ( event_type , trigger_id , arguments ) in enumerate( note.events ):
+        lines.append( 'E{}\t{}:{} {}'.format( event_idx + 1 , event_type , trigger_id ,
+                                              ' '.join( [ '{}:{}'.format( role , mention_id )
+                                                          for role , mention_id in arguments ] ) ) )
+    return( lines )
+
+
+def knowtator_xml( note ):
+    """A .knowtator.xml file with one mention per SDOH span.  Attribute
+    values are attached to their spans as string slots."""
+    slots = {}
+    for attribute_type , mention_id , value in note.attributes:
+        slots.setdefault( mention_id , [] ).append( ( attribute_type , value ) )
+    lines = [ '<?xml version="1.0" encoding="UTF-8"?>' ,
+              '<annotations textSource={}>'.format( quoteattr( '{}.txt'.format( note.name ) ) ) ]
+    slot_count = 0
+    for mention_id , span_class , begin_offset , end_offset , text in note.mentions:
+        instance_id = 'Synthetic_Instance_{}'.format( mention_id )
+        lines.append( '  <annotation>' )
+        lines.append( '    <mention id="{}" />'.format( instance_id ) )
+        lines.append( '    <span start="{}" end="{}" />'.format( begin_offset , end_offset ) )
+        lines.append( '    <spannedText>{}</spannedText>'.format( escape( text ) ) )
+        lines.append( '  </annotation>' )
+        lines.append( '  <classMention id="{}">'.format( instance_id ) )
+        lines.append( '    <mentionClass id="{}">{}</mentionClass>'.format( span_class ,
+                                                                             escape( text ) ) )
+        slot_lines = []
+        for slot_name , value in slots.get( mention_id , [] ):
+            slot_count += 1
+            slot_id = 'Synthetic_Slot_{}'.format( slot_count )
+            lines.append( '    <hasSlotMention id="{}" />'.format( slot_id ) )
+            slot_lines.append( '  <stringSlotMention id="{}">'.format( slot_id ) )
+            slot_lines.append( '    <mentionSlot id="{}" />'.format( slot_name ) )
+            slot_lines.append( '    <stringSlotMentionValue value={} />'.format( quoteattr( value ) ) )
+            slot_lines.append( '  </stringSlotMention>' )
+        lines.append( '  </classMention>' )
+        lines.extend( slot_lines )
+    lines.append( '</annotations>' )
+    return( '\n'.join( lines ) + '\n' )
+
+
+def i2b2_xml( note ):
+    """An i2b2 de-identification style XML file with the note in <TEXT>
+    and every PHI span in <TAGS>"""
+    lines = [ '<?xml version="1.0" encoding="UTF-8" ?>' ,
+              '<deIdi2b2>' ,
+              '<TEXT><![CDATA[{}]]></TEXT>'.format( note.text ) ,
+              '<TAGS>' ]
+    for phi_idx , ( phi_type , begin_offset , end_offset , text ) in enumerate( note.phi ):
+        tag , tag_type , nlm_tag = phi_types[ phi_type ]
+        lines.append( '<{} id="P{}" start="{}" end="{}" text={} TYPE="{}" comment="" />'.format( tag ,
+                                                                                               phi_idx ,
+                                                                                               begin_offset ,
+                                                                                               end_offset ,
+                                                                                               quoteattr( text ) ,
+                                                                                               tag_type ) )
+    lines.append( '</TAGS>' )
+    lines.append( '</deIdi2b2>' )
+    return( '\n'.join( lines ) + '\n' )
+
+
+def nlm_scrubbed_text( note ):
+    """The note as NLM-Scrubber would write it (.nphi.txt):  every PHI
+    span replaced by its [TAG] and the post-text metadata block at the
+    end"""
+    note_text = note.text
+    pieces = []
+    last_end = 0
+    for phi_type , begin_offset , end_offset , text in note.phi:
+        pieces.append( note_text[ last_end:begin_offset ] )
+        pieces.append( '[{}]'.format( phi_types[ phi_type ][ 2 ] ) )
+        last_end = end_offset
+    pieces.append( note_text[ last_end: ] )
+    pieces.append( '\n\n##### DOCUMENT #############################################################\n' )
+    pieces.append( 'Document name:  {}.txt\n'.format( note.name ) )
+    pieces.append( 'PHI replaced:  {}\n'.format( len( note.phi ) ) )
+    return( ''.join( pieces ) )
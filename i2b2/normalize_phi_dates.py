@@ -3,8 +3,6 @@ import logging as log
 
 import argparse
 
-from tqdm import tqdm
-
 import glob
 import os
 ## TODO - use warnings
@@ -14,7 +12,17 @@ import re
 
 import random
 
-from lxml import etree as ET
+import hashlib
+import hmac
+
+import multiprocessing
+
+
+sys.path.insert( 0 , os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' ) )
+from corpus_utils.profiling import add_profile_arguments , init_profiler , NullProfiler
+from corpus_utils.metrics import add_metrics_arguments , init_metrics , file_bytes , run_timed
+from corpus_utils.lazy import progress
+from corpus_utils.options import add_progressbar_arguments , add_workers_arguments , init_progressbar
 
 def initialize_arg_parser():
     parser = argparse.ArgumentParser( description = """
@@ -24,11 +32,7 @@ Normalize all years found in <DATE...TYPE="DATE".../> annotations for i2b2 datas
                          help = "print more information" ,
                          action = "store_true" )
 
-    parser.add_argument( '--progressbar-output' ,
-                         dest = 'progressbar_output' ,
-                         default = 'stderr' ,
-                         choices = [ 'stderr' , 'stdout' , 'none' ] ,
-                         help = "Pipe the progress bar to stderr, stdout, or neither" )
+    add_progressbar_arguments( parser )
     
     parser.add_argument( '--input' , required = True ,
                          dest = "input_dir",
@@ -41,7 +45,26 @@ Normalize all years found in <DATE...TYPE="DATE".../> annotations for i2b2 datas
     parser.add_argument( '--exceptions' , default = None ,
                          dest = "exceptions_file",
                          help = "Tab-delimited list of date strings with numerical components that don't match a pattern" )
-    
+
+    parser.add_argument( '--seed' , default = None ,
+                         dest = "seed",
+                         help = "Secret key for deterministic date shifting. Without a seed, every year is drawn independently at random (legacy behavior)" )
+
+    parser.add_argument( '--shift-scope' ,
+                         dest = 'shift_scope' ,
+                         default = 'document' ,
+                         choices = [ 'document' , 'patient' ] ,
+                         help = "Share one year shift across each document or across all documents for the same patient (only used with --seed)" )
+
+    parser.add_argument( '--patient-pattern' ,
+                         dest = 'patient_pattern' ,
+                         default = r'^([^-_.]+)' ,
+                         help = "Regular expression whose first group extracts the patient id from a filename (e.g., '100' from '100-01.xml')" )
+
+    add_workers_arguments( parser , 'normalize files' )
+
+    add_profile_arguments( parser )
+    add_metrics_arguments( parser )
     ##
     return parser
 
@@ -52,19 +75,11 @@ def get_arguments( command_line_args ):
     ##
     return args
 
-def init_args():
+def init_args( command_line_args = None ):
     ##
-    args = get_arguments( sys.argv[ 1: ] )
+    args = get_arguments( command_line_args )
     ## Configure progressbar peformance
-    if( args.progressbar_output == 'none' ):
-        args.progressbar_disabled = True
-        args.progressbar_file = None
-    else:
-        args.progressbar_disabled = False
-        if( args.progressbar_output == 'stderr' ):
-            args.progressbar_file = sys.stderr
-        elif( args.progressbar_output == 'stdout' ):
-            args.progressbar_file = sys.stdout
+    init_progressbar( args )
     bad_args_flag = False
     ##
     if( not os.path.exists( args.input_dir ) ):
@@ -87,41 +102,191 @@ def init_args():
     return args
 
 #############################################
-## 
+## core functions
 #############################################
 
-if __name__ == "__main__":
-    ##
-    args = init_args()
-    ##
-    if( args.exceptions_file is not None ):
-        with open( args.exceptions_file , 'w' ) as fp:
-            fp.write( '{}\t{}\t{}\t{}\n'.format( 'Filename' ,
-                                                 'Begin' ,
-                                                 'End' ,
-                                                 'Annotation' ) )
-    ##########################
-    ## Walk the input directory and write each file to the new output directory
-    file_list = set( [os.path.basename(x) for x in glob.glob( '{}/*.xml'.format( args.input_dir ) ) ] )
-    ##########################
-    for this_filename in tqdm( sorted( file_list ) , total = len( file_list ) ):
-        input_file = os.path.join( args.input_dir , this_filename )
-        output_file = os.path.join( args.output_dir , this_filename )
-        input_tree = ET.parse( input_file )
-        input_root = input_tree.getroot()
-        body_node = None
-        tags_node = None
-        for node in input_root:
-            if( node.tag == 'TEXT' ):
-                body_node = node
-                note_text = node.text
-            elif( node.tag == 'TAGS' ):
-                tags_node = node
-        if( note_text is None ):
-            log.warn( 'Note \'{}\' lacks a body. Skipping it.'.format( this_filename ) )
-            continue
-        if( tags_node is None ):
-            log.warn( 'Note \'{}\' doesn\'t seem to have any <TAGS>.'.format( this_filename ) )
+MIN_YEAR = 1950
+MAX_YEAR = 2021
+## Seeded shifts move every year of a shift key by the same number of
+## years, between 1 and MAX_YEAR_SHIFT in either direction
+MAX_YEAR_SHIFT = 10
+
+class DateShifter( object ):
+    """Pick surrogate years for date annotations.
+
+    With a seed, every shift key (a document or patient id) gets a
+    fixed year offset derived from an HMAC of the key.  The same
+    original year always maps to the same surrogate year for a given
+    key, regardless of which notes were seen first, so reruns and
+    parallel workers agree.  The offset is never zero and is added
+    as-is so the order of and intervals between the dates of a key are
+    kept.  Surrogate years that would leave [MIN_YEAR, MAX_YEAR) are
+    clamped to it (and logged) rather than wrapped around.
+
+    Without a seed, every year, two-digit year, and decade is drawn
+    independently from the global random module with the same ranges
+    as earlier releases.
+    """
+    def __init__( self , seed = None ,
+                  shift_scope = 'document' ,
+                  patient_pattern = r'^([^-_.]+)' ):
+        self.seed = seed
+        self.shift_scope = shift_scope
+        self.patient_pattern = re.compile( patient_pattern )
+        self.offsets = {}
+
+    def shift_key( self , filename ):
+        doc_id = re.sub( r'\.xml$' , '' , os.path.basename( filename ) )
+        if( self.shift_scope == 'patient' ):
+            patient_match = self.patient_pattern.search( doc_id )
+            if( patient_match ):
+                return( patient_match.group( 1 ) )
+            log.warning( 'No patient id found in \'{}\'. Shifting it as its own patient.'.format( filename ) )
+        return( doc_id )
+
+    def year_offset( self , shift_key ):
+        if( shift_key not in self.offsets ):
+            digest = hmac.new( self.seed.encode( 'utf8' ) ,
+                               shift_key.encode( 'utf8' ) ,
+                               hashlib.sha256 ).digest()
+            offset = int.from_bytes( digest[ 0:8 ] , 'big' ) % ( 2 * MAX_YEAR_SHIFT )
+            ## 0..N-1 -> -N..-1 and N..2N-1 -> 1..N
+            if( offset < MAX_YEAR_SHIFT ):
+                offset -= MAX_YEAR_SHIFT
+            else:
+                offset -= MAX_YEAR_SHIFT - 1
+            self.offsets[ shift_key ] = offset
+        return( self.offsets[ shift_key ] )
+
+    def new_year( self , shift_key , year ):
+        if( self.seed is None ):
+            return( random.randrange( MIN_YEAR , MAX_YEAR ) )
+        new_year = year + self.year_offset( shift_key )
+        if( new_year < MIN_YEAR or new_year >= MAX_YEAR ):
+            clamped_year = min( max( new_year , MIN_YEAR ) , MAX_YEAR - 1 )
+            log.warning( 'Surrogate year {} for {} in \'{}\' is out of range. Using {}.'.format( new_year ,
+                                                                                               year ,
+                                                                                               shift_key ,
+                                                                                               clamped_year ) )
+            new_year = clamped_year
+        return( new_year )
+
+    def new_two_digit_year( self , shift_key , year ):
+        """Surrogate for a two-digit year (e.g., 98 -> 03)"""
+        if( self.seed is None ):
+            return( random.choice( [ random.randrange( 50 , 99 ) ,
+                                     random.randrange( 0 , 21 ) ] ) )
+        return( self.new_year( shift_key , expand_two_digit_year( year ) ) % 100 )
+
+    def new_decade( self , shift_key , decade ):
+        """First three digits of the surrogate for a decade (e.g., 1990 -> 196)"""
+        if( self.seed is None ):
+            return( random.randrange( 195 , 201 ) )
+        return( self.new_year( shift_key , decade ) // 10 )
+
+    def new_two_digit_decade( self , shift_key , decade ):
+        """Tens digit of the surrogate for a two-digit decade (e.g., 90 -> 6)"""
+        if( self.seed is None ):
+            return( int( random.choice( [ '5' , '6' , '7' , '8' , '9' ,
+                                          '0' , '1' ] ) ) )
+        return( self.new_year( shift_key , expand_two_digit_year( decade ) ) // 10 % 10 )
+
+
+def expand_two_digit_year( year ):
+    ## Two-digit years in these corpora fall on either side of 2000
+    if( year < 50 ):
+        return( 2000 + year )
+    return( 1900 + year )
+
+
+def surrogate_date_text( tag_text , shifter , shift_key ):
+    """Return tag_text with its year replaced by a surrogate year or
+    None if the string doesn't match any known date pattern.  The
+    surrogate always has the same length as the original."""
+    if( re.fullmatch( r'(\d\d?[ -/\.]\d{2}[ -/\.])(\d{2})' , tag_text ) or
+        re.fullmatch( r'(\d{2}[ -/\.]\d\d?[ -/\.])(\d{2})' , tag_text ) or
+        re.fullmatch( r'(\d[ -/\.]\d[ -/\.])(\d{2})' , tag_text ) or
+        re.fullmatch( r'\'(\d{2})' , tag_text ) ):
+        new_year = shifter.new_two_digit_year( shift_key , int( tag_text[ -2: ] ) )
+        return( '{0}{1:02d}'.format( tag_text[ :-2 ] , new_year ) )
+    elif( re.fullmatch( r'(\d\d?[ -/\.]\d{2}[ -/\.])(\d{4})' , tag_text ) or
+          re.fullmatch( r'(\d{2}[ -/\.]\d\d?[ -/\.])(\d{4})' , tag_text ) or
+          re.fullmatch( r'(\d[ -/\.]\d[ -/\.])(\d{4})' , tag_text ) or
+          re.fullmatch( r'(\d\d?[ -/\.])(\d{4})' , tag_text ) or
+          re.fullmatch( r'([A-Z][a-z]+[ -/\.])(\d{4})' , tag_text ) or
+          re.fullmatch( r'(\d{4})' , tag_text ) or
+          re.fullmatch( r'.*(of|[ -/\.~])(\d{4})' , tag_text ) ):
+        new_year = shifter.new_year( shift_key , int( tag_text[ -4: ] ) )
+        return( '{}{}'.format( tag_text[ :-4 ] , new_year ) )
+    elif( re.fullmatch( r'(\d{4})([ -/\.]\d\d?[ -/\.]\d\d?)' , tag_text ) or
+          re.fullmatch( r'(\d{4})([ -/\.]\d\d?)' , tag_text ) or
+          re.fullmatch( r'(\d{4})([ -/\.].*)' , tag_text ) ):
+        new_year = shifter.new_year( shift_key , int( tag_text[ 0:4 ] ) )
+        return( '{}{}'.format( new_year , tag_text[ 4: ] ) )
+    elif( re.fullmatch( r'(\d{3}0)\'s' , tag_text ) ):
+        new_decade = shifter.new_decade( shift_key , int( tag_text[ 0:4 ] ) )
+        return( '{}0\'s'.format( new_decade ) )
+    elif( re.fullmatch( r'(\d{3}0)s' , tag_text ) ):
+        new_decade = shifter.new_decade( shift_key , int( tag_text[ 0:4 ] ) )
+        return( '{}0s'.format( new_decade ) )
+    elif( re.fullmatch( r'(\d0)\'s' , tag_text ) ):
+        new_decade = shifter.new_two_digit_decade( shift_key , int( tag_text[ 0:2 ] ) )
+        return( '{}0\'s'.format( new_decade ) )
+    elif( re.fullmatch( r'\'(\d0)s' , tag_text ) ):
+        new_decade = shifter.new_two_digit_decade( shift_key , int( tag_text[ 1:3 ] ) )
+        return( '\'{}0s'.format( new_decade ) )
+    elif( re.fullmatch( r'(\d0)s' , tag_text ) ):
+        new_decade = shifter.new_two_digit_decade( shift_key , int( tag_text[ 0:2 ] ) )
+        return( '{}0s'.format( new_decade ) )
+    return( None )
+
+## lxml parsers can't be pickled so each process builds (and then
+## reuses) its own.  lxml itself is only imported once there's a file
+## to parse.
+xml_parser = None
+
+def get_xml_parser():
+    global xml_parser
+    if( xml_parser is None ):
+        from lxml import etree as ET
+        xml_parser = ET.XMLParser( huge_tree = True ,
+                                   no_network = True ,
+                                   remove_blank_text = True )
+    return( xml_parser )
+
+
+def normalize_file( input_file , output_file , shifter , profiler = None ):
+    """Rewrite the dates in a single i2b2 XML file.  Returns a list of
+    (filename, begin, end, text) tuples for date strings that don't
+    match any known pattern and the number of dates rewritten."""
+    from lxml import etree as ET
+    if( profiler is None ):
+        profiler = NullProfiler()
+    this_filename = os.path.basename( input_file )
+    shift_key = shifter.shift_key( this_filename )
+    exceptions = []
+    with profiler.stage( 'parse' , this_filename ):
+        input_tree = ET.parse( input_file , get_xml_parser() )
+    input_root = input_tree.getroot()
+    body_node = None
+    tags_node = None
+    note_text = None
+    for node in input_root:
+        if( node.tag == 'TEXT' ):
+            body_node = node
+            note_text = node.text
+        elif( node.tag == 'TAGS' ):
+            tags_node = node
+    if( note_text is None ):
+        log.warning( 'Note \'{}\' lacks a body. Skipping it.'.format( this_filename ) )
+        return( exceptions , 0 )
+    if( tags_node is None ):
+        log.warning( 'Note \'{}\' doesn\'t seem to have any <TAGS>.'.format( this_filename ) )
+        tags_node = []
+    ## Surrogates are the same length as the original so we can splice
+    ## them all back into the note in a single pass at the end
+    with profiler.stage( 'build' , this_filename ):
+        edits = []
         for tag_node in tags_node:
             if( tag_node.tag == 'DATE' ):
                 if( 'TYPE' in tag_node.attrib and
@@ -129,68 +294,120 @@ if __name__ == "__main__":
                     annot_begin = int( tag_node.attrib[ 'start' ] )
                     annot_end = int( tag_node.attrib[ 'end' ] )
                     tag_text = tag_node.attrib[ 'text' ]
-                    new_text = None
-                    if( re.fullmatch( r'(\d\d?[ -/\.]\d{2}[ -/\.])(\d{2})' , tag_text ) or
-                          re.fullmatch( r'(\d{2}[ -/\.]\d\d?[ -/\.])(\d{2})' , tag_text ) or
-                          re.fullmatch( r'(\d[ -/\.]\d[ -/\.])(\d{2})' , tag_text ) or
-                          re.fullmatch( r'\'(\d{2})' , tag_text ) ):
-                        new_year = random.choice( [ random.randrange( 50 , 99 ) , 
-                                                    random.randrange( 0 , 21 ) ] )
-                        new_text = '{0}{1:02d}'.format( tag_text[ :-2 ] , new_year )
-                    elif( re.fullmatch( r'(\d\d?[ -/\.]\d{2}[ -/\.])(\d{4})' , tag_text ) or
-                          re.fullmatch( r'(\d{2}[ -/\.]\d\d?[ -/\.])(\d{4})' , tag_text ) or
-                          re.fullmatch( r'(\d[ -/\.]\d[ -/\.])(\d{4})' , tag_text ) or
-                          re.fullmatch( r'(\d\d?[ -/\.])(\d{4})' , tag_text ) or
-                          re.fullmatch( r'([A-Z][a-z]+[ -/\.])(\d{4})' , tag_text ) or
-                          re.fullmatch( r'(\d{4})' , tag_text ) or
-                          re.fullmatch( r'.*(of|[ -/\.~])(\d{4})' , tag_text ) ):
-                        new_year = random.randrange( 1950 , 2021 )
-                        new_text = '{}{}'.format( tag_text[ :-4 ] , new_year )
-                    elif( re.fullmatch( r'(\d{4})([ -/\.]\d\d?[ -/\.]\d\d?)' , tag_text ) or
-                          re.fullmatch( r'(\d{4})([ -/\.]\d\d?)' , tag_text ) or
-                          re.fullmatch( r'(\d{4})([ -/\.].*)' , tag_text ) ):
-                        new_year = random.randrange( 1950 , 2021 )
-                        new_text = '{}{}'.format( new_year , tag_text[ 4: ] )
-                    elif( re.fullmatch( r'(\d{3}0)\'s' , tag_text ) ):
-                        new_year = random.randrange( 195 , 201 )
-                        new_text = '{}0\'s'.format( new_year )
-                    elif( re.fullmatch( r'(\d{3}0)s' , tag_text ) ):
-                        new_year = random.randrange( 195 , 201 )
-                        new_text = '{}0s'.format( new_year )
-                    elif( re.fullmatch( r'(\d0)\'s' , tag_text ) ):
-                        new_year = random.choice( [ '5' , '6' , '7' , '8' , '9' , 
-                                                    '0' , '1' ] )
-                        new_text = '{}0\'s'.format( new_year )
-                    elif( re.fullmatch( r'\'(\d0)s' , tag_text ) ):
-                        new_year = random.choice( [ '5' , '6' , '7' , '8' , '9' , 
-                                                    '0' , '1' ] )
-                        new_text = '\'{}0s'.format( new_year )
-                    elif( re.fullmatch( r'(\d0)s' , tag_text ) ):
-                        new_year = random.choice( [ '5' , '6' , '7' , '8' , '9' , 
-                                                    '0' , '1' ] )
-                        new_text = '{}0s'.format( new_year )
-                    elif( re.fullmatch( r'.*\d.*' , tag_text ) and
-                          args.exceptions_file is not None ):
-                        with open( args.exceptions_file , 'a' ) as fp:
-                            fp.write( '{}\t{}\t{}\t{}\n'.format( this_filename ,
-                                                                 annot_begin ,
-                                                                 annot_end , 
-                                                                 tag_text ) )
-                    if( new_text is not None ):
-                        tag_node.attrib[ 'text' ] = new_text
-                        if( annot_begin == 0 ):
-                            prefix = ''
-                        else:
-                            prefix = note_text[ 0:annot_begin ]
-                        if( annot_end == len( note_text ) ):
-                            suffix = ''
-                        else:
-                            suffix = note_text[ annot_end: ]
-                        note_text = '{}{}{}'.format( prefix ,
-                                                     new_text ,
-                                                     suffix )
-        body_node.text = ET.CDATA( note_text )
+                    new_text = surrogate_date_text( tag_text ,
+                                                    shifter ,
+                                                    shift_key )
+                    if( new_text is None ):
+                        if( re.fullmatch( r'.*\d.*' , tag_text ) ):
+                            exceptions.append( ( this_filename ,
+                                                 annot_begin ,
+                                                 annot_end ,
+                                                 tag_text ) )
+                        continue
+                    tag_node.attrib[ 'text' ] = new_text
+                    edits.append( ( annot_begin , annot_end , new_text ) )
+        pieces = []
+        last_end = 0
+        for annot_begin , annot_end , new_text in sorted( edits ):
+            pieces.append( note_text[ last_end:annot_begin ] )
+            pieces.append( new_text )
+            last_end = annot_end
+        pieces.append( note_text[ last_end: ] )
+        body_node.text = ET.CDATA( ''.join( pieces ) )
+    with profiler.stage( 'serialize' , this_filename ):
         new_tree = ET.ElementTree( input_root )
         new_tree.write( output_file , 
                         xml_declaration = True , 
                         encoding = 'utf8' )
+    return( exceptions , len( edits ) )
+
+
+## Each worker gets its own shifter.  Shifts only depend on the seed
+## and shift key so all workers agree.
+worker_shifter = None
+
+def init_worker( seed , shift_scope , patient_pattern ):
+    global worker_shifter
+    worker_shifter = DateShifter( seed = seed ,
+                                  shift_scope = shift_scope ,
+                                  patient_pattern = patient_pattern )
+
+
+def normalize_file_in_worker( file_pair ):
+    input_file , output_file = file_pair
+    return( input_file , run_timed( normalize_file , input_file , output_file , worker_shifter ) )
+
+#############################################
+## 
+#############################################
+
+def main( command_line_args = None ):
+    ##
+    args = init_args( command_line_args )
+    profiler = init_profiler( args )
+    ##
+    ##########################
+    ## Walk the input directory and write each file to the new output directory
+    with profiler.stage( 'discover' ):
+        file_list = set( [os.path.basename(x) for x in glob.glob( '{}/*.xml'.format( args.input_dir ) ) ] )
+    file_pairs = [ ( os.path.join( args.input_dir , this_filename ) ,
+                     os.path.join( args.output_dir , this_filename ) )
+                   for this_filename in sorted( file_list ) ]
+    input_bytes = {}
+    for input_file , output_file in file_pairs:
+        input_bytes[ input_file ] = file_bytes( input_file )
+    exceptions = []
+    metrics = init_metrics( args , len( file_pairs ) , sum( input_bytes.values() ) ,
+                            start = False )
+    ##########################
+    if( args.workers > 1 ):
+        with multiprocessing.Pool( processes = args.workers ,
+                                   initializer = init_worker ,
+                                   initargs = ( args.seed ,
+                                                args.shift_scope ,
+                                                args.patient_pattern ) ) as pool:
+            ## Only start the heartbeat once the workers are forked
+            metrics.start()
+            for input_file , ( ( file_exceptions , date_count ) ,
+                               worker , busy_seconds ) in progress( pool.imap_unordered( normalize_file_in_worker ,
+                                                                                         file_pairs ,
+                                                                                         chunksize = 16 ) ,
+                                                                    total = len( file_pairs ) ,
+                                                                    file = args.progressbar_file ,
+                                                                    disable = args.progressbar_disabled ):
+                exceptions.extend( file_exceptions )
+                metrics.update( input_bytes[ input_file ] , date_count ,
+                                worker = worker , busy_seconds = busy_seconds )
+    else:
+        metrics.start()
+        shifter = DateShifter( seed = args.seed ,
+                               shift_scope = args.shift_scope ,
+                               patient_pattern = args.patient_pattern )
+        for input_file , output_file in progress( file_pairs ,
+                                                  file = args.progressbar_file ,
+                                                  disable = args.progressbar_disabled ):
+            ( file_exceptions , date_count ) , worker , busy_seconds = run_timed( normalize_file ,
+                                                                                  input_file , output_file , shifter ,
+                                                                                  profiler = profiler )
+            exceptions.extend( file_exceptions )
+            metrics.update( input_bytes[ input_file ] , date_count ,
+                            worker = worker , busy_seconds = busy_seconds )
+    metrics.close()
+    ##########################
+    if( args.exceptions_file is not None ):
+        with open( args.exceptions_file , 'w' ) as fp:
+            fp.write( '{}\t{}\t{}\t{}\n'.format( 'Filename' ,
+                                                 'Begin' ,
+                                                 'End' ,
+                                                 'Annotation' ) )
+            for this_filename , annot_begin , annot_end , tag_text in sorted( exceptions ):
+                fp.write( '{}\t{}\t{}\t{}\n'.format( this_filename ,
+                                                     annot_begin ,
+                                                     annot_end , 
+                                                     tag_text ) )
+    ##
+    profiler.write_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,6 @@ from __future__ import print_function
 import sys
 import logging as log
 
-from tqdm import tqdm
-
 import glob
 import os
 ## TODO - use warnings
@@ -13,32 +11,50 @@ import warnings
 import re
 import json
 
+import gzip
+
 import argparse
 
 import xml.etree.ElementTree as ET
 
+sys.path.insert( 0 , os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' ) )
+from corpus_utils.brat import BratWriter
+from corpus_utils.lazy import progress
+from corpus_utils.options import add_progressbar_arguments , init_progressbar
+
 def initialize_arg_parser():
     parser = argparse.ArgumentParser( description = """
-Split a single i2b2 2006 input file into individual note files.
+Split a single i2b2 2006 input file into individual note files (XML,
+brat .txt/.ann pairs, and/or a single JSONL file).
 """ )
     parser.add_argument( '-v' , '--verbose' ,
                          help = "print more information" ,
                          action = "store_true" )
 
-    parser.add_argument( '--progressbar-output' ,
-                         dest = 'progressbar_output' ,
-                         default = 'stderr' ,
-                         choices = [ 'stderr' , 'stdout' , 'none' ] ,
-                         help = "Pipe the progress bar to stderr, stdout, or neither" )
+    add_progressbar_arguments( parser )
     
-    parser.add_argument( '--input' , required = True ,
-                         default = 'smokers_surrogate_train_all_version2.xml' ,
-                         dest = "input_file",
-                         help = "Original single XML file" )
+    parser.add_argument( '--input' , required = True , nargs = '+' ,
+                         default = [ 'smokers_surrogate_train_all_version2.xml' ] ,
+                         dest = "input_files",
+                         help = "Original single XML file (or several). Files ending in .gz are decompressed on the fly" )
 
     parser.add_argument( '--output' , default = '/tmp/i2b2_split' ,
                         dest = "output",
                         help = "Directory for writing the individual output files" )
+
+    parser.add_argument( '--name-pattern' , default = None ,
+                         dest = "name_pattern",
+                         help = "Python format string for output filenames. Available fields: id (the RECORD ID, as an int when possible), raw_id (the RECORD ID string), index (running count of records, starting at 1), and stem (input filename without .xml/.gz). Default:  {id:03d}.xml for a single input file and {stem}-{id:03d}.xml for more than one" )
+
+    parser.add_argument( '--format' , nargs = '+' ,
+                         default = [ 'xml' ] ,
+                         choices = [ 'xml' , 'brat' , 'jsonl' ] ,
+                         dest = "formats",
+                         help = "Output format(s) to write for each record. brat writes a .txt/.ann pair per record (using --name-pattern with the .xml suffix swapped). jsonl writes every record to --jsonl-file" )
+
+    parser.add_argument( '--jsonl-file' , default = None ,
+                         dest = "jsonl_file",
+                         help = "File for the jsonl output (Default:  records.jsonl in the --output directory)" )
     
     ##
     return parser
@@ -50,24 +66,17 @@ def get_arguments( command_line_args ):
     ##
     return args
 
-def init_args():
+def init_args( command_line_args = None ):
     ##
-    args = get_arguments( sys.argv[ 1: ] )
+    args = get_arguments( command_line_args )
     ## Configure progressbar peformance
-    if( args.progressbar_output == 'none' ):
-        args.progressbar_disabled = True
-        args.progressbar_file = None
-    else:
-        args.progressbar_disabled = False
-        if( args.progressbar_output == 'stderr' ):
-            args.progressbar_file = sys.stderr
-        elif( args.progressbar_output == 'stdout' ):
-            args.progressbar_file = sys.stdout
+    init_progressbar( args )
     bad_args_flag = False
     ##
-    if( not os.path.exists( args.input_file ) ):
-        bad_args_flag = True
-        log.error( 'The input file does not exist:  {}'.format( args.input_file ) )
+    for input_file in args.input_files:
+        if( not os.path.exists( input_file ) ):
+            bad_args_flag = True
+            log.error( 'The input file does not exist:  {}'.format( input_file ) )
     ##
     if( not os.path.exists( args.output ) ):
         log.warning( 'Creating output folder:  {}'.format( args.output ) )
@@ -78,27 +87,184 @@ def init_args():
         except IOError as e:
             log.error( 'IOError caught while trying to create output folder:  {}'.format( e ) )
     ##
+    if( args.name_pattern is None ):
+        ## Records from different inputs can share an ID
+        if( len( args.input_files ) > 1 ):
+            args.name_pattern = '{stem}-{id:03d}.xml'
+        else:
+            args.name_pattern = '{id:03d}.xml'
+    ##
+    if( 'jsonl' in args.formats and
+        args.jsonl_file is None ):
+        args.jsonl_file = os.path.join( args.output , 'records.jsonl' )
+    ##
     if( bad_args_flag ):
         log.error( "I'm bailing out of this run because of errors mentioned above." )
         exit( 1 )
     ##
     return args
 
+#############################################
+## core functions
+#############################################
+
+def open_input( input_file ):
+    if( input_file.endswith( '.gz' ) ):
+        return( gzip.open( input_file , 'rb' ) )
+    return( open( input_file , 'rb' ) )
+
+
+def iter_records( input_file ):
+    """Stream the children of the root node (i.e., each RECORD) from
+    an i2b2 2006 file.  Every record is cleared from the tree as soon
+    as the caller is done with it so memory use doesn't grow with
+    the size of the corpus."""
+    with open_input( input_file ) as fp:
+        depth = 0
+        root = None
+        for event , node in ET.iterparse( fp , events = ( 'start' , 'end' ) ):
+            if( event == 'start' ):
+                if( root is None ):
+                    root = node
+                depth += 1
+                continue
+            depth -= 1
+            if( depth == 1 ):
+                yield node
+                root.clear()
+
+
+def output_filename( name_pattern , record_id , index , input_file ):
+    try:
+        typed_id = int( record_id )
+    except ValueError:
+        typed_id = record_id
+    stem = re.sub( r'(\.xml)?(\.gz)?$' , '' , os.path.basename( input_file ) )
+    return( name_pattern.format( id = typed_id ,
+                                 raw_id = record_id ,
+                                 index = index ,
+                                 stem = stem ) )
+
+def record_to_document( node ):
+    """Flatten a RECORD node into its note text, the inline annotations
+    found in its TEXT node (e.g., <PHI TYPE="DATE">), and its
+    document-level attributes (e.g., <SMOKING STATUS="..."/>)."""
+    doc = { 'id' : node.attrib[ 'ID' ] ,
+            'text' : '' ,
+            'attributes' : {} ,
+            'annotations' : [] }
+    pieces = []
+    text_length = 0
+    def walk( text_node ):
+        nonlocal text_length
+        if( text_node.text is not None ):
+            pieces.append( text_node.text )
+            text_length += len( text_node.text )
+        for child in text_node:
+            begin_offset = text_length
+            walk( child )
+            doc[ 'annotations' ].append( { 'label' : child.attrib.get( 'TYPE' , child.tag ) ,
+                                           'begin' : begin_offset ,
+                                           'end' : text_length } )
+            if( child.tail is not None ):
+                pieces.append( child.tail )
+                text_length += len( child.tail )
+    for child in node:
+        if( child.tag == 'TEXT' ):
+            walk( child )
+        else:
+            for attr_name in sorted( child.attrib ):
+                doc[ 'attributes' ][ '{}_{}'.format( child.tag , attr_name ) ] = child.attrib[ attr_name ]
+    doc[ 'text' ] = ''.join( pieces )
+    for annot in doc[ 'annotations' ]:
+        annot[ 'text' ] = doc[ 'text' ][ annot[ 'begin' ]:annot[ 'end' ] ]
+    doc[ 'annotations' ] = sorted( doc[ 'annotations' ] ,
+                                   key = lambda annot: ( annot[ 'begin' ] , annot[ 'end' ] ) )
+    return( doc )
+
+
+def write_brat( doc , txt_path , ann_path ):
+    """Write a document as a brat pair.  Document-level attributes are
+    attached to a Record span covering the full note."""
+    with open( txt_path , 'w' ) as fp:
+        fp.write( doc[ 'text' ] )
+    brat_writer = BratWriter( ann_path )
+    if( len( doc[ 'attributes' ] ) > 0 ):
+        record_id = brat_writer.add_text_bound( 'Record' ,
+                                                [ ( 0 , len( doc[ 'text' ] ) ) ] ,
+                                                re.sub( r'[\n\r]' , ' ' , doc[ 'text' ] ) )
+        for attr_name in sorted( doc[ 'attributes' ] ):
+            brat_writer.add_attribute( attr_name ,
+                                       record_id ,
+                                       re.sub( r'\s+' , '_' , doc[ 'attributes' ][ attr_name ] ) )
+    for annot in doc[ 'annotations' ]:
+        brat_writer.add_text_bound( re.sub( r'\s+' , '_' , annot[ 'label' ] ) ,
+                                    [ ( annot[ 'begin' ] , annot[ 'end' ] ) ] ,
+                                    re.sub( r'[\n\r]' , ' ' , annot[ 'text' ] ) )
+    brat_writer.flush()
+
 #############################################
 ## 
 #############################################
 
-if __name__ == "__main__":
+def main( command_line_args = None ):
     ##
-    args = init_args()
+    args = init_args( command_line_args )
     ##
+    jsonl_fp = None
+    if( 'jsonl' in args.formats ):
+        jsonl_fp = open( args.jsonl_file , 'w' )
     ##########################
-    ## Walk the input file and collect matching annotations
-    input_tree = ET.parse( args.input_file )
-    input_root = input_tree.getroot()
-    ## Loop over the RECORD level
-    for node in input_root:
-        record_id = node.attrib[ 'ID' ]
-        new_tree = ET.ElementTree( node )
-        output_file = '{}/{:03d}.xml'.format( args.output , int( record_id ) )
-        new_tree.write( output_file , encoding='utf8')
+    ## Stream each input file and write out every RECORD as soon as
+    ## it has been closed
+    record_count = 0
+    output_files = set()
+    for input_file in args.input_files:
+        for node in progress( iter_records( input_file ) ,
+                              desc = os.path.basename( input_file ) ,
+                              file = args.progressbar_file ,
+                              disable = args.progressbar_disabled ):
+            record_count += 1
+            record_id = node.attrib[ 'ID' ]
+            try:
+                output_file = os.path.join( args.output ,
+                                            output_filename( args.name_pattern ,
+                                                             record_id ,
+                                                             record_count ,
+                                                             input_file ) )
+            except ( ValueError , KeyError , IndexError ) as e:
+                log.error( 'Unable to name the output file of RECORD ID \'{}\' in {} with --name-pattern \'{}\':  {}'.format( record_id ,
+                                                                                                                          input_file ,
+                                                                                                                          args.name_pattern ,
+                                                                                                                          e ) )
+                log.error( "I'm bailing out of this run because of errors mentioned above." )
+                exit( 1 )
+            ## Never silently overwrite a record written earlier in this run
+            if( output_file in output_files ):
+                log.error( 'RECORD ID \'{}\' in {} would overwrite {}.  Add {{stem}} or {{index}} to --name-pattern to tell the records apart.'.format( record_id ,
+                                                                                                                                                 input_file ,
+                                                                                                                                                 output_file ) )
+                log.error( "I'm bailing out of this run because of errors mentioned above." )
+                exit( 1 )
+            output_files.add( output_file )
+            if( 'xml' in args.formats ):
+                new_tree = ET.ElementTree( node )
+                new_tree.write( output_file , encoding='utf8')
+            if( 'brat' in args.formats or
+                'jsonl' in args.formats ):
+                doc = record_to_document( node )
+            if( 'brat' in args.formats ):
+                output_root = re.sub( r'\.xml$' , '' , output_file )
+                write_brat( doc ,
+                            '{}.txt'.format( output_root ) ,
+                            '{}.ann'.format( output_root ) )
+            if( jsonl_fp is not None ):
+                doc[ 'source' ] = os.path.basename( input_file )
+                jsonl_fp.write( '{}\n'.format( json.dumps( doc ) ) )
+    ##
+    if( jsonl_fp is not None ):
+        jsonl_fp.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,38 +3,23 @@ import logging as log
 
 import argparse
 
-from tqdm import tqdm
-
 import glob
 import os
 
-try:
-    from lxml import etree
-    log.debug("running with lxml.etree")
-except ImportError:
-    try:
-        # Python 2.5
-        import xml.etree.cElementTree as etree
-        log.debug("running with cElementTree on Python 2.5+")
-    except ImportError:
-        try:
-            # Python 2.5
-            import xml.etree.ElementTree as etree
-            log.debug("running with ElementTree on Python 2.5+")
-        except ImportError:
-            try:
-                # normal cElementTree install
-                import cElementTree as etree
-                log.debug("running with cElementTree")
-            except ImportError:
-                try:
-                    # normal ElementTree install
-                    import elementtree.ElementTree as etree
-                    log.debug("running with ElementTree")
-                except ImportError:
-                    log.warn("Failed to import ElementTree from any known place")
-
-import cassis
+import re
+
+from collections import namedtuple
+
+import multiprocessing
+
+import fnmatch
+
+sys.path.insert( 0 , os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' ) )
+from corpus_utils.brat import BratWriter
+from corpus_utils.profiling import add_profile_arguments , init_profiler , NullProfiler
+from corpus_utils.metrics import add_metrics_arguments , init_metrics , file_bytes , run_timed
+from corpus_utils.lazy import get_etree , get_cassis , progress
+from corpus_utils.options import add_progressbar_arguments , add_workers_arguments , init_logging , init_progressbar
 
 #############################################
 ## helper functions
@@ -47,20 +32,22 @@ def initialize_arg_parser():
                          help = "print more information" ,
                          action = "store_true" )
 
-    parser.add_argument( '--progressbar-output' ,
-                         dest = 'progressbar_output' ,
-                         default = 'stderr' ,
-                         choices = [ 'stderr' , 'stdout' , 'none' ] ,
-                         help = "Pipe the progress bar to stderr, stdout, or neither" )
+    add_progressbar_arguments( parser )
 
     parser.add_argument( '--pretty-print' ,
                          dest = 'pretty_print' ,
                          help = "Round floats and remove decimals from integers" ,
                          action = "store_true" )
 
+    add_workers_arguments( parser , 'convert files' )
+
     parser.add_argument( '--mapping-file' , default = None ,
                          dest = 'mapping_file' ,
-                         help = "Tab-delimited files containing concepts mappings for the source ontology to the target ontology" )
+                         help = "Tab-delimited files containing concepts mappings for the source ontology to the target ontology. Source entries may be glob wildcards prefixed with 'glob:' (e.g., 'glob:Hist*') or regular expressions prefixed with 're:'" )
+
+    parser.add_argument( '--hierarchy-file' , default = None ,
+                         dest = 'hierarchy_file' ,
+                         help = "Tab-delimited file (with a header row) of child and parent source classes. Unmapped classes fall back to the mapping of their closest mapped ancestor" )
 
     parser.add_argument( '--txt-root' , default = None ,
                          required = True ,
@@ -72,13 +59,14 @@ def initialize_arg_parser():
                          help = "Directory containing input corpus in Knowtator format" )
     
     parser.add_argument( '--cas-root' , default = None ,
-                         required = True ,
                          dest = "cas_root",
                          help = "Directory for output corpus in CAS XMI formatted XML" )
     parser.add_argument( '--brat-root' , default = None ,
-                         required = True ,
                          dest = "brat_root",
                          help = "Directory for output corpus in brat format (.txt and .ann files)" )
+
+    add_profile_arguments( parser )
+    add_metrics_arguments( parser )
     ##
     return parser
 
@@ -88,27 +76,18 @@ def get_arguments( command_line_args ):
     ##
     return args
 
-def init_args():
+def init_args( command_line_args = None ):
     ##
-    args = get_arguments( sys.argv[ 1: ] )
+    args = get_arguments( command_line_args )
     ## Set up logging
-    if( args.verbose ):
-        log.basicConfig( format = "%(levelname)s: %(message)s" ,
-                         level = log.DEBUG )
-        log.info( "Verbose output." )
-        log.debug( "{}".format( args ) )
-    else:
-        log.basicConfig( format="%(levelname)s: %(message)s" )
+    init_logging( args )
     ## Configure progressbar peformance
-    if( args.progressbar_output == 'none' ):
-        args.progressbar_disabled = True
-        args.progressbar_file = None
-    else:
-        args.progressbar_disabled = False
-        if( args.progressbar_output == 'stderr' ):
-            args.progressbar_file = sys.stderr
-        elif( args.progressbar_output == 'stdout' ):
-            args.progressbar_file = sys.stdout
+    init_progressbar( args )
+    ####
+    if( args.cas_root is None and
+        args.brat_root is None ):
+        log.error( 'At least one of --cas-root or --brat-root is required' )
+        exit( 1 )
     ##
     return args
 
@@ -118,6 +97,12 @@ def loadTypesystem( args ):
     ############################
     ## Create a type system
     ## - https://github.com/dkpro/dkpro-cassis/blob/master/cassis/typesystem.py
+    ##
+    ## brat-only runs never build a CAS so they don't need (or import)
+    ## cassis at all
+    if( args.cas_root is None ):
+        return( None , None )
+    cassis = get_cassis()
     ############
     ## ... for tokens
     typesystem = cassis.TypeSystem()
@@ -161,11 +146,200 @@ def loadTypesystem( args ):
 ## core functions
 #############################################
 
+## A compact, flattened view of a single Knowtator mention:
+## - spans is a tuple of (begin, end) pairs (more than one for
+##   discontinuous annotations)
+## - slots is a tuple of (slot name, value) pairs.  Complex slots
+##   have the id of the mention they point to as their value.
+KnowtatorMention = namedtuple( 'KnowtatorMention' ,
+                               [ 'id' , 'spans' , 'text' ,
+                                 'mention_class' , 'slots' ] )
+
+slotMention_tags = [ 'stringSlotMention' ,
+                     'complexSlotMention' ,
+                     'integerSlotMention' ,
+                     'booleanSlotMention' ]
+
+knowtator_tags = [ 'annotation' , 'classMention' ] + slotMention_tags
+
+
+def iter_knowtator_mentions( xml_path ):
+    """Read a .knowtator.xml file and yield one KnowtatorMention per
+    annotated span in document order.
+
+    Mentions are only yielded once the whole file has been read (a
+    class or slot can come after its annotation).  Only the top-level
+    annotation, classMention, and slot mention elements are looked at
+    and each is dropped from the tree as soon as it has been read so
+    memory holds the small records below rather than the full tree.
+    Mentions without any span (e.g., targets of complex slots) are not
+    yielded."""
+    mention_order = []
+    mention_spans = {}
+    mention_text = {}
+    mention_classes = {}
+    mention_slot_ids = {}
+    slot_values = {}
+    etree = get_etree()
+    with open( xml_path , 'rb' ) as fp:
+        if( etree.__name__ == 'lxml.etree' ):
+            context = etree.iterparse( fp , events = ( 'end' , ) ,
+                                       tag = knowtator_tags )
+        else:
+            ## ElementTree has no getparent() so we keep track of the
+            ## root and how deep we are in it instead
+            context = etree.iterparse( fp , events = ( 'start' , 'end' ) )
+        root = None
+        depth = 0
+        for event , node in context:
+            if( event == 'start' ):
+                if( root is None ):
+                    root = node
+                depth += 1
+                continue
+            depth -= 1
+            if( node.tag == 'annotation' ):
+                mention_id = None
+                spans = []
+                text_span = ''
+                for child in node:
+                    if( child.tag == 'mention' ):
+                        mention_id = child.attrib[ 'id' ]
+                    elif( child.tag == 'span' ):
+                        spans.append( ( int( child.attrib[ 'start' ] ) ,
+                                        int( child.attrib[ 'end' ] ) ) )
+                    elif( child.tag == 'spannedText' and
+                          child.text is not None ):
+                        text_span = child.text
+                if( mention_id is not None and
+                    len( spans ) > 0 ):
+                    if( mention_id not in mention_spans ):
+                        mention_order.append( mention_id )
+                    mention_spans[ mention_id ] = tuple( sorted( spans ) )
+                    mention_text[ mention_id ] = text_span
+            elif( node.tag == 'classMention' ):
+                mention_id = node.attrib[ 'id' ]
+                for child in node:
+                    if( child.tag == 'mentionClass' ):
+                        mention_classes[ mention_id ] = child.attrib[ 'id' ]
+                    elif( child.tag == 'hasSlotMention' ):
+                        mention_slot_ids.setdefault( mention_id , [] ).append( child.attrib[ 'id' ] )
+            elif( node.tag in slotMention_tags ):
+                slot_name = None
+                values = []
+                for child in node:
+                    if( child.tag == 'mentionSlot' ):
+                        slot_name = child.attrib[ 'id' ]
+                    elif( child.tag.endswith( 'SlotMentionValue' ) ):
+                        values.append( child.attrib[ 'value' ] )
+                slot_values[ node.attrib[ 'id' ] ] = ( slot_name , values )
+            else:
+                continue
+            ## Only the small records above survive the element
+            node.clear()
+            ## Clearing leaves the (empty) element in the tree so we
+            ## also drop it and every sibling read before it
+            if( root is None ):
+                while( node.getprevious() is not None ):
+                    del node.getparent()[ 0 ]
+            elif( depth == 1 ):
+                root.clear()
+    ##
+    for mention_id in mention_order:
+        slots = []
+        for slot_id in mention_slot_ids.get( mention_id , [] ):
+            if( slot_id not in slot_values ):
+                log.debug( 'Missing slot mention \'{}\' for \'{}\''.format( slot_id , mention_id ) )
+                continue
+            slot_name , values = slot_values[ slot_id ]
+            for value in values:
+                slots.append( ( slot_name , value ) )
+        yield KnowtatorMention( id = mention_id ,
+                                spans = mention_spans[ mention_id ] ,
+                                text = mention_text[ mention_id ] ,
+                                mention_class = mention_classes.get( mention_id ) ,
+                                slots = tuple( slots ) )
+
+
+class OntologyMapping( object ):
+    """Map source classes (e.g., Knowtator mention classes) to a
+    comma-delimited, sorted list of target classes.
+
+    Source keys are matched exactly (even ones with a * or ?) unless
+    they are prefixed with 'glob:' (shell-style wildcards) or 're:' (a
+    regular expression).
+
+    A source class is resolved by, in order:  exact matches, wildcard
+    or regular expression rules (all matching rules are combined), and
+    then the same two steps for each ancestor in the class hierarchy,
+    starting with the closest.  Resolved labels are interned and cached
+    so every later lookup of the same class is a single dict access."""
+    def __init__( self ):
+        self.exact = {}
+        self.patterns = []
+        self.parents = {}
+        self.cache = {}
+
+    def __len__( self ):
+        return( len( self.exact ) + len( self.patterns ) )
+
+    def add_rule( self , src_key , tgt_type ):
+        if( src_key.startswith( 're:' ) ):
+            pattern = re.compile( src_key[ 3: ] )
+        elif( src_key.startswith( 'glob:' ) ):
+            pattern = re.compile( fnmatch.translate( src_key[ 5: ] ) )
+        else:
+            self.exact.setdefault( src_key , set() ).add( tgt_type )
+            return
+        for rule_pattern , tgt_types in self.patterns:
+            if( rule_pattern.pattern == pattern.pattern ):
+                tgt_types.add( tgt_type )
+                return
+        self.patterns.append( ( pattern , set( [ tgt_type ] ) ) )
+
+    def add_parent( self , child , parent ):
+        self.parents[ child ] = parent
+
+    def targets( self , src_class ):
+        tgt_types = set( self.exact.get( src_class , set() ) )
+        for pattern , pattern_tgt_types in self.patterns:
+            if( pattern.fullmatch( src_class ) ):
+                tgt_types.update( pattern_tgt_types )
+        return( tgt_types )
+
+    def resolve( self , src_class ):
+        seen = set()
+        while( src_class is not None and
+               src_class not in seen ):
+            seen.add( src_class )
+            tgt_types = self.targets( src_class )
+            if( len( tgt_types ) > 0 ):
+                ## We sort the entries here so output is consistent across multiple runs
+                ## if the underlying mapping file is equivalent
+                return( sys.intern( ','.join( sorted( tgt_types ) ) ) )
+            src_class = self.parents.get( src_class )
+        return( None )
+
+    def compile( self ):
+        """Resolve every class named in the mapping or hierarchy files
+        up front.  Anything else is resolved on first lookup."""
+        for src_class in set( self.exact ) | set( self.parents ):
+            self.lookup( src_class )
+        return( self )
+
+    def lookup( self , src_class ):
+        """Return the joined target label for src_class or None if
+        nothing maps to it"""
+        if( src_class not in self.cache ):
+            self.cache[ src_class ] = self.resolve( src_class )
+        return( self.cache[ src_class ] )
+
+
 def loadOntologyMapping( args ):
+    ontology_mapping = OntologyMapping()
     if( args.mapping_file is None ):
-        return( {} , 'DefaultType' , None )
+        return( ontology_mapping , 'DefaultType' , None )
     ####
-    ontology_mapping = {}
     with open( args.mapping_file , 'r' ) as fp:
         headers = fp.readline().strip()
         src_header , _ , tgt_header = headers.split( '\t' )
@@ -174,130 +348,212 @@ def loadOntologyMapping( args ):
             if( line == '' ):
                 continue
             src_type , src_abbrev , tgt_type = line.split( '\t' )
-            if( src_type not in ontology_mapping ):
-                ontology_mapping[ src_type ] = set()
-            ontology_mapping[ src_type ].add( tgt_type )
-            if( src_abbrev not in ontology_mapping ):
-                ontology_mapping[ src_abbrev ] = set()
-            ontology_mapping[ src_abbrev ].add( tgt_type )
+            ontology_mapping.add_rule( src_type , tgt_type )
+            ontology_mapping.add_rule( src_abbrev , tgt_type )
+    ####
+    if( args.hierarchy_file is not None ):
+        with open( args.hierarchy_file , 'r' ) as fp:
+            fp.readline()
+            for line in fp:
+                line = line.strip()
+                if( line == '' ):
+                    continue
+                child , parent = line.split( '\t' )
+                ontology_mapping.add_parent( child , parent )
     ##
-    return( ontology_mapping , src_header , tgt_header )
+    return( ontology_mapping.compile() , src_header , tgt_header )
 
 
-if __name__ == "__main__":
+def add_mentions( cas , brat_writer , mentions ,
+                  defaultType , ontology_mapping , src_type , tgt_type ):
+    """Add every Knowtator mention to the CAS and the brat writer (either
+    of which may be None when that output wasn't asked for)"""
+    for mention in mentions:
+        mapped_section = None
+        if( tgt_type is not None ):
+            mapped_section = ontology_mapping.lookup( mention.mention_class )
+            if( mapped_section is None ):
+                mapped_section = 'Unknown/Unclassified'
+        if( cas is not None ):
+            ## Discontinuous spans are represented in the CAS by their
+            ## fully encompassing span
+            begin_offset = mention.spans[ 0 ][ 0 ]
+            end_offset = max( [ span_end for span_begin , span_end in mention.spans ] )
+            slot_modifiers = [ '{}={}'.format( slot_name , value )
+                               for slot_name , value in mention.slots ]
+            if( tgt_type is None ):
+                if( len( slot_modifiers ) > 0 ):
+                    cas.add_annotation( defaultType( beginHeader = begin_offset ,
+                                                     endHeader = end_offset ,
+                                                     SectionId = mention.mention_class ,
+                                                     modifiers = ';'.join( slot_modifiers ) ,
+                                                     begin = '-1' ,
+                                                     end = '-1' ) )
+                else:
+                    cas.add_annotation( defaultType( beginHeader = begin_offset ,
+                                                     endHeader = end_offset ,
+                                                     SectionId = mention.mention_class ,
+                                                     begin = '-1' ,
+                                                     end = '-1' ) )
+            else:
+                cas.add_annotation( defaultType( beginHeader = begin_offset ,
+                                                 endHeader = end_offset ,
+                                                 SectionId = mapped_section ,
+                                                 modifiers = ';'.join( [ '{}={}'.format( src_type ,
+                                                                                         mention.mention_class ) ] +
+                                                                       slot_modifiers ) ,
+                                                 begin = '-1' ,
+                                                 end = '-1' ) )
+        ####
+        if( brat_writer is not None ):
+            t_id = brat_writer.add_text_bound( 'SectionHeader' ,
+                                               mention.spans ,
+                                               mention.text )
+            brat_writer.add_normalization( t_id , src_type , 0 ,
+                                           mention.mention_class )
+            if( tgt_type is not None ):
+                brat_writer.add_normalization( t_id , tgt_type , 0 ,
+                                               mapped_section )
+            for slot_name , value in mention.slots:
+                brat_writer.add_attribute( re.sub( r'\s+' , '_' , slot_name ) ,
+                                           t_id ,
+                                           re.sub( r'\s+' , '_' , value ) )
+
+
+def convert_file( full_path , args , typesystem , defaultType ,
+                  ontology_mapping , src_type , tgt_type , profiler = None ):
+    """Convert a single .knowtator.xml file to a CAS XMI file and/or a
+    brat .txt/.ann pair.  Returns the number of mentions converted or
+    None if the matching text file is missing."""
+    if( profiler is None ):
+        profiler = NullProfiler()
+    xml_filename = os.path.basename( full_path )
+    plain_filename = xml_filename[ 0:-14 ]
+    txt_path = os.path.join( args.txt_root ,
+                             plain_filename )
+    if( not os.path.exists( txt_path ) ):
+        txt_path = os.path.join( args.txt_root ,
+                                 '{}.txt'.format( plain_filename ) )
+        if( not os.path.exists( txt_path ) ):
+            log.warn( 'No matching txt file found for \'{}\''.format( xml_filename ) )
+            return( None )
+    with profiler.stage( 'read' , plain_filename ):
+        with open( txt_path , 'r' ) as fp:
+            note_contents = fp.read().strip()
+    with profiler.stage( 'parse' , plain_filename ):
+        mentions = list( iter_knowtator_mentions( full_path ) )
     ##
-    args = init_args()
+    with profiler.stage( 'build' , plain_filename ):
+        cas = None
+        if( args.cas_root is not None ):
+            cas = get_cassis().Cas( typesystem = typesystem )
+            cas.sofa_string = note_contents
+            cas.sofa_mime = "text/plain"
+        brat_writer = None
+        if( args.brat_root is not None ):
+            brat_writer = BratWriter( os.path.join( args.brat_root ,
+                                                    '{}.ann'.format( plain_filename ) ) )
+        add_mentions( cas , brat_writer , mentions ,
+                      defaultType , ontology_mapping , src_type , tgt_type )
+    if( brat_writer is not None ):
+        with profiler.stage( 'write' , plain_filename ):
+            with open( os.path.join( args.brat_root ,
+                                     '{}.txt'.format( plain_filename ) ) , 'w' ) as fp:
+                fp.write( '{}'.format( note_contents ) )
+            brat_writer.flush()
+    if( cas is not None ):
+        with profiler.stage( 'serialize' , plain_filename ):
+            cas.to_xmi( path = os.path.join( args.cas_root ,
+                                             '{}.xml'.format( plain_filename ) ) ,
+                        pretty_print = True )
+    return( len( mentions ) )
+
+
+## Everything a worker needs is built once in the parent process and
+## inherited by forked workers.  Workers started any other way (e.g.,
+## spawn) rebuild it from args.
+shared_state = {}
+
+def init_worker( args ):
+    if( len( shared_state ) > 0 ):
+        return
+    typesystem , defaultType = loadTypesystem( args )
+    ontology_mapping , src_type , tgt_type = loadOntologyMapping( args )
+    shared_state.update( { 'args' : args ,
+                           'typesystem' : typesystem ,
+                           'defaultType' : defaultType ,
+                           'ontology_mapping' : ontology_mapping ,
+                           'src_type' : src_type ,
+                           'tgt_type' : tgt_type } )
+
+
+def convert_file_in_worker( full_path ):
+    return( full_path , run_timed( convert_file , full_path , **shared_state ) )
+
+
+def main( command_line_args = None ):
+    ##
+    args = init_args( command_line_args )
+    profiler = init_profiler( args )
     ##
     typesystem , defaultType = loadTypesystem( args )
     ##
     ontology_mapping , src_type , tgt_type = loadOntologyMapping( args )
     ##
+    shared_state.update( { 'args' : args ,
+                           'typesystem' : typesystem ,
+                           'defaultType' : defaultType ,
+                           'ontology_mapping' : ontology_mapping ,
+                           'src_type' : src_type ,
+                           'tgt_type' : tgt_type } )
+    ##
     ############################
     ## Iterate over the files, covert to CAS, and write the XMI to disk
-    file_list = glob.glob( os.path.join( args.xml_root , '*.knowtator.xml' ) )
-    for full_path in tqdm( sorted( file_list ) ,
-                           file = args.progressbar_file ,
-                           disable = args.progressbar_disabled ):
-        xml_filename = os.path.basename( full_path )
-        plain_filename = xml_filename[ 0:-14 ]
+    with profiler.stage( 'discover' ):
+        file_list = sorted( glob.glob( os.path.join( args.xml_root , '*.knowtator.xml' ) ) )
+    input_bytes = {}
+    for full_path in file_list:
+        ## The text file is looked for without and then with a .txt extension
         txt_path = os.path.join( args.txt_root ,
-                                 plain_filename )
+                                 os.path.basename( full_path )[ 0:-14 ] )
         if( not os.path.exists( txt_path ) ):
-            txt_path = os.path.join( args.txt_root ,
-                                     '{}.txt'.format( plain_filename ) )
-            if( not os.path.exists( txt_path ) ):
-                log.warn( 'No matching txt file found for \'{}\''.format( xml_filename ) )
-                continue
-        with open( txt_path , 'r' ) as fp:
-            note_contents = fp.read().strip()
-        with open( full_path , 'r' ) as fp:
-            tree = etree.parse( fp )
-        root = tree.getroot()
-        spans = {}
-        for node in root:
-            if( node.tag == 'annotation' ):
-                mention_id = None
-                begin_offset = None
-                end_offset = None
-                for child in node.iter():
-                    if( child.tag == 'mention' ):
-                        mention_id = child.attrib[ 'id' ]
-                    elif( child.tag == 'span' ):
-                        begin_offset = int( child.attrib[ 'start' ] )
-                        end_offset = int( child.attrib[ 'end' ] )
-                    elif( child.tag == 'spannedText' ):
-                        text_span = child.text
-                if( mention_id not in spans ):
-                    spans[ mention_id ] = {}
-                spans[ mention_id ][ 'begin' ] = begin_offset
-                spans[ mention_id ][ 'end' ] = end_offset
-                spans[ mention_id ][ 'text_span' ] = text_span
-            elif( node.tag == 'classMention' ):
-                mention_id = node.attrib[ 'id' ]
-                mention_class = None
-                for child in node.iter():
-                    if( child.tag == 'mentionClass' ):
-                        mention_class = child.attrib[ 'id' ]
-                if( mention_id not in spans ):
-                    spans[ mention_id ] = {}
-                spans[ mention_id ][ 'class' ] = mention_class
-        ##
-        cas = cassis.Cas( typesystem = typesystem )
-        cas.sofa_string = note_contents
-        cas.sofa_mime = "text/plain"
-        cas_path = os.path.join( args.cas_root ,
-                                 '{}.xml'.format( plain_filename ) )
-        brat_txt_path = os.path.join( args.brat_root ,
-                                      '{}.txt'.format( plain_filename ) )
-        brat_ann_path = os.path.join( args.brat_root ,
-                                      '{}.ann'.format( plain_filename ) )
-        with open( brat_txt_path , 'w' ) as fp:
-            fp.write( '{}'.format( note_contents ) )
-        with open( brat_ann_path , 'w' ) as fp:
-            1 ## Clear out the old
-        annot_count = 0
-        normalization_count = 0
-        for mention_id in spans:
-            if( tgt_type is None ):
-                cas.add_annotation( defaultType( beginHeader = spans[ mention_id ][ 'begin' ] ,
-                                                 endHeader = spans[ mention_id ][ 'end' ] ,
-                                                 SectionId = spans[ mention_id ][ 'class' ] ,
-                                                 begin = '-1' ,
-                                                 end = '-1' ) )
-            else:
-                if( spans[ mention_id ][ 'class' ] in ontology_mapping ):
-                    ## We sort the entries here so output is consistent across multiple runs
-                    ## if the underlying mapping file is equivalent
-                    mapped_section = ','.join( sorted( ontology_mapping[ spans[ mention_id ][ 'class' ] ] ) )
-                else:
-                    mapped_section = 'Unknown/Unclassified'
-                cas.add_annotation( defaultType( beginHeader = spans[ mention_id ][ 'begin' ] ,
-                                                 endHeader = spans[ mention_id ][ 'end' ] ,
-                                                 SectionId = mapped_section ,
-                                                 modifiers = '{}={}'.format( src_type ,
-                                                                             spans[ mention_id ][ 'class' ] ) ,
-                                                 begin = '-1' ,
-                                                 end = '-1' ) )
-            ####
-            annot_count += 1
-            with open( brat_ann_path , 'a' ) as fp:
-                fp.write( 'T{}\t{} {} {}\t{}\n'.format( annot_count ,
-                                                        'SectionHeader' ,
-                                                        spans[ mention_id ][ 'begin' ] ,
-                                                        spans[ mention_id ][ 'end' ] ,
-                                                        spans[ mention_id ][ 'text_span' ] ) )
-                normalization_count += 1
-                fp.write( 'N{}\tReference T{} {}:0\t{}\n'.format( normalization_count ,
-                                                                  annot_count ,
-                                                                  src_type ,
-                                                                  spans[ mention_id ][ 'class' ] ) )
-                if( tgt_type is not None ):
-                    normalization_count += 1
-                    fp.write( 'N{}\tReference T{} {}:0\t{}\n'.format( normalization_count ,
-                                                                      annot_count ,
-                                                                      tgt_type ,
-                                                                      mapped_section ) )
-        cas.to_xmi( path = cas_path ,
-                    pretty_print = True )
-
-            
+            txt_path = '{}.txt'.format( txt_path )
+        input_bytes[ full_path ] = file_bytes( full_path , txt_path )
+    metrics = init_metrics( args , len( file_list ) , sum( input_bytes.values() ) ,
+                            start = False )
+    if( args.workers > 1 ):
+        if( 'fork' in multiprocessing.get_all_start_methods() ):
+            mp_context = multiprocessing.get_context( 'fork' )
+        else:
+            mp_context = multiprocessing.get_context()
+        with mp_context.Pool( processes = args.workers ,
+                              initializer = init_worker ,
+                              initargs = ( args , ) ) as pool:
+            ## Only start the heartbeat once the workers are forked
+            metrics.start()
+            for full_path , ( mention_count ,
+                              worker , busy_seconds ) in progress( pool.imap_unordered( convert_file_in_worker ,
+                                                                                        file_list ,
+                                                                                        chunksize = 4 ) ,
+                                                                   total = len( file_list ) ,
+                                                                   file = args.progressbar_file ,
+                                                                   disable = args.progressbar_disabled ):
+                metrics.update( input_bytes[ full_path ] , mention_count or 0 ,
+                                worker = worker , busy_seconds = busy_seconds )
+    else:
+        metrics.start()
+        for full_path in progress( file_list ,
+                                   file = args.progressbar_file ,
+                                   disable = args.progressbar_disabled ):
+            mention_count , worker , busy_seconds = run_timed( convert_file , full_path ,
+                                                               profiler = profiler ,
+                                                               **shared_state )
+            metrics.update( input_bytes[ full_path ] , mention_count or 0 ,
+                            worker = worker , busy_seconds = busy_seconds )
+    metrics.close()
+    ##
+    profiler.write_report()
+
+
+if __name__ == "__main__":
+    main()
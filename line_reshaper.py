@@ -5,8 +5,6 @@ import logging as log
 
 import argparse
 
-from tqdm import tqdm
-
 import glob
 import os
 
@@ -14,6 +12,10 @@ import re
 
 import statistics
 
+from corpus_utils.profiling import add_profile_arguments , init_profiler
+from corpus_utils.lazy import progress
+from corpus_utils.options import add_progressbar_arguments , init_logging , init_progressbar
+
 #############################################
 ## helper functions
 #############################################
@@ -25,11 +27,7 @@ def initialize_arg_parser():
                          help = "print more information" ,
                          action = "store_true" )
 
-    parser.add_argument( '--progressbar-output' ,
-                         dest = 'progressbar_output' ,
-                         default = 'stderr' ,
-                         choices = [ 'stderr' , 'stdout' , 'none' ] ,
-                         help = "Pipe the progress bar to stderr, stdout, or neither" )
+    add_progressbar_arguments( parser )
 
     parser.add_argument( '--pretty-print' ,
                          dest = 'pretty_print' ,
@@ -64,6 +62,7 @@ def initialize_arg_parser():
                         default = 80 ,
                         help = "" )
 
+    add_profile_arguments( parser )
     ##
     return parser
 
@@ -73,27 +72,13 @@ def get_arguments( command_line_args ):
     ##
     return args
 
-def init_args():
+def init_args( command_line_args = None ):
     ##
-    args = get_arguments( sys.argv[ 1: ] )
+    args = get_arguments( command_line_args )
     ## Set up logging
-    if args.verbose:
-        log.basicConfig( format = "%(levelname)s: %(message)s" ,
-                         level = log.DEBUG )
-        log.info( "Verbose output." )
-        log.debug( "{}".format( args ) )
-    else:
-        log.basicConfig( format="%(levelname)s: %(message)s" )
+    init_logging( args )
     ## Configure progressbar peformance
-    if( args.progressbar_output == 'none' ):
-        args.progressbar_disabled = True
-        args.progressbar_file = None
-    else:
-        args.progressbar_disabled = False
-        if( args.progressbar_output == 'stderr' ):
-            args.progressbar_file = sys.stderr
-        elif( args.progressbar_output == 'stdout' ):
-            args.progressbar_file = sys.stdout
+    init_progressbar( args )
     ## lstrip hack added to handle prefixes and suffixes with dashes
     ##   https://stackoverflow.com/questions/16174992/cant-get-argparse-to-read-quoted-string-with-dashes-in-it
     args.file_prefix = args.file_prefix.lstrip()
@@ -108,18 +93,19 @@ def init_args():
 ## core functions
 #############################################
 
-def get_file_metrics( args ):
+def get_file_metrics( args , profiler ):
     log.debug( "Entering '{}'".format( sys._getframe().f_code.co_name ) )
     ##
-    file_list = set([os.path.basename(x) for x in glob.glob( args.input +
-                                                             args.file_prefix +
-                                                             '*' +
-                                                             args.file_suffix[ 0 ] )])
+    with profiler.stage( 'discover' ):
+        file_list = set([os.path.basename(x) for x in glob.glob( args.input +
+                                                                 args.file_prefix +
+                                                                 '*' +
+                                                                 args.file_suffix[ 0 ] )])
     lengths = []
     ##########################
-    for this_filename in tqdm( sorted( file_list ) ,
-                               file = args.progressbar_file ,
-                               disable = args.progressbar_disabled ):
+    for this_filename in progress( sorted( file_list ) ,
+                                   file = args.progressbar_file ,
+                                   disable = args.progressbar_disabled ):
         try:
             this_full_path = '{}/{}'.format( args.input ,
                                              this_filename )
@@ -133,11 +119,12 @@ def get_file_metrics( args ):
             e = sys.exc_info()[0]
             log.error( 'Uncaught exception in get_file_metrics:  {}'.format( e ) )
         ##
-        with open( this_full_path , 'r' ) as fp:
-            for line in fp:
-                line = line.strip()
-                if( len( line ) > 0 ):
-                    lengths.append( len( line ) )
+        with profiler.stage( 'read' , this_filename ):
+            with open( this_full_path , 'r' ) as fp:
+                for line in fp:
+                    line = line.strip()
+                    if( len( line ) > 0 ):
+                        lengths.append( len( line ) )
     print( 'Files:\t{}\nLines:\t{}\nMin:\t{}\nMean:\t{}\nMedian:\t{}\nMax:\t{}\n'.format(
         len( file_list ) ,
         len( lengths ) ,
@@ -148,17 +135,18 @@ def get_file_metrics( args ):
     #########
     log.debug( "-- Leaving '{}'".format( sys._getframe().f_code.co_name ) )
 
-def create_fixed_width( args ):
+def create_fixed_width( args , profiler ):
     log.debug( "Entering '{}'".format( sys._getframe().f_code.co_name ) )
     ##
-    file_list = set([os.path.basename(x) for x in glob.glob( args.input +
-                                                             args.file_prefix +
-                                                             '*' +
-                                                             args.file_suffix[ 0 ] )])
+    with profiler.stage( 'discover' ):
+        file_list = set([os.path.basename(x) for x in glob.glob( args.input +
+                                                                 args.file_prefix +
+                                                                 '*' +
+                                                                 args.file_suffix[ 0 ] )])
     ##########################
-    for this_filename in tqdm( sorted( file_list ) ,
-                               file = args.progressbar_file ,
-                               disable = args.progressbar_disabled ):
+    for this_filename in progress( sorted( file_list ) ,
+                                   file = args.progressbar_file ,
+                                   disable = args.progressbar_disabled ):
         try:
             this_full_path = '{}/{}'.format( args.input ,
                                              this_filename )
@@ -180,34 +168,43 @@ def create_fixed_width( args ):
             e = sys.exc_info()[0]
             log.error( 'Uncaught exception in get_file_metrics:  {}'.format( e ) )
         ##
-        with open( this_full_path , 'r' ) as in_file:
-            with open( that_full_path , 'w' ) as out_file:
-                for line in in_file:
-                    line = line.strip()
-                    if( args.max_width == -1 ):
-                        out_file.write( '{} '.format( line ) )
-                        continue
-                    chars = list( line )
-                    left_char = 0
-                    right_char = min( len( line ) , args.max_width )
-                    while( right_char < len( line ) ):
-                        while( right_char > left_char and
-                               re.match( r'\S' , chars[ right_char ] ) ):
-                            right_char -= 1
+        ## Lines are read, reshaped, and written in a single pass
+        with profiler.stage( 'write' , this_filename ):
+            with open( this_full_path , 'r' ) as in_file:
+                with open( that_full_path , 'w' ) as out_file:
+                    for line in in_file:
+                        line = line.strip()
+                        if( args.max_width == -1 ):
+                            out_file.write( '{} '.format( line ) )
+                            continue
+                        chars = list( line )
+                        left_char = 0
+                        right_char = min( len( line ) , args.max_width )
+                        while( right_char < len( line ) ):
+                            while( right_char > left_char and
+                                   re.match( r'\S' , chars[ right_char ] ) ):
+                                right_char -= 1
+                            out_file.write( '{}\n'.format( ''.join( chars[ left_char:right_char ] ) ) )
+                            left_char = right_char + 1
+                            right_char = min( len( line ) , right_char + args.max_width )
                         out_file.write( '{}\n'.format( ''.join( chars[ left_char:right_char ] ) ) )
-                        left_char = right_char + 1
-                        right_char = min( len( line ) , right_char + args.max_width )
-                    out_file.write( '{}\n'.format( ''.join( chars[ left_char:right_char ] ) ) )
-                if( args.max_width == -1 ):
-                    out_file.write( '\n' )
+                    if( args.max_width == -1 ):
+                        out_file.write( '\n' )
     #########
     log.debug( "-- Leaving '{}'".format( sys._getframe().f_code.co_name ) )
 
-if __name__ == "__main__":
+def main( command_line_args = None ):
     ##
-    args = init_args()
+    args = init_args( command_line_args )
+    profiler = init_profiler( args )
     ##
     if( args.print_metrics ):
-        get_file_metrics( args )
+        get_file_metrics( args , profiler )
     else:
-        create_fixed_width( args )
+        create_fixed_width( args , profiler )
+    ##
+    profiler.write_report()
+
+
+if __name__ == "__main__":
+    main()
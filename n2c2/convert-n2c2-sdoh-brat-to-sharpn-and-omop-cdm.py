@@ -0,0 +1,197 @@
+import sys
+import logging as log
+
+import argparse
+
+import glob
+import os
+
+sys.path.insert( 0 , os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' ) )
+from corpus_utils.sdoh import add_omop_types , loadTypeHandles , parse_ann_file , get_note_id , count_mentions , build_sharpn_cas , build_omop_cas
+from corpus_utils.profiling import add_profile_arguments , init_profiler
+from corpus_utils.metrics import add_metrics_arguments , init_metrics , file_bytes
+from corpus_utils.lazy import get_cassis , load_typesystem , progress
+from corpus_utils.options import add_progressbar_arguments , init_logging , init_progressbar
+
+#############################################
+## helper functions
+#############################################
+
+def initialize_arg_parser():
+    parser = argparse.ArgumentParser( description = """
+Convert the 2022 n2c2 Track 2 SDOH corpus (brat) into both SHARPn and
+OMOP CDM CAS XMI while reading and parsing every document only once.
+""")
+    parser.add_argument( '-v' , '--verbose' ,
+                         help = "print more information" ,
+                         action = "store_true" )
+
+    add_progressbar_arguments( parser )
+
+    parser.add_argument( '--no-relations' ,
+                         dest = 'noRels' ,
+                         help = "Do not create any OMOP CDM relation arcs between concepts" ,
+                         action = "store_true" )
+
+    parser.add_argument( '--types-file' ,
+                         dest = 'typesFile' ,
+                         help = 'XML file containing the types that need to be loaded' )
+
+    parser.add_argument( '--txt-root' , default = None ,
+                         required = True ,
+                         dest = "txt_root",
+                         help = "Directory containing input corpus in text format" )
+
+    parser.add_argument( '--brat-root' , default = None ,
+                         required = True ,
+                         dest = "brat_root",
+                         help = "Directory for input corpus in brat format (.ann files)" )
+
+    parser.add_argument( '--sharpn-root' , default = None ,
+                         dest = "sharpn_root",
+                         help = "Directory for output corpus in SHARPn CAS XMI formatted XML" )
+
+    parser.add_argument( '--omop-root' , default = None ,
+                         dest = "omop_root",
+                         help = "Directory for output corpus in OMOP CDM CAS XMI formatted XML" )
+
+    parser.add_argument( '--cas-root' , default = None ,
+                         dest = "cas_root",
+                         help = "Directory for output corpus with both representations in one CAS XMI per note (in the 'SHARPn' and 'OMOP_CDM' views)" )
+
+    add_profile_arguments( parser )
+    add_metrics_arguments( parser )
+    ##
+    return parser
+
+def get_arguments( command_line_args ):
+    parser = initialize_arg_parser()
+    args = parser.parse_args( command_line_args )
+    ##
+    return args
+
+def init_args( command_line_args = None ):
+    ##
+    args = get_arguments( command_line_args )
+    ## Set up logging
+    init_logging( args )
+    ## Configure progressbar peformance
+    init_progressbar( args )
+    ##
+    if( args.sharpn_root is None and
+        args.omop_root is None and
+        args.cas_root is None ):
+        log.error( 'At least one of --sharpn-root, --omop-root, or --cas-root is required' )
+        exit( 1 )
+    for output_dir in [ args.sharpn_root , args.omop_root , args.cas_root ]:
+        if( output_dir is not None and
+            not os.path.exists( output_dir ) ):
+            try:
+                os.makedirs( output_dir )
+            except OSError as e:
+                log.error( 'OSError caught while trying to create CAS XMI output folder:  {}'.format( e ) )
+            except IOError as e:
+                log.error( 'IOError caught while trying to create CAS XMI output folder:  {}'.format( e ) )
+    ##
+    return args
+
+
+## TODO - make this easily configurable from the command line
+def loadTypesystem( args ):
+    ############################
+    ## Create a type system
+    ## - https://github.com/dkpro/dkpro-cassis/blob/master/cassis/typesystem.py
+    typesystem = load_typesystem( args.typesFile )
+    typesystem = add_omop_types( typesystem )
+    return( typesystem )
+
+
+def new_cas( typesystem , note_contents ):
+    cas = get_cassis().Cas( typesystem = typesystem )
+    cas.sofa_string = note_contents
+    cas.sofa_mime = "text/plain"
+    return( cas )
+
+
+def new_view( cas , view_name , note_contents ):
+    view = cas.create_view( view_name )
+    view.sofa_string = note_contents
+    view.sofa_mime = "text/plain"
+    return( view )
+
+
+def main( command_line_args = None ):
+    ##
+    args = init_args( command_line_args )
+    profiler = init_profiler( args )
+    ##
+    typesystem = loadTypesystem( args )
+    types = loadTypeHandles( typesystem , sharpn = True , omop = True )
+    ##
+    ############################
+    ## Iterate over the files, parse each one once, and write every
+    ## requested representation to disk
+    with profiler.stage( 'discover' ):
+        file_list = [ os.path.basename( f ) for f in glob.glob( os.path.join( args.brat_root ,
+                                                                              '*.ann' ) ) ]
+    input_bytes = {}
+    for brat_filename in file_list:
+        input_bytes[ brat_filename ] = file_bytes( os.path.join( args.txt_root ,
+                                                                 '{}.txt'.format( brat_filename[ 0:-4 ] ) ) ,
+                                                   os.path.join( args.brat_root , brat_filename ) )
+    metrics = init_metrics( args , len( file_list ) , sum( input_bytes.values() ) )
+    note_count = 0
+    for brat_filename in progress( sorted( file_list ) ,
+                                   file = args.progressbar_file ,
+                                   disable = args.progressbar_disabled ):
+        plain_filename = brat_filename[ 0:-4 ]
+        txt_path = os.path.join( args.txt_root ,
+                                '{}.txt'.format( plain_filename ) )
+        if( not os.path.exists( txt_path ) ):
+            log.warn( 'No matching txt file found for \'{}\''.format( brat_filename ) )
+            metrics.update( input_bytes[ brat_filename ] )
+            continue
+        with profiler.stage( 'read' , plain_filename ):
+            with open( txt_path , 'r' ) as fp:
+                note_contents = fp.read().strip()
+        note_count += 1
+        brat_path = os.path.join( args.brat_root , brat_filename )
+        with profiler.stage( 'parse' , plain_filename ):
+            doc = parse_ann_file( brat_path )
+        note_id = get_note_id( brat_path , note_count )
+        xmi_filename = '{}.xmi'.format( plain_filename )
+        ##
+        if( args.sharpn_root is not None ):
+            with profiler.stage( 'build' , plain_filename ):
+                cas = build_sharpn_cas( new_cas( typesystem , note_contents ) ,
+                                        doc , types )
+            with profiler.stage( 'serialize' , plain_filename ):
+                cas.to_xmi( path = os.path.join( args.sharpn_root , xmi_filename ) ,
+                            pretty_print = True )
+        if( args.omop_root is not None ):
+            with profiler.stage( 'build' , plain_filename ):
+                cas = build_omop_cas( new_cas( typesystem , note_contents ) ,
+                                      doc , types , note_id ,
+                                      skip_relations = args.noRels )
+            with profiler.stage( 'serialize' , plain_filename ):
+                cas.to_xmi( path = os.path.join( args.omop_root , xmi_filename ) ,
+                            pretty_print = True )
+        if( args.cas_root is not None ):
+            with profiler.stage( 'build' , plain_filename ):
+                cas = new_cas( typesystem , note_contents )
+                build_sharpn_cas( new_view( cas , 'SHARPn' , note_contents ) ,
+                                  doc , types )
+                build_omop_cas( new_view( cas , 'OMOP_CDM' , note_contents ) ,
+                                doc , types , note_id ,
+                                skip_relations = args.noRels )
+            with profiler.stage( 'serialize' , plain_filename ):
+                cas.to_xmi( path = os.path.join( args.cas_root , xmi_filename ) ,
+                            pretty_print = True )
+        metrics.update( input_bytes[ brat_filename ] , count_mentions( doc ) )
+    metrics.close()
+    ##
+    profiler.write_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,44 +3,17 @@ import logging as log
 
 import argparse
 
-from tqdm import tqdm
-
 import glob
 import os
 
 import re
 
-try:
-    from lxml import etree
-    log.debug("running with lxml.etree")
-except ImportError:
-    try:
-        # Python 2.5
-        import xml.etree.cElementTree as etree
-        log.debug("running with cElementTree on Python 2.5+")
-    except ImportError:
-        try:
-            # Python 2.5
-            import xml.etree.ElementTree as etree
-            log.debug("running with ElementTree on Python 2.5+")
-        except ImportError:
-            try:
-                # normal cElementTree install
-                import cElementTree as etree
-                log.debug("running with cElementTree")
-            except ImportError:
-                try:
-                    # normal ElementTree install
-                    import elementtree.ElementTree as etree
-                    log.debug("running with ElementTree")
-                except ImportError:
-                    log.warn("Failed to import ElementTree from any known place")
-
-import cassis
-
-import warnings
-
-warnings.filterwarnings( 'ignore' , category = UserWarning , module = 'cassis' )
+sys.path.insert( 0 , os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' ) )
+from corpus_utils.brat import BratWriter
+from corpus_utils.profiling import add_profile_arguments , init_profiler
+from corpus_utils.metrics import add_metrics_arguments , init_metrics , file_bytes
+from corpus_utils.lazy import get_cassis , load_typesystem , progress
+from corpus_utils.options import add_progressbar_arguments , init_logging , init_progressbar
 
 #############################################
 ## helper functions
@@ -53,11 +26,7 @@ def initialize_arg_parser():
                          help = "print more information" ,
                          action = "store_true" )
 
-    parser.add_argument( '--progressbar-output' ,
-                         dest = 'progressbar_output' ,
-                         default = 'stderr' ,
-                         choices = [ 'stderr' , 'stdout' , 'none' ] ,
-                         help = "Pipe the progress bar to stderr, stdout, or neither" )
+    add_progressbar_arguments( parser )
 
     parser.add_argument( '--pretty-print' ,
                          dest = 'pretty_print' ,
@@ -83,16 +52,19 @@ def initialize_arg_parser():
                          dest = "cas_root",
                          help = "Directory for output corpus in CAS XMI formatted XML" )
     
-    parser.add_argument( '--left-window' , default = 20 ,
+    parser.add_argument( '--left-window' , default = 20 , type = int ,
                          dest = 'leftWindow' ,
                          help = "Characters to the left of the trigger annotation to include modifier relations" )
-    parser.add_argument( '--right-window' , default = 20 ,
+    parser.add_argument( '--right-window' , default = 20 , type = int ,
                          dest = 'rightWindow' ,
                          help = "Characters to the right of the trigger annotation to include modifier relations" )
     parser.add_argument( '--allow-identity' ,
                          dest = 'allowIdentity' ,
                          help = "Allow a trigger to have a relation arc pointing back to itself" ,
                          action = "store_true" )    
+
+    add_profile_arguments( parser )
+    add_metrics_arguments( parser )
     ##
     return parser
 
@@ -102,27 +74,13 @@ def get_arguments( command_line_args ):
     ##
     return args
 
-def init_args():
+def init_args( command_line_args = None ):
     ##
-    args = get_arguments( sys.argv[ 1: ] )
+    args = get_arguments( command_line_args )
     ## Set up logging
-    if( args.verbose ):
-        log.basicConfig( format = "%(levelname)s: %(message)s" ,
-                         level = log.DEBUG )
-        log.info( "Verbose output." )
-        log.debug( "{}".format( args ) )
-    else:
-        log.basicConfig( format="%(levelname)s: %(message)s" )
+    init_logging( args )
     ## Configure progressbar peformance
-    if( args.progressbar_output == 'none' ):
-        args.progressbar_disabled = True
-        args.progressbar_file = None
-    else:
-        args.progressbar_disabled = False
-        if( args.progressbar_output == 'stderr' ):
-            args.progressbar_file = sys.stderr
-        elif( args.progressbar_output == 'stdout' ):
-            args.progressbar_file = sys.stdout
+    init_progressbar( args )
     ####
     try:
         args.leftWindow = int( args.leftWindow )
@@ -146,8 +104,7 @@ def loadTypesystem( args ):
     ############################
     ## Create a type system
     ## - https://github.com/dkpro/dkpro-cassis/blob/master/cassis/typesystem.py
-    with open( args.typesFile , 'rb' ) as fp:
-        typesystem = cassis.load_typesystem( fp )
+    typesystem = load_typesystem( args.typesFile )
     ############
     ## ... for Metadata
     NoteMetadata = typesystem.get_type( metadata_typeString )
@@ -417,6 +374,8 @@ def process_cas_file( cas ,
                       left_window ,
                       right_window ,
                       allow_identity ):
+    typesystem = cas.typesystem
+    note_content = cas.sofa_string
     brat = { 'T' : {} , 'E' : {} , 'A' : {} }
     spansByType = { 'Alcohol' : {} ,
                     'Amount' : {} ,
@@ -640,7 +599,9 @@ def process_cas_file( cas ,
                                       'past' ] ):
                 concept_type = 'StatusTime'
             else:
-                print( 'Orphan:\t{}'.format( annot ) )
+                ## Orphans are still written out (below) so this is
+                ## only worth seeing with --verbose
+                log.debug( 'Orphan ({}):\t{}'.format( input_filename , annot ) )
                 orphanModifiers.append( annot )
                 continue
             concept_value = source_concept
@@ -802,43 +763,69 @@ def process_cas_file( cas ,
     return( attached_annots , brat )
 
 
-if __name__ == "__main__":
+def brat_records( attached_annots , brat ):
+    """The ( id , body ) of every record to write to the .ann file:
+    all E and A records but only the T records that ended up attached
+    to an event"""
+    records = []
+    for key_type in [ 'T' , 'E' , 'A' ]:
+        for key in sorted( brat[ key_type ] ):
+            if( key_type == 'E' or
+                key_type == 'A' or
+                key in attached_annots ):
+                records.append( ( '{}{}'.format( key_type , key ) ,
+                                  brat[ key_type ][ key ] ) )
+            ## TODO - log the T records that are dropped
+    return( records )
+
+
+def main( command_line_args = None ):
     ##
-    args = init_args()
+    args = init_args( command_line_args )
+    profiler = init_profiler( args )
     ##
+    cassis = get_cassis()
     typesystem = loadTypesystem( args )
     ##
     ############################
     ## Iterate over the files, covert to brat, and write the ann files to disk
-    file_list = [ os.path.basename( f ) for f in glob.glob( os.path.join( args.cas_root ,
-                                                                          '*.xmi' ) ) ]
-    for cas_filename in tqdm( sorted( file_list ) ,
-                               file = args.progressbar_file ,
-                               disable = args.progressbar_disabled ):
+    with profiler.stage( 'discover' ):
+        file_list = [ os.path.basename( f ) for f in glob.glob( os.path.join( args.cas_root ,
+                                                                              '*.xmi' ) ) ]
+    input_bytes = {}
+    for cas_filename in file_list:
+        input_bytes[ cas_filename ] = file_bytes( os.path.join( args.cas_root , cas_filename ) )
+    metrics = init_metrics( args , len( file_list ) , sum( input_bytes.values() ) )
+    for cas_filename in progress( sorted( file_list ) ,
+                                   file = args.progressbar_file ,
+                                   disable = args.progressbar_disabled ):
         plain_filename = cas_filename[ 0:-4 ]
         txt_path = os.path.join( args.txt_root ,
                                  '{}.txt'.format( plain_filename ) )
         brat_path = os.path.join( args.brat_root ,
                                   '{}.ann'.format( plain_filename ) )
-        with open( os.path.join( args.cas_root ,
-                                 cas_filename ) , 'rb' ) as fp:
-            cas = cassis.load_cas_from_xmi( fp , typesystem = typesystem )
-            with open( txt_path , 'w' ) as wp:
-                note_content = cas.sofa_string
-                wp.write( '{}'.format( note_content ) )
+        with profiler.stage( 'parse' , plain_filename ):
+            with open( os.path.join( args.cas_root ,
+                                     cas_filename ) , 'rb' ) as fp:
+                cas = cassis.load_cas_from_xmi( fp , typesystem = typesystem )
+        with profiler.stage( 'build' , plain_filename ):
+            note_content = cas.sofa_string
             attached_annots , brat = process_cas_file( cas , plain_filename ,
                                                        args.leftWindow ,
                                                        args.rightWindow ,
                                                        args.allowIdentity )
-            with open( brat_path , 'w' ) as wp:
-                for key_type in [ 'T' , 'E' , 'A' ]:
-                    for key in sorted( brat[ key_type ] ):
-                        if( key_type == 'E' or
-                            key_type == 'A' or
-                            key in attached_annots ):
-                            wp.write( '{}{}\t{}\n'.format( key_type , key ,
-                                                           brat[ key_type ][ key ] ) )
-                        elif( key_type == 'T' and
-                              key not in attached_annots ):
-                            ## TODO - log these
-                            1
+        with profiler.stage( 'write' , plain_filename ):
+            with open( txt_path , 'w' ) as wp:
+                wp.write( '{}'.format( note_content ) )
+            brat_writer = BratWriter( brat_path )
+            for annot_id , body in brat_records( attached_annots , brat ):
+                brat_writer.add_line( annot_id , body )
+            brat_writer.flush()
+        metrics.update( input_bytes[ cas_filename ] , len( attached_annots ) )
+    metrics.close()
+    ##
+    profiler.write_report()
+
+
+if __name__ == "__main__":
+    main()
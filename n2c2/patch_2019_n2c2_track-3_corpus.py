@@ -8,7 +8,15 @@ import glob
 
 import logging as log
 
-from tqdm import tqdm
+import multiprocessing
+
+sys.path.insert( 0 , os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' ) )
+from corpus_utils.brat import parse_spans , span_text
+from corpus_utils.redaction import HashPolicy , check_redacted
+from corpus_utils.layout import load_layout
+from corpus_utils.lazy import progress
+from corpus_utils.metrics import add_metrics_arguments , init_metrics , file_bytes , run_timed
+from corpus_utils.options import add_progressbar_arguments , add_workers_arguments , init_progressbar
 
 def initialize_arg_parser():
     parser = argparse.ArgumentParser( description = """
@@ -22,12 +30,25 @@ annotation file.
 
     parser.add_argument( '--input-dir' , required = True ,
                          dest = "inputDir",
-                         help = "Root input directory containg a train and test folder" )
+                         help = "Root input directory containg a train and test folder (or the splits listed in --layout)" )
 
     parser.add_argument( '--output-dir' , required = True ,
                         dest = "outputDir",
                         help = "Root output directory for writing the ann files" )
-    
+
+    parser.add_argument( '--layout' , default = None ,
+                         dest = 'layout_file' ,
+                         help = "JSON or YAML file describing the corpus splits and the 'note', 'redacted', and 'ann' folder of each (Default:  train/test as released for 2019 n2c2 Track 3)" )
+
+    parser.add_argument( '--hash-key-file' , default = None ,
+                         dest = 'hash_key_file' ,
+                         help = "Key used to redact the corpus with the 'hash' policy.  When given, every hash token is checked against the patched span" )
+
+    add_workers_arguments( parser , 'patch files' )
+
+    add_progressbar_arguments( parser )
+
+    add_metrics_arguments( parser )
     ##
     return parser
 
@@ -51,80 +72,175 @@ def check_dir( dir_of_interest , bad_args_flag ):
             log.error( 'IOError caught while trying to create output folder:  {}'.format( e ) )
     return bad_args_flag
 
-def init_args():
+def init_args( command_line_args = None ):
     ##
-    args = get_arguments( sys.argv[ 1: ] )
+    args = get_arguments( command_line_args )
     bad_args_flag = False
     ##
-    for split in [ 'train' , 'test' ]:
-        for form in [ 'redacted' , 'note' ]:
-            input_dir = os.path.join( args.inputDir ,
-                                      split ,
-                                      '{}_{}'.format( split , form ) )
-            if( not os.path.exists( input_dir ) ):
-                bad_args_flag = True
-                log.error( 'The input directory does not exist:  {}'.format( input_dir ) )
+    try:
+        args.layout = load_layout( args.layout_file )
+    except ( OSError , ValueError ) as e:
+        log.error( 'Unable to load the corpus layout:  {}'.format( e ) )
+        log.error( "I'm bailing out of this run because of errors mentioned above." )
+        exit( 1 )
+    ##
+    for split in args.layout.splits:
+        try:
+            for form in [ 'redacted' , 'note' ]:
+                input_dir = args.layout.folder( args.inputDir , split , form )
+                if( not os.path.exists( input_dir ) ):
+                    bad_args_flag = True
+                    log.error( 'The input directory does not exist:  {}'.format( input_dir ) )
+            ##
+            bad_args_flag = check_dir( args.layout.folder( args.outputDir , split , 'ann' ) ,
+                                       bad_args_flag )
+        except ValueError as e:
+            bad_args_flag = True
+            log.error( '{}'.format( e ) )
     ##
-    bad_args_flag = check_dir( os.path.join( args.outputDir ,
-                                             'train' ,
-                                             'train_ann' ) ,
-                               bad_args_flag )
-    bad_args_flag = check_dir( os.path.join( args.outputDir ,
-                                             'test' ,
-                                             'test_ann' ) ,
-                               bad_args_flag )
+    if( args.hash_key_file is not None and
+        not os.path.exists( args.hash_key_file ) ):
+        bad_args_flag = True
+        log.error( 'The hash key file does not exist:  {}'.format( args.hash_key_file ) )
     ##
     if( bad_args_flag ):
         log.error( "I'm bailing out of this run because of errors mentioned above." )
         exit( 1 )
+    ## Configure progressbar peformance
+    init_progressbar( args )
     ##
     return args
 
+
+def patch_file( note_path , redacted_path , ann_path , hash_policy = None ):
+    """Fill every redacted text-bound string back in from the note.
+    Discontinuous spans get the text of every fragment joined by a space
+    and line breaks become spaces (the same as brat).  When the redacted string carries a mask or a
+    hash token, the patched string is checked against it to catch
+    offsets that have drifted.  Returns counts of the spans patched,
+    spans that ran past the end of the note, and spans that failed or
+    passed their check."""
+    counts = { 'files' : 1 , 'spans' : 0 , 'out_of_range' : 0 ,
+               'mismatched' : 0 , 'verified' : 0 }
+    with open( note_path , 'r' ) as fp:
+        note_contents = fp.read()
+    out_lines = []
+    with open( redacted_path , 'r' ) as in_fp:
+        for line in in_fp:
+            line = line.strip()
+            if( not line.startswith( 'T' ) ):
+                out_lines.append( line )
+                continue
+            cols = line.split( '\t' , 2 )
+            annotType , _ , offsets = cols[ 1 ].partition( ' ' )
+            spans = parse_spans( offsets )
+            counts[ 'spans' ] += 1
+            if( max( [ end_offset for begin_offset , end_offset in spans ] ) > len( note_contents ) ):
+                counts[ 'out_of_range' ] += 1
+                log.debug( 'Span runs past the end of the note ({}):  {}'.format( note_path , line ) )
+            span = span_text( note_contents , spans )
+            if( len( cols ) > 2 ):
+                ## Lines are stripped before they are redacted so any
+                ## trailing whitespace never made it into the mask or token
+                span_check = check_redacted( cols[ 2 ] , span.rstrip() , hash_policy )
+                if( span_check is False ):
+                    counts[ 'mismatched' ] += 1
+                    log.debug( 'Patched span does not match its redacted string ({}):  {}'.format( note_path , line ) )
+                elif( span_check ):
+                    counts[ 'verified' ] += 1
+            out_lines.append( '{}\t{}\t{}'.format( cols[ 0 ] ,
+                                                   cols[ 1 ] ,
+                                                   span ) )
+    with open( ann_path , 'w' ) as out_fp:
+        out_fp.write( ''.join( [ '{}\n'.format( line ) for line in out_lines ] ) )
+    return( counts )
+
+
+## State shared by every file in a run.  Workers get a copy through
+## the pool initializer.
+shared_state = {}
+
+def init_worker( hash_policy ):
+    shared_state.update( { 'hash_policy' : hash_policy } )
+
+
+def patch_file_in_worker( job ):
+    split , note_path , redacted_path , ann_path = job
+    return( split , note_path , run_timed( patch_file , note_path , redacted_path , ann_path ,
+                                           **shared_state ) )
+
 #############################################
 ## 
 #############################################
 
-if __name__ == "__main__":
+def main( command_line_args = None ):
     ##
-    args = init_args()
+    args = init_args( command_line_args )
     ##
+    hash_policy = None
+    if( args.hash_key_file is not None ):
+        with open( args.hash_key_file , 'rb' ) as fp:
+            hash_policy = HashPolicy( fp.read().strip() )
+    init_worker( hash_policy )
     ##########################
-    for split in [ 'train' , 'test' ]:
-        redacted_dir = os.path.join( args.inputDir ,
-                                     split ,
-                                     '{}_redacted'.format( split ) )
-        note_dir = os.path.join( args.inputDir ,
-                                 split ,
-                                 '{}_note'.format( split ) )
-        ann_dir = os.path.join( args.outputDir ,
-                                split ,
-                                '{}_ann'.format( split ) )
+    splits = args.layout.splits
+    jobs = []
+    for split in splits:
+        redacted_dir = args.layout.folder( args.inputDir , split , 'redacted' )
+        note_dir = args.layout.folder( args.inputDir , split , 'note' )
+        ann_dir = args.layout.folder( args.outputDir , split , 'ann' )
         file_list = glob.glob( os.path.join( note_dir ,
                                              '*.txt' ) )
-        for full_path in tqdm( file_list , desc = split ):
+        for full_path in sorted( file_list ):
             note_filename = os.path.basename( full_path )
             ann_filename = re.sub( '.txt$' ,
                                    '.ann' ,
                                    note_filename )
-            with open( full_path , 'r' ) as fp:
-                note_contents = fp.read()
-            with open( os.path.join( redacted_dir ,
-                                     ann_filename ) ,
-                       'r' ) as in_fp:
-                with open( os.path.join( ann_dir ,
-                                         ann_filename ) ,
-                           'w' ) as out_fp:
-                    for line in in_fp:
-                        line = line.strip()
-                        cols = line.split( '\t' )
-                        if( cols[ 0 ][ 0 ] == 'T' ):
-                            middleCols = cols[ 1 ].split( ' ' )
-                            annotType = middleCols[ 0 ]
-                            startOffset = int( middleCols[ 1 ] )
-                            endOffset = int( middleCols[ -1 ] )
-                            span = note_contents[ startOffset : endOffset ]
-                            out_fp.write( '{}\t{}\t{}\n'.format( cols[ 0 ] ,
-                                                                 cols[ 1 ] ,
-                                                                 span ) )
-                        else:
-                            out_fp.write( '{}\n'.format( line ) )
+            jobs.append( ( split , full_path ,
+                           os.path.join( redacted_dir , ann_filename ) ,
+                           os.path.join( ann_dir , ann_filename ) ) )
+    input_bytes = {}
+    for split , note_path , redacted_path , ann_path in jobs:
+        input_bytes[ note_path ] = file_bytes( note_path , redacted_path )
+    metrics = init_metrics( args , len( jobs ) , sum( input_bytes.values() ) ,
+                            start = False )
+    ## Every split shares one pool
+    split_counts = {}
+    for split in splits:
+        split_counts[ split ] = { 'files' : 0 , 'spans' : 0 , 'out_of_range' : 0 ,
+                                  'mismatched' : 0 , 'verified' : 0 }
+    if( args.workers > 1 ):
+        pool = multiprocessing.Pool( processes = args.workers ,
+                                     initializer = init_worker ,
+                                     initargs = ( hash_policy , ) )
+        results = pool.imap_unordered( patch_file_in_worker , jobs , chunksize = 16 )
+    else:
+        pool = None
+        results = map( patch_file_in_worker , jobs )
+    ## Only start the heartbeat once any workers are forked
+    metrics.start()
+    for split , note_path , ( counts , worker , busy_seconds ) in progress( results ,
+                                                                           total = len( jobs ) ,
+                                                                           file = args.progressbar_file ,
+                                                                           disable = args.progressbar_disabled ):
+        for count_type in counts:
+            split_counts[ split ][ count_type ] += counts[ count_type ]
+        metrics.update( input_bytes[ note_path ] , counts[ 'spans' ] ,
+                        worker = worker , busy_seconds = busy_seconds )
+    if( pool is not None ):
+        pool.close()
+        pool.join()
+    metrics.close()
+    ##
+    for split in splits:
+        counts = split_counts[ split ]
+        print( '{}\t{} files\t{} spans\t{} verified\t{} mismatched\t{} out of range'.format( split ,
+                                                                                               counts[ 'files' ] ,
+                                                                                               counts[ 'spans' ] ,
+                                                                                               counts[ 'verified' ] ,
+                                                                                               counts[ 'mismatched' ] ,
+                                                                                               counts[ 'out_of_range' ] ) )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,17 @@ import sys
 import logging as log
 
 import glob
-from tqdm import tqdm
-
 import argparse
 
+import multiprocessing
+
+sys.path.insert( 0 , os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' ) )
+from corpus_utils.redaction import RedactedPolicy , MaskPolicy , HashPolicy
+from corpus_utils.layout import load_layout
+from corpus_utils.lazy import progress
+from corpus_utils.metrics import add_metrics_arguments , init_metrics , file_bytes , run_timed
+from corpus_utils.options import add_progressbar_arguments , add_workers_arguments , init_progressbar
+
 def initialize_arg_parser():
     parser = argparse.ArgumentParser( description = """
 Redact brat annotation files (.ann) by removing all span strings and
@@ -24,7 +31,39 @@ write to a new directory.
     parser.add_argument( '--output-dir' , required = True ,
                          dest = "outputDir",
                          help = "Output directory for writing the ann files" )
-    
+
+    parser.add_argument( '--layout' , default = None ,
+                         dest = 'layout_file' ,
+                         help = "JSON or YAML file describing the corpus splits.  When given, the input and output directories are treated as corpus roots and every split's 'ann' folder is redacted into its 'redacted' folder" )
+
+    parser.add_argument( '--policy' , default = 'redacted' ,
+                         dest = 'policy' ,
+                         choices = [ 'redacted' , 'mask' , 'hash' ] ,
+                         help = "How to redact each string: replace it with '[redacted]' (default), mask every non-whitespace character (keeping the length), or replace it with a keyed hash token" )
+
+    parser.add_argument( '--mask-char' , default = 'X' ,
+                         dest = 'mask_char' ,
+                         help = "Character to mask with when using the 'mask' policy (Default:  X)" )
+
+    parser.add_argument( '--hash-key-file' , default = None ,
+                         dest = 'hash_key_file' ,
+                         help = "File containing the secret key for the 'hash' policy.  Anyone holding the key can regenerate the tokens from the original strings" )
+
+    parser.add_argument( '--token-map' , default = None ,
+                         dest = 'token_map' ,
+                         help = "Tab-delimited file to write every hash token and the string it replaced to for later re-identification.  Keep it with the key" )
+
+    parser.add_argument( '--line-types' , nargs = '+' ,
+                         default = [ 'T' ] ,
+                         dest = 'line_types' ,
+                         choices = [ 'T' , 'N' , 'A' , '#' ] ,
+                         help = "Annotation lines to redact: text-bound spans (T), normalization strings (N), attribute values (A), and annotator notes (#) (Default:  T)" )
+
+    add_workers_arguments( parser , 'redact files' )
+
+    add_progressbar_arguments( parser )
+
+    add_metrics_arguments( parser )
     ##
     return parser
 
@@ -48,43 +87,186 @@ def check_dir( dir_of_interest , bad_args_flag ):
             log.error( 'IOError caught while trying to create output folder:  {}'.format( e ) )
     return bad_args_flag
 
-def init_args():
+def init_args( command_line_args = None ):
     ##
-    args = get_arguments( sys.argv[ 1: ] )
+    args = get_arguments( command_line_args )
     bad_args_flag = False
     ##
     if( not os.path.exists( args.inputDir ) ):
         bad_args_flag = True
         log.error( 'The input directory does not exist:  {}'.format( args.inputDir ) )
     ##
-    bad_args_flag = check_dir( os.path.join( args.outputDir ) ,
-                               bad_args_flag )
+    ## Pairs of folders to redact from and into
+    args.folders = []
+    if( args.layout_file is None ):
+        args.folders.append( ( args.inputDir , args.outputDir ) )
+    else:
+        try:
+            layout = load_layout( args.layout_file )
+            for split in layout.splits:
+                args.folders.append( ( layout.folder( args.inputDir , split , 'ann' ) ,
+                                       layout.folder( args.outputDir , split , 'redacted' ) ) )
+        except ( OSError , ValueError ) as e:
+            bad_args_flag = True
+            log.error( 'Unable to load the corpus layout:  {}'.format( e ) )
+    for input_dir , output_dir in args.folders:
+        if( args.layout_file is not None and
+            not os.path.exists( input_dir ) ):
+            bad_args_flag = True
+            log.error( 'The input directory does not exist:  {}'.format( input_dir ) )
+        bad_args_flag = check_dir( output_dir ,
+                                   bad_args_flag )
+    ##
+    if( args.policy == 'hash' ):
+        if( args.hash_key_file is None ):
+            bad_args_flag = True
+            log.error( "The 'hash' policy requires a --hash-key-file" )
+        elif( not os.path.exists( args.hash_key_file ) ):
+            bad_args_flag = True
+            log.error( 'The hash key file does not exist:  {}'.format( args.hash_key_file ) )
+    elif( args.token_map is not None ):
+        log.warning( "Ignoring --token-map because it only applies to the 'hash' policy" )
+        args.token_map = None
+    if( len( args.mask_char ) != 1 ):
+        bad_args_flag = True
+        log.error( 'The mask character must be a single character:  {}'.format( args.mask_char ) )
     ##
     if( bad_args_flag ):
         log.error( "I'm bailing out of this run because of errors mentioned above." )
         exit( 1 )
+    ## Configure progressbar peformance
+    init_progressbar( args )
     ##
     return args
 
+def load_policy( args ):
+    if( args.policy == 'mask' ):
+        return( MaskPolicy( args.mask_char ) )
+    elif( args.policy == 'hash' ):
+        with open( args.hash_key_file , 'rb' ) as fp:
+            key = fp.read().strip()
+        return( HashPolicy( key ) )
+    return( RedactedPolicy() )
+
+
+def redact_line( line , policy , line_types , token_map = None ):
+    """Redact the free-text part of a single .ann line (without its
+    newline).  Text-bound, normalization, and note lines carry their
+    string in the third column.  Attribute lines carry an optional value
+    after the attribute name and target."""
+    if( line == '' or line[ 0 ] not in line_types ):
+        return( line )
+    if( line[ 0 ] == 'A' ):
+        ann_id , _ , middle = line.partition( '\t' )
+        fields = middle.split( ' ' , 2 )
+        if( len( fields ) < 3 ):
+            return( line )
+        text = fields[ 2 ]
+        prefix = '{}\t{} {} '.format( ann_id , fields[ 0 ] , fields[ 1 ] )
+    else:
+        cols = line.split( '\t' , 2 )
+        if( len( cols ) < 3 ):
+            return( line )
+        text = cols[ 2 ]
+        prefix = '{}\t{}\t'.format( cols[ 0 ] , cols[ 1 ] )
+    redacted_text = policy.redact( text )
+    if( token_map is not None ):
+        token_map[ redacted_text ] = text
+    return( '{}{}'.format( prefix , redacted_text ) )
+
+
+def redact_file( in_path , out_path , policy , line_types , collect_tokens = False ):
+    """Redact a single .ann file.  Returns the tokens generated (if
+    collect_tokens is set) mapped to the strings they replaced and the
+    number of lines of the types being redacted."""
+    token_map = {} if collect_tokens else None
+    out_lines = []
+    line_count = 0
+    with open( in_path , 'r' ) as in_fp:
+        for line in in_fp:
+            line = line.strip()
+            if( line != '' and line[ 0 ] in line_types ):
+                line_count += 1
+            out_lines.append( redact_line( line , policy , line_types , token_map ) )
+    with open( out_path , 'w' ) as out_fp:
+        out_fp.write( ''.join( '{}\n'.format( line ) for line in out_lines ) )
+    return( token_map , line_count )
+
+
+## State shared by every file in a run.  Workers get a copy through
+## the pool initializer.
+shared_state = {}
+
+def init_worker( policy , line_types , collect_tokens ):
+    shared_state.update( { 'policy' : policy ,
+                           'line_types' : line_types ,
+                           'collect_tokens' : collect_tokens } )
+
+
+def redact_file_in_worker( paths ):
+    return( paths[ 0 ] , run_timed( redact_file , paths[ 0 ] , paths[ 1 ] , **shared_state ) )
+
 #############################################
 ## 
 #############################################
 
-if __name__ == "__main__":
+def main( command_line_args = None ):
     ##
-    args = init_args()
+    args = init_args( command_line_args )
     ##
+    policy = load_policy( args )
+    line_types = set( args.line_types )
+    collect_tokens = ( args.token_map is not None )
+    init_worker( policy , line_types , collect_tokens )
     ##########################
-    file_list = glob.glob( os.path.join( args.inputDir , '*.ann' ) )                                         
-    for full_path in tqdm( file_list ):
-        filename = os.path.basename( full_path )
-        out_path = os.path.join( args.outputDir , filename )
-        with open( full_path , 'r' ) as in_fp:
-            with open( out_path , 'w' ) as out_fp:
-                for line in in_fp:
-                    line = line.strip()
-                    cols = line.split( '\t' )
-                    if( cols[ 0 ][ 0 ] == 'T' ):
-                        out_fp.write( '{}\t{}\t{}\n'.format( cols[ 0 ] , cols[ 1 ] , '[redacted]' ) )
-                    else:
-                        out_fp.write( '{}\n'.format( line ) )
+    ## Every folder (split) shares one pool
+    jobs = []
+    for input_dir , output_dir in args.folders:
+        file_list = glob.glob( os.path.join( input_dir , '*.ann' ) )
+        jobs.extend( [ ( full_path , os.path.join( output_dir ,
+                                                   os.path.basename( full_path ) ) )
+                       for full_path in file_list ] )
+    input_bytes = {}
+    for in_path , out_path in jobs:
+        input_bytes[ in_path ] = file_bytes( in_path )
+    metrics = init_metrics( args , len( jobs ) , sum( input_bytes.values() ) ,
+                            start = False )
+    token_map = {}
+    if( args.workers > 1 ):
+        with multiprocessing.Pool( processes = args.workers ,
+                                   initializer = init_worker ,
+                                   initargs = ( policy , line_types , collect_tokens ) ) as pool:
+            ## Only start the heartbeat once the workers are forked
+            metrics.start()
+            for in_path , ( ( file_tokens , line_count ) ,
+                            worker , busy_seconds ) in progress( pool.imap_unordered( redact_file_in_worker ,
+                                                                                      jobs ,
+                                                                                      chunksize = 16 ) ,
+                                                                 total = len( jobs ) ,
+                                                                 file = args.progressbar_file ,
+                                                                 disable = args.progressbar_disabled ):
+                if( file_tokens is not None ):
+                    token_map.update( file_tokens )
+                metrics.update( input_bytes[ in_path ] , line_count ,
+                                worker = worker , busy_seconds = busy_seconds )
+    else:
+        metrics.start()
+        for job in progress( jobs ,
+                             file = args.progressbar_file ,
+                             disable = args.progressbar_disabled ):
+            in_path , ( ( file_tokens , line_count ) ,
+                        worker , busy_seconds ) = redact_file_in_worker( job )
+            if( file_tokens is not None ):
+                token_map.update( file_tokens )
+            metrics.update( input_bytes[ in_path ] , line_count ,
+                            worker = worker , busy_seconds = busy_seconds )
+    metrics.close()
+    ##
+    if( args.token_map is not None ):
+        with open( args.token_map , 'w' ) as fp:
+            for token in sorted( token_map ):
+                fp.write( '{}\t{}\n'.format( token , token_map[ token ] ) )
+
+
+if __name__ == "__main__":
+    main()
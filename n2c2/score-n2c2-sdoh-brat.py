@@ -0,0 +1,414 @@
+import sys
+import logging as log
+
+import argparse
+
+import bisect
+import csv
+import glob
+import os
+
+import multiprocessing
+
+sys.path.insert( 0 , os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' ) )
+from corpus_utils.brat import parse_spans
+from corpus_utils.sdoh import attributeClasses
+from corpus_utils.lazy import progress
+from corpus_utils.options import add_progressbar_arguments , add_workers_arguments , init_logging , init_progressbar
+
+#############################################
+## helper functions
+#############################################
+
+## Arguments whose subtype comes from a *Val attribute (e.g.,
+## StatusTime current/past/none).  These are scored on their subtype
+## and every other argument on its span.
+labeledArguments = [ attribute_class[ 0:-3 ]
+                     for attribute_class in attributeClasses ]
+
+def initialize_arg_parser():
+    parser = argparse.ArgumentParser( description = """
+Score n2c2 2022 Track 2 (SDOH) system output in brat format against
+the reference standard, event by event.  Triggers are aligned by event
+type and span and the arguments of aligned events are then scored
+within them.  Precision, recall, and F1 are reported per event type
+and argument (and per subtype with --detailed).
+""" )
+    parser.add_argument( '-v' , '--verbose' ,
+                         help = "print more information" ,
+                         action = "store_true" )
+
+    add_progressbar_arguments( parser )
+
+    parser.add_argument( '--gold-root' , default = None ,
+                         required = True ,
+                         dest = "gold_root",
+                         help = "Directory containing the reference standard .ann files" )
+
+    parser.add_argument( '--system-root' , default = None ,
+                         required = True ,
+                         dest = "system_root",
+                         help = "Directory containing the system output .ann files" )
+
+    parser.add_argument( '--score-trigger' , default = 'overlap' ,
+                         choices = [ 'overlap' , 'exact' ] ,
+                         dest = 'score_trigger' ,
+                         help = "How closely a system trigger span must match the reference trigger span" )
+
+    parser.add_argument( '--score-span' , default = 'exact' ,
+                         choices = [ 'exact' , 'overlap' ] ,
+                         dest = 'score_span' ,
+                         help = "How closely a system argument span (e.g., Amount) must match the reference argument span" )
+
+    parser.add_argument( '--score-labeled' , default = 'label' ,
+                         choices = [ 'label' , 'label-span' ] ,
+                         dest = 'score_labeled' ,
+                         help = "Score labeled arguments (e.g., StatusTime) on their subtype alone or on their subtype and span (as per --score-span)" )
+
+    parser.add_argument( '--detailed' ,
+                         dest = 'detailed' ,
+                         help = "Break every labeled argument down by subtype" ,
+                         action = "store_true" )
+
+    parser.add_argument( '--output-file' , default = None ,
+                         dest = 'output_file' ,
+                         help = "CSV file to write the scores (event, argument, subtype, NT, NP, TP, P, R, F1) to" )
+
+    add_workers_arguments( parser , 'score notes' )
+    ##
+    return parser
+
+def get_arguments( command_line_args ):
+    parser = initialize_arg_parser()
+    args = parser.parse_args( command_line_args )
+    ##
+    return args
+
+def init_args( command_line_args = None ):
+    ##
+    args = get_arguments( command_line_args )
+    ## Set up logging
+    init_logging( args )
+    ## Configure progressbar peformance
+    init_progressbar( args )
+    ##
+    return args
+
+#############################################
+## indexing
+#############################################
+
+def index_ann_lines( lines ):
+    """Index the events of a single SDOH .ann file by event type.
+
+    Each event is a dict with its 'type', the 'begin', 'end', and
+    'spans' of its trigger, and its 'arguments' as a dict from
+    argument label (the label of the argument's T record, e.g.,
+    StatusTime or Amount) to a list of ( begin , end , spans , subtype )
+    tuples.  An argument that the event lists more than once (e.g., as
+    both Status:T5 and StatusTime:T5) is only kept once.
+
+    Events of each type are sorted by trigger begin offset with a
+    parallel list of the begin offsets ('begins') and the longest
+    trigger ('max_length') so overlapping triggers can be found with a
+    bisect rather than a scan."""
+    text_bounds = {}
+    subtypes = {}
+    event_lines = []
+    for line in lines:
+        line = line.rstrip( '\n' )
+        if( '\t' not in line ):
+            continue
+        annot_id , body = line.split( '\t' , 1 )
+        if( annot_id.startswith( 'T' ) ):
+            label , offsets = body.split( '\t' , 1 )[ 0 ].split( ' ' , 1 )
+            spans = tuple( parse_spans( offsets ) )
+            text_bounds[ annot_id ] = ( label ,
+                                        min( [ span[ 0 ] for span in spans ] ) ,
+                                        max( [ span[ 1 ] for span in spans ] ) ,
+                                        spans )
+        elif( annot_id.startswith( 'E' ) ):
+            event_lines.append( body )
+        elif( annot_id.startswith( 'A' ) ):
+            fields = body.split()
+            if( len( fields ) > 2 and fields[ 0 ] in attributeClasses ):
+                subtypes[ fields[ 1 ] ] = fields[ 2 ]
+    index = {}
+    for body in event_lines:
+        trigger , *arguments = body.split()
+        event_type , trigger_id = trigger.split( ':' )
+        if( trigger_id not in text_bounds ):
+            log.debug( 'Skipping event with a missing trigger:  {}'.format( body ) )
+            continue
+        label , begin_offset , end_offset , spans = text_bounds[ trigger_id ]
+        event = { 'type' : event_type ,
+                  'begin' : begin_offset ,
+                  'end' : end_offset ,
+                  'spans' : spans ,
+                  'arguments' : {} }
+        seen_ids = set( [ trigger_id ] )
+        for argument in arguments:
+            role , argument_id = argument.split( ':' )
+            if( argument_id in seen_ids or argument_id not in text_bounds ):
+                continue
+            seen_ids.add( argument_id )
+            label , begin_offset , end_offset , spans = text_bounds[ argument_id ]
+            if( label not in event[ 'arguments' ] ):
+                event[ 'arguments' ][ label ] = []
+            event[ 'arguments' ][ label ].append( ( begin_offset , end_offset , spans ,
+                                                    subtypes.get( argument_id , None ) ) )
+        if( event_type not in index ):
+            index[ event_type ] = { 'events' : [] }
+        index[ event_type ][ 'events' ].append( event )
+    for event_type in index:
+        events = sorted( index[ event_type ][ 'events' ] ,
+                         key = lambda event : ( event[ 'begin' ] , event[ 'end' ] ) )
+        index[ event_type ] = { 'events' : events ,
+                                'begins' : [ event[ 'begin' ] for event in events ] ,
+                                'max_length' : max( [ event[ 'end' ] - event[ 'begin' ]
+                                                      for event in events ] ) }
+    return( index )
+
+
+def index_ann_file( input_filename ):
+    """Index a single .ann file (see index_ann_lines).  A missing file
+    has no events."""
+    if( not os.path.exists( input_filename ) ):
+        return( {} )
+    with open( input_filename , 'r' ) as fp:
+        return( index_ann_lines( fp ) )
+
+#############################################
+## scoring
+#############################################
+
+def spans_match( gold , system , score_span ):
+    ## gold and system are ( begin , end , spans , ... ) tuples
+    if( score_span == 'exact' ):
+        return( gold[ 2 ] == system[ 2 ] )
+    return( gold[ 0 ] < system[ 1 ] and system[ 0 ] < gold[ 1 ] )
+
+
+def arguments_match( label , gold , system , args ):
+    if( label in labeledArguments ):
+        if( gold[ 3 ] != system[ 3 ] ):
+            return( False )
+        if( args.score_labeled == 'label' ):
+            return( True )
+    return( spans_match( gold , system , args.score_span ) )
+
+
+def align_arguments( gold_event , system_event , args ):
+    """Pair up the arguments of two aligned events one-to-one.  Returns
+    the matched ( label , subtype ) of every pair."""
+    matches = []
+    for label in system_event[ 'arguments' ]:
+        if( label not in gold_event[ 'arguments' ] ):
+            continue
+        unmatched = list( gold_event[ 'arguments' ][ label ] )
+        for system_argument in system_event[ 'arguments' ][ label ]:
+            for gold_idx , gold_argument in enumerate( unmatched ):
+                if( arguments_match( label , gold_argument , system_argument , args ) ):
+                    matches.append( ( label , gold_argument[ 3 ] ) )
+                    del unmatched[ gold_idx ]
+                    break
+    return( matches )
+
+
+def trigger_candidates( gold_index , system_event , score_trigger ):
+    """Reference events of the same type whose trigger matches the
+    system trigger.  Only the events starting between ( system begin -
+    longest trigger ) and the system end can overlap it."""
+    if( system_event[ 'type' ] not in gold_index ):
+        return( [] )
+    gold_events = gold_index[ system_event[ 'type' ] ]
+    if( score_trigger == 'exact' ):
+        first_idx = bisect.bisect_left( gold_events[ 'begins' ] , system_event[ 'begin' ] )
+        last_idx = bisect.bisect_right( gold_events[ 'begins' ] , system_event[ 'begin' ] )
+        return( [ gold_idx for gold_idx in range( first_idx , last_idx )
+                  if( gold_events[ 'events' ][ gold_idx ][ 'spans' ] == system_event[ 'spans' ] ) ] )
+    first_idx = bisect.bisect_left( gold_events[ 'begins' ] ,
+                                    system_event[ 'begin' ] - gold_events[ 'max_length' ] )
+    last_idx = bisect.bisect_left( gold_events[ 'begins' ] , system_event[ 'end' ] )
+    return( [ gold_idx for gold_idx in range( first_idx , last_idx )
+              if( gold_events[ 'events' ][ gold_idx ][ 'end' ] > system_event[ 'begin' ] ) ] )
+
+
+def add_count( counts , key , column , increment = 1 ):
+    ## counts are [ NT , NP , TP ] by ( event type , argument , subtype )
+    if( key not in counts ):
+        counts[ key ] = [ 0 , 0 , 0 ]
+    counts[ key ][ column ] += increment
+
+
+def add_event_counts( counts , event , column ):
+    add_count( counts , ( event[ 'type' ] , 'Trigger' , None ) , column )
+    for label in event[ 'arguments' ]:
+        for argument in event[ 'arguments' ][ label ]:
+            add_count( counts , ( event[ 'type' ] , label , argument[ 3 ] ) , column )
+
+
+def score_document( gold_index , system_index , args ):
+    """Count the reference (NT), system (NP), and matched (TP) triggers
+    and arguments of a single note.  Every system event is aligned with
+    at most one unaligned reference event of the same type with a
+    matching trigger, preferring the one that shares the most
+    arguments (and then the closest one).  Arguments only count as
+    matched within aligned events."""
+    counts = {}
+    for event_type in gold_index:
+        for gold_event in gold_index[ event_type ][ 'events' ]:
+            add_event_counts( counts , gold_event , 0 )
+    for event_type in system_index:
+        aligned = set()
+        for system_event in system_index[ event_type ][ 'events' ]:
+            add_event_counts( counts , system_event , 1 )
+            best_idx = None
+            best_matches = None
+            best_rank = None
+            for gold_idx in trigger_candidates( gold_index , system_event , args.score_trigger ):
+                if( gold_idx in aligned ):
+                    continue
+                gold_event = gold_index[ event_type ][ 'events' ][ gold_idx ]
+                matches = align_arguments( gold_event , system_event , args )
+                rank = ( len( matches ) ,
+                         - abs( gold_event[ 'begin' ] - system_event[ 'begin' ] ) )
+                if( best_rank is None or rank > best_rank ):
+                    best_idx , best_matches , best_rank = gold_idx , matches , rank
+            if( best_idx is None ):
+                continue
+            aligned.add( best_idx )
+            add_count( counts , ( event_type , 'Trigger' , None ) , 2 )
+            for label , subtype in best_matches:
+                add_count( counts , ( event_type , label , subtype ) , 2 )
+    return( counts )
+
+
+def score_file( plain_filename , args ):
+    return( score_document( index_ann_file( os.path.join( args.gold_root ,
+                                                          '{}.ann'.format( plain_filename ) ) ) ,
+                            index_ann_file( os.path.join( args.system_root ,
+                                                          '{}.ann'.format( plain_filename ) ) ) ,
+                            args ) )
+
+
+## args is inherited by forked workers or passed to init_worker by
+## any other start method (e.g., spawn)
+shared_state = {}
+
+def init_worker( args ):
+    shared_state[ 'args' ] = args
+
+
+def score_file_in_worker( plain_filename ):
+    return( score_file( plain_filename , shared_state[ 'args' ] ) )
+
+#############################################
+## reporting
+#############################################
+
+def prf( nt , np , tp ):
+    precision = tp / np if np > 0 else 0.0
+    recall = tp / nt if nt > 0 else 0.0
+    f1 = 2 * tp / ( nt + np ) if nt + np > 0 else 0.0
+    return( precision , recall , f1 )
+
+
+def score_rows( counts , detailed ):
+    """One row ( event , argument , subtype , NT , NP , TP , P , R , F1 )
+    per event type and argument (and subtype when detailed) followed by
+    a micro-averaged OVERALL row.  Triggers come first within each
+    event type."""
+    rows = {}
+    overall = [ 0 , 0 , 0 ]
+    for event_type , label , subtype in counts:
+        key = ( event_type , label , subtype if detailed else None )
+        if( key not in rows ):
+            rows[ key ] = [ 0 , 0 , 0 ]
+        for column in range( 3 ):
+            rows[ key ][ column ] += counts[ ( event_type , label , subtype ) ][ column ]
+            overall[ column ] += counts[ ( event_type , label , subtype ) ][ column ]
+    ordered = []
+    for event_type , label , subtype in sorted( rows ,
+                                                key = lambda key : ( key[ 0 ] ,
+                                                                     key[ 1 ] != 'Trigger' ,
+                                                                     key[ 1 ] ,
+                                                                     key[ 2 ] or '' ) ):
+        nt , np , tp = rows[ ( event_type , label , subtype ) ]
+        ordered.append( [ event_type , label , subtype , nt , np , tp ] +
+                        list( prf( nt , np , tp ) ) )
+    ordered.append( [ 'OVERALL' , 'OVERALL' , None ] + overall + list( prf( *overall ) ) )
+    return( ordered )
+
+
+def print_rows( rows ):
+    print( '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}'.format( 'Event' , 'Argument' , 'Subtype' ,
+                                                        'NT' , 'NP' , 'TP' ,
+                                                        'P' , 'R' , 'F1' ) )
+    for event_type , label , subtype , nt , np , tp , precision , recall , f1 in rows:
+        print( '{}\t{}\t{}\t{}\t{}\t{}\t{:.3f}\t{:.3f}\t{:.3f}'.format( event_type , label ,
+                                                                        subtype or '' ,
+                                                                        nt , np , tp ,
+                                                                        precision , recall , f1 ) )
+
+
+def write_rows( output_file , rows ):
+    with open( output_file , 'w' , newline = '' ) as fp:
+        writer = csv.writer( fp )
+        writer.writerow( [ 'event' , 'argument' , 'subtype' ,
+                           'NT' , 'NP' , 'TP' , 'P' , 'R' , 'F1' ] )
+        for row in rows:
+            writer.writerow( row[ 0:2 ] + [ row[ 2 ] or '' ] + row[ 3:6 ] +
+                             [ '{:.4f}'.format( score ) for score in row[ 6: ] ] )
+
+
+def main( command_line_args = None ):
+    ##
+    args = init_args( command_line_args )
+    ##
+    gold_files = set( [ os.path.basename( ann_path )[ 0:-4 ]
+                        for ann_path in glob.glob( os.path.join( args.gold_root , '*.ann' ) ) ] )
+    system_files = set( [ os.path.basename( ann_path )[ 0:-4 ]
+                          for ann_path in glob.glob( os.path.join( args.system_root , '*.ann' ) ) ] )
+    if( len( gold_files - system_files ) > 0 ):
+        log.warning( 'No system output for {} reference file(s).  Scoring them as empty.'.format( len( gold_files - system_files ) ) )
+    if( len( system_files - gold_files ) > 0 ):
+        log.warning( 'No reference file for {} system file(s).  Scoring them against an empty reference.'.format( len( system_files - gold_files ) ) )
+    jobs = sorted( gold_files | system_files )
+    ##
+    counts = {}
+    if( args.workers > 1 ):
+        if( 'fork' in multiprocessing.get_all_start_methods() ):
+            mp_context = multiprocessing.get_context( 'fork' )
+        else:
+            mp_context = multiprocessing.get_context()
+        pool = mp_context.Pool( processes = args.workers ,
+                                initializer = init_worker ,
+                                initargs = ( args , ) )
+        results = pool.imap_unordered( score_file_in_worker , jobs ,
+                                       chunksize = 64 )
+    else:
+        pool = None
+        init_worker( args )
+        results = map( score_file_in_worker , jobs )
+    try:
+        for file_counts in progress( results ,
+                                     total = len( jobs ) ,
+                                     file = args.progressbar_file ,
+                                     disable = args.progressbar_disabled ):
+            for key in file_counts:
+                for column in range( 3 ):
+                    add_count( counts , key , column , file_counts[ key ][ column ] )
+    finally:
+        if( pool is not None ):
+            pool.close()
+            pool.join()
+    ##
+    rows = score_rows( counts , args.detailed )
+    print_rows( rows )
+    if( args.output_file is not None ):
+        write_rows( args.output_file , rows )
+
+
+if __name__ == "__main__":
+    main()
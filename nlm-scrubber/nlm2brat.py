@@ -5,14 +5,22 @@ import configparser
 
 import os
 import sys
-from shutil import copyfile
+from shutil import copy2
 
 import glob
+from itertools import groupby
 
-from tqdm import tqdm
+import multiprocessing
 
 import re
 
+sys.path.insert( 0 , os.path.join( os.path.dirname( os.path.abspath( __file__ ) ) , '..' ) )
+from corpus_utils.brat import BratWriter
+from corpus_utils.profiling import add_profile_arguments , init_profiler , NullProfiler
+from corpus_utils.metrics import add_metrics_arguments , init_metrics , file_bytes , run_timed
+from corpus_utils.lazy import progress
+from corpus_utils.options import add_progressbar_arguments , add_workers_arguments , init_progressbar
+
 def initialize_arg_parser():
     parser = argparse.ArgumentParser( description = """
 Stand-alone version of Jupyter notebook
@@ -33,6 +41,28 @@ Stand-alone version of Jupyter notebook
                          dest = 'output_dir' ,
                          help = 'Directory to write the .txt and .ann files to' )
     ##
+    add_progressbar_arguments( parser )
+    ##
+    add_workers_arguments( parser , 'align files' )
+    ##
+    parser.add_argument( '--manifest' , default = None ,
+                         dest = 'manifest_file' ,
+                         help = 'Tab-delimited list of finished files used to resume interrupted runs (Default:  .nlm2brat_manifest.tsv in the output directory)' )
+    ##
+    parser.add_argument( '--no-resume' ,
+                         dest = 'no_resume' ,
+                         help = 'Ignore (and overwrite) the manifest of a previous run and process every file' ,
+                         action = "store_true" )
+    ##
+    parser.add_argument( '--link-mode' ,
+                         dest = 'link_mode' ,
+                         default = 'auto' ,
+                         choices = [ 'auto' , 'reflink' , 'hardlink' , 'copy' ] ,
+                         help = "How to put the raw .txt files into the output directory. 'auto' tries a reflink, then a hard link, and then falls back to copying" )
+
+    add_profile_arguments( parser )
+    add_metrics_arguments( parser )
+    ##
     return parser
 
 
@@ -42,9 +72,9 @@ def get_arguments( command_line_args ):
     return args
 
 
-def init_args():
+def init_args( command_line_args = None ):
     ##
-    args = get_arguments( sys.argv[ 1: ] )
+    args = get_arguments( command_line_args )
     ## Set up logging
     log.basicConfig()
     formatter = log.Formatter( '%(asctime)s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s' )
@@ -52,155 +82,395 @@ def init_args():
     if args.verbose:
         log.getLogger().setLevel( log.DEBUG )
         log.info( "Verbose output." )
+    ## Configure progressbar peformance
+    init_progressbar( args )
+    ##
+    if( args.manifest_file is None ):
+        args.manifest_file = os.path.join( args.output_dir ,
+                                           '.nlm2brat_manifest.tsv' )
     return args
 
 
-def extract_tag_types( txt , tag_types , start_pos , pos ):
-    while( txt[ pos ] != ']' ):
-        pos += 1
-    pos += 1
-    ##log.info( '{}|{}|{}'.format( start_pos , txt[ ( start_pos + 1 ):( pos - 1 ) ] , pos ) )
-    tag_types.add( txt[ ( start_pos + 1 ):( pos - 1 ) ] )
-    if( txt[ pos ] in [ ' ' , '\r' , '\n' ] and
-        txt[ pos + 1 ] == '[' ):
-        tag_types , pos = extract_tag_types( txt , tag_types , pos + 1 , pos + 1 )
-    return( tag_types , pos )
+## A run of stacked tags that we can't tell apart in the raw text.
+## Tags are stacked when they are only separated by nothing
+## ([ANNOT][ANNOT]), a single space ([ANNOT] [ANNOT]), or a single
+## character and a newline ([ANNOT]\n\n[ANNOT]).  Runs can be any
+## length.
+tag_re = re.compile( r'\[([A-Z0-9]+\+?)\]' )
+tag_group_re = re.compile( r'\[[A-Z0-9]+\+?\](?:(?: |[\s\S]\n)?\[[A-Z0-9]+\+?\])*' )
 
 
-def align_files( raw_file , processed_file , ann_file ):
-    with open( raw_file , 'r' ) as fp:
-        raw_txt = fp.read()
-    with open( processed_file , 'r' ) as fp:
-        proc_txt = fp.read()
-    if( os.path.exists( ann_file ) ):
-        os.remove( ann_file )
-    raw_pos = 0
-    proc_pos = 0
-    ## Adjust for newlines and trailing whitespace
-    max_raw_pos = len( raw_txt.rstrip() )
-    ## Find the start of the post-text metadata
-    max_proc_pos = re.search( '##### DOCUMENT #############################################################' , proc_txt ).span()[ 0 ]
-    max_proc_txt = proc_txt[ :max_proc_pos ]
-    ## Adjust for newlines and trailing whitespace
-    max_proc_pos = len( max_proc_txt.rstrip() )
+def find_tag_groups( proc_txt , max_proc_pos ):
+    """List every [TAG] in the processed text (ignoring the post-text
+    metadata) with its processed offsets.  Every tag in a run of
+    stacked tags gets the same 'group' number."""
     annot_list = []
-    annotation_count = 0
-    matches = re.finditer( r'\[[A-Z0-9]+\+?\]' , proc_txt )
-    for match in matches:
-        annot = dict()
-        annotation_count += 1
-        annot[ 'id' ] = 'T{}'.format( annotation_count )
-        annot[ 'tag' ] = match.group()[ 1:-1 ]
-        annot[ 'start_offset_proc' ] = match.start()
-        annot[ 'end_offset_proc' ] = match.end()
-        annot_list.append( annot )
-    i = 0
-    merge_flag = False
-    while( i < len( annot_list ) ):
-        annot = annot_list[ i ]
-        ################################################################
-        ## For the first annotation in a document, the raw and processed
-        ## first annotation begins at the same point
-        if( i == 0 ):
-            annot[ 'start_offset_raw' ] = annot[ 'start_offset_proc' ]
+    for group_idx , group_match in enumerate( tag_group_re.finditer( proc_txt , 0 , max_proc_pos ) ):
+        for match in tag_re.finditer( proc_txt , group_match.start() , group_match.end() ):
+            annot = dict()
+            annot[ 'id' ] = 'T{}'.format( len( annot_list ) + 1 )
+            annot[ 'tag' ] = match.group( 1 )
+            annot[ 'group' ] = group_idx
+            annot[ 'start_offset_proc' ] = match.start()
+            annot[ 'end_offset_proc' ] = match.end()
+            annot_list.append( annot )
+    return( annot_list )
+
+
+## Runs of blank lines in the processed text that we try to split the
+## document on
+anchor_re = re.compile( r'(?:\r?\n){2,}' )
+
+
+def find_anchors( raw_txt , proc_txt , annot_list ,
+                  max_raw_pos , max_proc_pos , context_width = 32 ):
+    """Find the runs of blank lines that show up in both files so we can
+    align the chunks between them independently of each other.  Only
+    blank lines surrounded by literal text (at least one character away
+    from any tag) are candidates.  Each candidate is located in the raw
+    text by searching forward for the literal text around it (up to
+    context_width characters on either side), starting no earlier than
+    the literal text since the last anchor allows.  Candidates we can't
+    find are dropped, which merges the chunks on either side of them.
+    Returns a list of ( proc_offset , raw_offset ) pairs for the start of
+    each anchor."""
+    anchors = []
+    tag_idx = 0
+    prev_tag_end = None
+    prev_anchor_proc = 0
+    prev_anchor_raw = 0
+    ## Characters in the processed text since the last anchor that
+    ## might not be in the raw text (the tags plus a newline each)
+    tag_chars = 0
+    for match in anchor_re.finditer( proc_txt , 0 , max_proc_pos ):
+        while( tag_idx < len( annot_list ) and
+               annot_list[ tag_idx ][ 'end_offset_proc' ] <= match.start() ):
+            prev_tag_end = annot_list[ tag_idx ][ 'end_offset_proc' ]
+            tag_chars += prev_tag_end - annot_list[ tag_idx ][ 'start_offset_proc' ] + 1
+            tag_idx += 1
+        ## Characters right next to a tag may have been added by the
+        ## scrubber so they can't be part of the context
+        lower = prev_anchor_proc
+        if( prev_tag_end is not None ):
+            lower = max( lower , prev_tag_end + 1 )
+        if( tag_idx < len( annot_list ) ):
+            upper = annot_list[ tag_idx ][ 'start_offset_proc' ] - 1
         else:
-            ## Otherwise, we can calculate the raw offset of the current
-            ## annotation based
-            prev_start_raw = annot_list[ i - 1 ][ 'start_offset_raw' ]
-            prev_start_proc = annot_list[ i - 1 ][ 'start_offset_proc' ]
-            prev_end_raw = annot_list[ i - 1 ][ 'end_offset_raw' ]
-            prev_end_proc = annot_list[ i - 1 ][ 'end_offset_proc' ]
-            ## TODO - deal with 3 in a row
-            if( i > 0 and
-                ## [ANNOT][ANNOT]
-                ( annot[ 'start_offset_proc' ] == annot_list[ i - 1 ][ 'end_offset_proc' ] or
-                  ## [ANNOT] [ANNOT]
-                  ( proc_txt[ annot[ 'start_offset_proc' ] - 1 ] == ' ' and
-                    annot[ 'start_offset_proc' ] - 1 == annot_list[ i - 1 ][ 'end_offset_proc' ] ) or
-                  ## [ANNOT]\n\n[ANNOT]
-                  ( proc_txt[ annot[ 'start_offset_proc' ] - 1 ] == '\n' and
-                    annot[ 'start_offset_proc' ] - 2 == annot_list[ i - 1 ][ 'end_offset_proc' ] ) ) ):
-                log.info( 'Merging this annotation with previous annotation' )
-                annot[ 'start_offset_raw' ] = prev_start_raw
-                merge_flag = True
-            else:
-                annot[ 'start_offset_raw' ] = prev_end_raw + ( annot[ 'start_offset_proc' ] - prev_end_proc )
-        ################################################################
-        ## Next, we need to calculate the end offset in the
-        ## raw document.
-        ##log.info( '{}'.format( annot ) )
-        if( annot[ 'end_offset_proc' ] == max_proc_pos ):
+            upper = max_proc_pos
+        if( match.start() <= lower or match.end() >= upper ):
+            continue
+        context_start = max( lower , match.start() - context_width )
+        context_end = min( upper , match.end() + context_width )
+        search_start = max( prev_anchor_raw ,
+                            prev_anchor_raw + ( context_start - prev_anchor_proc ) - tag_chars )
+        context_raw = raw_txt.find( proc_txt[ context_start:context_end ] ,
+                                    search_start , max_raw_pos )
+        if( context_raw < 0 ):
+            log.debug( 'Unable to find the anchor at {} in the raw file'.format( match.start() ) )
+            continue
+        anchor_raw = context_raw + ( match.start() - context_start )
+        anchors.append( ( match.start() , anchor_raw ) )
+        prev_anchor_proc = match.end()
+        prev_anchor_raw = anchor_raw + ( match.end() - match.start() )
+        tag_chars = 0
+    return( anchors )
+
+
+def align_chunk( raw_txt , proc_txt , annot_list ,
+                 chunk_start , chunk_end , is_last ):
+    """Align the annotations in a single chunk.  Returns the aligned
+    annotations and whether the chunk lined up with its end anchor.  A
+    chunk lines up when every annotation was aligned and the literal
+    text after the last one ends right at the anchor (or, for chunks
+    without annotations, when the chunk is the same length in both
+    files).  The last chunk has no anchor to check against."""
+    proc_start , raw_start = chunk_start
+    proc_end , raw_end = chunk_end
+    ## Work on copies so that a failed attempt doesn't leave offsets behind
+    chunk_annots = [ dict( annot ) for annot in annot_list ]
+    aligned_list = align_annotations( raw_txt , proc_txt , chunk_annots ,
+                                      raw_end , proc_end ,
+                                      raw_pos = raw_start ,
+                                      proc_pos = proc_start )
+    if( is_last ):
+        return( aligned_list , True )
+    if( len( aligned_list ) < len( chunk_annots ) ):
+        return( aligned_list , False )
+    if( len( aligned_list ) == 0 ):
+        return( aligned_list ,
+                raw_end - raw_start == proc_end - proc_start )
+    last_annot = aligned_list[ -1 ]
+    return( aligned_list ,
+            last_annot[ 'end_offset_raw' ] + ( proc_end - last_annot[ 'end_offset_proc' ] ) == raw_end )
+
+
+def align_chunks( raw_txt , proc_txt , annot_list ,
+                  max_raw_pos , max_proc_pos ):
+    """Split both files at the blank lines they share and align each
+    chunk on its own so a misalignment can't spill over into the rest of
+    the document.  When a chunk doesn't line up with its end anchor, we
+    assume the anchor was misplaced and retry with the chunk merged into
+    the next one.  If that doesn't line up either, the problem is in the
+    text itself so we keep whatever we could align in the original chunk
+    and carry on from its end anchor."""
+    anchors = find_anchors( raw_txt , proc_txt , annot_list ,
+                            max_raw_pos , max_proc_pos )
+    chunk_ends = anchors + [ ( max_proc_pos , max_raw_pos ) ]
+    aligned_list = []
+    chunk_start = ( 0 , 0 )
+    tag_idx = 0
+    chunk_idx = 0
+    while( chunk_idx < len( chunk_ends ) ):
+        ## Grab the tags up to the end of this chunk and the next one
+        chunk_tag_idx = tag_idx
+        while( chunk_tag_idx < len( annot_list ) and
+               annot_list[ chunk_tag_idx ][ 'start_offset_proc' ] < chunk_ends[ chunk_idx ][ 0 ] ):
+            chunk_tag_idx += 1
+        chunk_aligned , lined_up = align_chunk( raw_txt , proc_txt ,
+                                                annot_list[ tag_idx:chunk_tag_idx ] ,
+                                                chunk_start , chunk_ends[ chunk_idx ] ,
+                                                chunk_idx + 1 == len( chunk_ends ) )
+        if( not lined_up ):
+            merged_tag_idx = chunk_tag_idx
+            while( merged_tag_idx < len( annot_list ) and
+                   annot_list[ merged_tag_idx ][ 'start_offset_proc' ] < chunk_ends[ chunk_idx + 1 ][ 0 ] ):
+                merged_tag_idx += 1
+            merged_aligned , merged_lined_up = align_chunk( raw_txt , proc_txt ,
+                                                            annot_list[ tag_idx:merged_tag_idx ] ,
+                                                            chunk_start , chunk_ends[ chunk_idx + 1 ] ,
+                                                            chunk_idx + 2 == len( chunk_ends ) )
+            if( merged_lined_up ):
+                chunk_aligned = merged_aligned
+                chunk_tag_idx = merged_tag_idx
+                chunk_idx += 1
+        if( len( chunk_aligned ) < chunk_tag_idx - tag_idx ):
+            log.warning( 'Unable to find the text following {} in the raw file. Skipping the remaining {} annotations in this chunk.'.format( annot_list[ tag_idx + len( chunk_aligned ) ][ 'id' ] ,
+                                                                                                                                         chunk_tag_idx - tag_idx - len( chunk_aligned ) ) )
+        aligned_list.extend( chunk_aligned )
+        chunk_start = chunk_ends[ chunk_idx ]
+        tag_idx = chunk_tag_idx
+        chunk_idx += 1
+    return( aligned_list )
+
+
+def align_annotations( raw_txt , proc_txt , annot_list ,
+                       max_raw_pos , max_proc_pos ,
+                       raw_pos = 0 , proc_pos = 0 ):
+    """Fill in the raw offsets and text for every annotation.
+
+    The raw and processed text are walked forward together.  Text
+    between tags is the same in both files so it moves both pointers by
+    the same amount.  The end of each group of tags in the raw text is
+    wherever the literal text following the group (up to the next tag
+    or the end of the document) shows up next.  Every search starts at
+    the current raw pointer, and the pointer never moves backwards, so
+    each file is scanned once.  Every annotation in a group gets the
+    span of the whole group.  Returns the annotations that were aligned
+    (everything before the first group we can't find in the raw text).
+
+    raw_pos/proc_pos and max_raw_pos/max_proc_pos bound the chunk of
+    the files to align, which is the whole document by default."""
+    groups = [ list( group ) for group_idx , group in groupby( annot_list ,
+                                                             key = lambda annot : annot[ 'group' ] ) ]
+    aligned_list = []
+    for group_idx , group in enumerate( groups ):
+        group_start_proc = group[ 0 ][ 'start_offset_proc' ]
+        group_end_proc = group[ -1 ][ 'end_offset_proc' ]
+        ## The literal text before this group is identical in both files
+        start_raw = raw_pos + ( group_start_proc - proc_pos )
+        if( group_end_proc == max_proc_pos ):
             ## If we're at the end of the document, we don't have to
             ## do anything clever to figure out the end offset
-            annot[ 'end_offset_raw' ] = max_raw_pos
-        elif( i + 1 < len( annot_list ) and
-              ## [ANNOT][ANNOT]
-              ( annot[ 'end_offset_proc' ] == annot_list[ i + 1 ][ 'start_offset_proc' ] or
-                ## [ANNOT] [ANNOT]
-                ( proc_txt[ annot[ 'end_offset_proc' ] ] == ' ' and
-                  annot[ 'end_offset_proc' ] + 1 == annot_list[ i + 1 ][ 'start_offset_proc' ] ) ) ):
-            ## If we're immediately followed by another annotation,
-            ## then merge the two annotations since we can't distinguish
-            ## between them reliably.
-            log.info( 'Merging this annotation with next annotation' )
-            annot[ 'end_offset_raw' ] = None
+            end_raw = max_raw_pos
+            next_span = ''
         else:
             ## Otherwise, grab the span of text between the end of this
-            ## annotation and the start of the next annotation (or the
-            ## end of the document).  Use that to figure out how wide
-            ## the original annotation was.
-            if( i + 1 < len( annot_list ) ):
-                next_span = proc_txt[ annot[ 'end_offset_proc' ]:annot_list[ i + 1 ][ 'start_offset_proc' ] ]
+            ## group and the start of the next group (or the end of the
+            ## document).  Use that to figure out how wide the original
+            ## annotation was.
+            if( group_idx + 1 < len( groups ) ):
+                next_span = proc_txt[ group_end_proc:groups[ group_idx + 1 ][ 0 ][ 'start_offset_proc' ] ]
             else:
-                next_span = proc_txt[ annot[ 'end_offset_proc' ]:max_proc_pos ]
+                next_span = proc_txt[ group_end_proc:max_proc_pos ]
+            search_span = next_span
             ## Newlines are introduced prior to a tag when the annotation
             ## spans multiple lines. However, sometimes, the following span
             ## is *only* whitespace, in which case, we need to preserve it.
-            if( re.search( r'[^\n\r][\n\r]$' , next_span , re.MULTILINE | re.DOTALL ) ):
-                log.info( 'Stripping final newline in next_span' )
-                next_span = re.sub( r'[\n\r]$' , "" , next_span )
-            ##
-            next_span_match = re.search( re.escape( next_span ) ,
-                                         raw_txt[ annot[ 'start_offset_raw' ]: ] , 
-                                         re.MULTILINE )
-            annot[ 'end_offset_raw' ] = annot[ 'start_offset_raw' ] + next_span_match.start()
-        ##
-        if( annot[ 'end_offset_raw' ] is None ):
-            annot[ 'text' ] = '(see next)'
-        else:
-            annot[ 'text' ] = raw_txt[ annot[ 'start_offset_raw' ]:annot[ 'end_offset_raw' ] ]
-        if( merge_flag ):
-            merge_flag = False
-            annot_list[ i - 1 ][ 'end_offset_raw' ] = annot[ 'end_offset_raw' ]
-            annot_list[ i - 1 ][ 'text' ] = annot[ 'text' ]
-        ## Loop back around
-        i += 1
+            if( re.search( r'[^\n\r][\n\r]$' , search_span , re.MULTILINE | re.DOTALL ) ):
+                log.debug( 'Stripping final newline in next_span' )
+                search_span = re.sub( r'[\n\r]$' , "" , search_span )
+            end_raw = raw_txt.find( search_span , start_raw , max_raw_pos )
+            if( end_raw < 0 ):
+                log.debug( 'Unable to find the text following {} in the raw file. Skipping the remaining {} annotations.'.format( group[ 0 ][ 'id' ] ,
+                                                                                                                                  len( annot_list ) - len( aligned_list ) ) )
+                break
+        text = raw_txt[ start_raw:end_raw ]
+        for annot in group:
+            annot[ 'start_offset_raw' ] = start_raw
+            annot[ 'end_offset_raw' ] = end_raw
+            annot[ 'text' ] = text
+            aligned_list.append( annot )
+        raw_pos = end_raw + len( next_span )
+        proc_pos = group_end_proc + len( next_span )
+    return( aligned_list )
+
+
+def load_pair( raw_file , processed_file ):
+    """Read a raw file and its NLM-Scrubber output along with the end
+    of the note text in each (ignoring trailing whitespace and the
+    post-text metadata)"""
+    with open( raw_file , 'r' ) as fp:
+        raw_txt = fp.read()
+    with open( processed_file , 'r' ) as fp:
+        proc_txt = fp.read()
+    ## Adjust for newlines and trailing whitespace
+    max_raw_pos = len( raw_txt.rstrip() )
+    ## Find the start of the post-text metadata
+    metadata_match = re.search( '##### DOCUMENT #############################################################' , proc_txt )
+    if( metadata_match is None ):
+        max_proc_txt = proc_txt
+    else:
+        max_proc_txt = proc_txt[ :metadata_match.start() ]
+    ## Adjust for newlines and trailing whitespace
+    max_proc_pos = len( max_proc_txt.rstrip() )
+    return( raw_txt , proc_txt , max_raw_pos , max_proc_pos )
+
+
+def write_annotations( annot_list , ann_file ):
+    brat_writer = BratWriter( ann_file )
+    for annot in annot_list:
+        ## Convert newlines and carriage returns into the string "\n" for printing
+        pii_str = re.sub( r'[\n\r]+' , "\\\\n" , annot[ 'text' ] )
+        brat_writer.add_text_bound( annot[ 'tag' ] ,
+                                    [ ( annot[ 'start_offset_raw' ] ,
+                                        annot[ 'end_offset_raw' ] ) ] ,
+                                    pii_str ,
+                                    annot_id = annot[ 'id' ] )
+    brat_writer.flush()
+
+
+def align_files( raw_file , processed_file , ann_file , profiler = None ):
+    if( profiler is None ):
+        profiler = NullProfiler()
+    document = os.path.basename( raw_file )
+    with profiler.stage( 'read' , document ):
+        raw_txt , proc_txt , max_raw_pos , max_proc_pos = load_pair( raw_file ,
+                                                                     processed_file )
+    if( os.path.exists( ann_file ) ):
+        os.remove( ann_file )
+    with profiler.stage( 'parse' , document ):
+        annot_list = find_tag_groups( proc_txt , max_proc_pos )
+    with profiler.stage( 'build' , document ):
+        annot_list = align_chunks( raw_txt , proc_txt , annot_list ,
+                                   max_raw_pos , max_proc_pos )
     ####################################################################
     ## Write the extracted annotations to disk.
-    with open( ann_file , 'w' ) as fp:
-        for annot in annot_list:
-            ## Convert newlines and carriage returns into the string "\n" for printing
-            pii_str = re.sub( r'[\n\r]+' , "\\\\n" , annot[ 'text' ] )
-            if( False ):
-                print( '{}\t{} {} {}\t{}'.format( annot[ 'id' ] ,
-                                                  annot[ 'tag' ] ,
-                                                  annot[ 'start_offset_raw' ] ,
-                                                  annot[ 'end_offset_raw' ] ,
-                                                  pii_str ) )##annot[ 'text' ] ) )
-            ##
-            fp.write( '{}\t{} {} {}\t{}\n'.format( annot[ 'id' ] ,
-                                                   annot[ 'tag' ] ,
-                                                   annot[ 'start_offset_raw' ] ,
-                                                   annot[ 'end_offset_raw' ] ,
-                                                   pii_str ) )##annot[ 'text' ] ) )
+    with profiler.stage( 'write' , document ):
+        write_annotations( annot_list , ann_file )
+    return( len( annot_list ) )
 
+## From linux/fs.h
+FICLONE = 0x40049409
 
-if __name__ == "__main__":
+def reflink( src , dst ):
+    import fcntl
+    with open( src , 'rb' ) as src_fp:
+        with open( dst , 'wb' ) as dst_fp:
+            try:
+                fcntl.ioctl( dst_fp.fileno() , FICLONE , src_fp.fileno() )
+            except OSError:
+                dst_fp.close()
+                os.remove( dst )
+                raise
+
+
+def link_or_copy( src , dst , link_mode = 'auto' ):
+    """Put src at dst without copying the contents when the filesystem
+    lets us.  Returns the method used or 'up-to-date' if dst already
+    matches src."""
+    if( os.path.exists( dst ) ):
+        src_stat = os.stat( src )
+        dst_stat = os.stat( dst )
+        if( os.path.samestat( src_stat , dst_stat ) or
+            ( src_stat.st_size == dst_stat.st_size and
+              src_stat.st_mtime_ns == dst_stat.st_mtime_ns ) ):
+            return( 'up-to-date' )
+        os.remove( dst )
+    if( link_mode in [ 'auto' , 'reflink' ] ):
+        try:
+            reflink( src , dst )
+            return( 'reflink' )
+        except ( ImportError , OSError ):
+            if( link_mode == 'reflink' ):
+                raise
+    if( link_mode in [ 'auto' , 'hardlink' ] ):
+        try:
+            os.link( src , dst )
+            return( 'hardlink' )
+        except OSError:
+            if( link_mode == 'hardlink' ):
+                raise
+    ## copy2 keeps the mtime so the next run sees the copy as up-to-date
+    copy2( src , dst )
+    return( 'copy' )
+
+
+def file_signature( raw_file , nphi_file ):
+    raw_stat = os.stat( raw_file )
+    nphi_stat = os.stat( nphi_file )
+    return( '{}:{}:{}:{}'.format( raw_stat.st_size , raw_stat.st_mtime_ns ,
+                                  nphi_stat.st_size , nphi_stat.st_mtime_ns ) )
+
+
+def load_manifest( manifest_file ):
+    finished = {}
+    if( os.path.exists( manifest_file ) ):
+        with open( manifest_file , 'r' ) as fp:
+            for line in fp:
+                cols = line.rstrip( '\n' ).split( '\t' )
+                if( len( cols ) == 2 ):
+                    finished[ cols[ 0 ] ] = cols[ 1 ]
+    return( finished )
+
+
+def process_file( job , profiler = None ):
+    if( profiler is None ):
+        profiler = NullProfiler()
+    this_filename , raw_dir , nphi_file , output_dir , link_mode = job
+    file_root = re.sub( r'.txt$' , '' , this_filename )
+    raw_file = os.path.join( raw_dir , this_filename )
+    ann_file = os.path.join( output_dir , '{}.ann'.format( file_root ) )
+    with profiler.stage( 'write' , this_filename ):
+        link_or_copy( raw_file ,
+                      os.path.join( output_dir , this_filename ) ,
+                      link_mode = link_mode )
+    annotation_count = align_files( raw_file ,
+                                    nphi_file ,
+                                    ann_file ,
+                                    profiler = profiler )
+    return( this_filename , annotation_count )
+
+
+def process_file_in_worker( job ):
+    return( run_timed( process_file , job ) )
+
+
+def main( command_line_args = None ):
+    ##
+    args = init_args( command_line_args )
+    profiler = init_profiler( args )
+    with profiler.stage( 'discover' ):
+        file_list = set( [os.path.basename(x) for x in glob.glob( '{}/*.txt'.format( args.raw_dir ) ) ] )
     ##
-    args = init_args()
-    file_list = set( [os.path.basename(x) for x in glob.glob( '{}/*.txt'.format( args.raw_dir ) ) ] )
+    if( args.no_resume ):
+        finished = {}
+    else:
+        finished = load_manifest( args.manifest_file )
     ##########################
-    for this_filename in tqdm( sorted( file_list ) , total = len( file_list ) ):
+    jobs = []
+    signatures = {}
+    input_bytes = {}
+    for this_filename in sorted( file_list ):
         file_root = re.sub( r'.txt$' , '' , this_filename )
         raw_file = '{}/{}'.format( args.raw_dir , this_filename )
         nphi_file = '{}/{}.nphi.txt'.format( args.proc_dir , file_root )
@@ -209,12 +479,52 @@ if __name__ == "__main__":
         if( not os.path.exists( nphi_file ) ):
             log.warn( 'Processed analog (.nphi.txt) to raw file ({}) missing'.format( this_filename ) )
             continue
+        signatures[ this_filename ] = file_signature( raw_file , nphi_file )
+        if( finished.get( this_filename ) == signatures[ this_filename ] and
+            os.path.exists( ann_file ) ):
+            log.debug( 'Skipping finished file:  {}'.format( this_filename ) )
+            continue
+        jobs.append( ( this_filename , args.raw_dir , nphi_file ,
+                       args.output_dir , args.link_mode ) )
+        input_bytes[ this_filename ] = file_bytes( raw_file , nphi_file )
+    log.info( '{} of {} files left to align'.format( len( jobs ) , len( file_list ) ) )
+    ##########################
+    ## Each file is recorded in the manifest as soon as it finishes
+    manifest_mode = 'w' if args.no_resume else 'a'
+    metrics = init_metrics( args , len( jobs ) , sum( input_bytes.values() ) ,
+                            start = False )
+    with open( args.manifest_file , manifest_mode ) as manifest_fp:
+        if( args.workers > 1 ):
+            with multiprocessing.Pool( processes = args.workers ) as pool:
+                ## Only start the heartbeat once the workers are forked
+                metrics.start()
+                results = pool.imap_unordered( process_file_in_worker , jobs , chunksize = 8 )
+                for ( this_filename , annotation_count ) , worker , busy_seconds in progress( results ,
+                                                                                              total = len( jobs ) ,
+                                                                                              file = args.progressbar_file ,
+                                                                                              disable = args.progressbar_disabled ):
+                    manifest_fp.write( '{}\t{}\n'.format( this_filename ,
+                                                          signatures[ this_filename ] ) )
+                    manifest_fp.flush()
+                    metrics.update( input_bytes[ this_filename ] , annotation_count ,
+                                    worker = worker , busy_seconds = busy_seconds )
         else:
-            log.info( '{}'.format( this_filename ) )
-        copyfile( raw_file ,
-                  '{}/{}'.format( args.output_dir , this_filename ) )
-        ## TODO - split each file into chunks with multiple newlines in between
-        ##        to simplify chunking of tags near each other
-        align_files( raw_file ,
-                     nphi_file ,
-                     ann_file )
+            metrics.start()
+            for job in progress( jobs ,
+                                 file = args.progressbar_file ,
+                                 disable = args.progressbar_disabled ):
+                log.info( '{}'.format( job[ 0 ] ) )
+                ( this_filename , annotation_count ) , worker , busy_seconds = run_timed( process_file , job ,
+                                                                                          profiler = profiler )
+                manifest_fp.write( '{}\t{}\n'.format( this_filename ,
+                                                      signatures[ this_filename ] ) )
+                manifest_fp.flush()
+                metrics.update( input_bytes[ this_filename ] , annotation_count ,
+                                worker = worker , busy_seconds = busy_seconds )
+    metrics.close()
+    ##
+    profiler.write_report()
+
+
+if __name__ == "__main__":
+    main()